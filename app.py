@@ -1,6 +1,37 @@
+import logging
+import os
+import time
+import uuid
 import streamlit as st
 from datetime import datetime
-from source.assistant import school_assistant
+from source.feedback_store import feedback_store
+from source.instrumentation import metrics, start_metrics_server
+from source.service_client import ASSISTANT_SERVICE_URL, ServiceClient, ServiceUnavailable
+from source.session_store import CHAT_LIVE_MESSAGES, CHAT_PAGE_SIZE, deep_sizeof, session_store
+
+# Affiche la réponse token par token (STREAM_ANSWERS=0 pour revenir au spinner)
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") != "0"
+# Affiche dans la barre latérale la mémoire de la session et le temps de rendu du chat
+SESSION_STATS = os.getenv("SESSION_STATS", "0") == "1"
+
+SESSION_BYTES_BUCKETS = (1e3, 4e3, 16e3, 64e3, 256e3, 1e6, 4e6)
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+# Endpoint Prometheus /metrics (désactivé si METRICS_PORT n'est pas défini)
+if os.getenv("METRICS_PORT"):
+    start_metrics_server(int(os.getenv("METRICS_PORT")))
+
+if ASSISTANT_SERVICE_URL:
+    # Client léger : encodeur, LanceDB et watsonx vivent dans le service partagé (python -m source.service)
+    assistant_service = ServiceClient(ASSISTANT_SERVICE_URL)
+    school_assistant = assistant_service.answer
+    school_assistant_stream = assistant_service.answer_stream
+else:
+    from source.assistant import school_assistant, school_assistant_stream
+    from source.resources import warm_up
+
+    # Charge l'encodeur, LanceDB et le client watsonx en arrière-plan (une fois par processus)
+    warm_up()
 
 # Mock function - replace with actual import: from assistant import school_assistant
 
@@ -16,6 +47,11 @@ if 'conversation_closed' not in st.session_state:
 # NEW: flag pour clear l'input au prochain rerun
 if 'clear_user_input' not in st.session_state:
     st.session_state.clear_user_input = False
+# Clé de la session dans session_store (messages archivés) et messages anciens affichés
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if 'older_shown' not in st.session_state:
+    st.session_state.older_shown = 0
 
 # Page config
 st.set_page_config(page_title="HelpAI", page_icon="🎓", layout="wide")
@@ -65,6 +101,53 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+
+def message_html(role, content):
+    """HTML block of one chat message."""
+    if role == 'user':
+        return f"""
+                <div class="chat-message user-message">
+                    <div class="message-label">👤 You</div>
+                    <div class="message-content">{content}</div>
+                </div>
+                """
+    return f"""
+                <div class="chat-message bot-message">
+                    <div class="message-label">🤖 Assistant</div>
+                    <div class="message-content">{content}</div>
+                </div>
+                """
+
+
+def archive_overflow():
+    """Move the oldest messages beyond CHAT_LIVE_MESSAGES from the session state to the session store."""
+    history = st.session_state.chat_history
+    overflow = len(history) - CHAT_LIVE_MESSAGES
+    overflow += overflow % 2  # question + réponse restent ensemble
+    if overflow > 0:
+        session_store.archive(st.session_state.session_id, history[:overflow])
+        del history[:overflow]
+
+
+def full_history():
+    """Archived and live messages of the conversation, oldest first."""
+    return session_store.load(st.session_state.session_id) + st.session_state.chat_history
+
+
+def message_count():
+    return session_store.count(st.session_state.session_id) + len(st.session_state.chat_history)
+
+
+def reset_conversation():
+    session_store.drop(st.session_state.session_id)
+    st.session_state.session_id = uuid.uuid4().hex
+    st.session_state.older_shown = 0
+    st.session_state.school_selected = None
+    st.session_state.chat_history = []
+    st.session_state.show_review = False
+    st.session_state.conversation_closed = False
+
+
 # Title
 st.title("🎓 HelpAI")
 
@@ -103,25 +186,26 @@ elif not st.session_state.show_review:
     
     st.markdown("---")
     
-    # Display chat history
-    if st.session_state.chat_history:
-        for msg in st.session_state.chat_history:
-            if msg['role'] == 'user':
-                st.markdown(f"""
-                <div class="chat-message user-message">
-                    <div class="message-label">👤 You</div>
-                    <div class="message-content">{msg['content']}</div>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
-                <div class="chat-message bot-message">
-                    <div class="message-label">🤖 Assistant</div>
-                    <div class="message-content">{msg['content']}</div>
-                </div>
-                """, unsafe_allow_html=True)
-    else:
-        st.info("👋 Hello! How can I help you today?")
+    # Display chat history (dans un conteneur pour pouvoir y streamer la prochaine réponse)
+    chat_area = st.container()
+    with chat_area:
+        render_start = time.perf_counter()
+        # Messages archivés : affichés seulement à la demande, page par page
+        archived = session_store.count(st.session_state.session_id)
+        shown = min(st.session_state.older_shown, archived)
+        if shown < archived:
+            if st.button(f"⬆️ Show older messages ({archived - shown})", use_container_width=True):
+                st.session_state.older_shown = shown + CHAT_PAGE_SIZE
+                st.rerun()
+        visible = session_store.load(st.session_state.session_id, archived - shown) if shown else []
+        visible += st.session_state.chat_history
+        if visible:
+            # Un seul bloc HTML pour tout l'historique visible (un élément Streamlit au lieu d'un par message)
+            st.markdown("".join(message_html(m['role'], m['content']) for m in visible), unsafe_allow_html=True)
+        else:
+            st.info("👋 Hello! How can I help you today?")
+        st.session_state.render_s = time.perf_counter() - render_start
+        metrics.observe("helpai_chat_render_seconds", st.session_state.render_s)
     
     # Chat input area (form => Enter triggers submit)
     st.markdown("---")
@@ -155,16 +239,43 @@ elif not st.session_state.show_review:
             'timestamp': datetime.now().isoformat()
         })
 
-        # Limit context (dernier 8 messages)
-        context_slice = st.session_state.chat_history[-2:]
+        # Limit context (dernier 8 messages) : utilisé seulement si la mémoire de conversation
+        # de l'assistant ne connaît pas encore la session (résumé + derniers échanges, voir
+        # source/conversation_memory.py)
+        context_slice = st.session_state.chat_history[-8:]
 
-        # Spinner while generating
-        with st.spinner("⏳ L'assistant réfléchit..."):
-            bot_response = school_assistant(
-                question=user_input,
-                school=st.session_state.school_selected,
-                chat_history=context_slice
-            )
+        try:
+            if STREAM_ANSWERS:
+                # Streaming: la réponse s'affiche au fur et à mesure dans la zone de chat
+                with chat_area:
+                    st.markdown(message_html('user', user_input), unsafe_allow_html=True)
+                    placeholder = st.empty()
+                    placeholder.markdown(message_html('assistant', "⏳"), unsafe_allow_html=True)
+                    pieces = []
+                    timings = {}
+                    for chunk in school_assistant_stream(
+                        question=user_input,
+                        school=st.session_state.school_selected,
+                        chat_history=context_slice,
+                        timings=timings,
+                        session_id=st.session_state.session_id
+                    ):
+                        pieces.append(chunk)
+                        placeholder.markdown(message_html('assistant', "".join(pieces) + "▌"), unsafe_allow_html=True)
+                bot_response = "".join(pieces).strip()
+            else:
+                # Spinner while generating
+                with st.spinner("⏳ L'assistant réfléchit..."):
+                    bot_response = school_assistant(
+                        question=user_input,
+                        school=st.session_state.school_selected,
+                        chat_history=context_slice,
+                        session_id=st.session_state.session_id
+                    )
+        except ServiceUnavailable:
+            st.session_state.chat_history.pop()
+            st.error("⚠️ Le service de l'assistant est indisponible ou surchargé, réessayez dans un instant.")
+            st.stop()
 
         # Add assistant response
         st.session_state.chat_history.append({
@@ -173,6 +284,8 @@ elif not st.session_state.show_review:
             'timestamp': datetime.now().isoformat()
         })
 
+        archive_overflow()
+
         # Clear input au prochain rerun (ne pas modifier le widget maintenant)
         st.session_state.clear_user_input = True
         st.rerun()
@@ -211,8 +324,8 @@ else:
     # Display conversation summary
     with st.expander("📋 View Conversation Summary"):
         st.markdown(f"**School:** {st.session_state.school_selected.upper()}")
-        st.markdown(f"**Number of messages:** {len(st.session_state.chat_history)}")
-        st.markdown(f"**Duration:** {len(st.session_state.chat_history) // 2} questions")
+        st.markdown(f"**Number of messages:** {message_count()}")
+        st.markdown(f"**Duration:** {message_count() // 2} questions")
     
     col1, col2 = st.columns(2)
     
@@ -220,27 +333,27 @@ else:
         if st.button("💾 Save Review", use_container_width=True, type="primary"):
             # Prepare review data
             review_data = {
+                'review_id': st.session_state.session_id,  # un nouvel envoi remplace l'avis de la session
                 'school': st.session_state.school_selected,
                 'rating': rating,
                 'review_text': review_text,
-                'chat_history': st.session_state.chat_history,
+                'chat_history': full_history(),
                 'timestamp': datetime.now().isoformat()
             }
             
-            # Mock save - replace with actual database save
-            st.success("✅ Review saved successfully!")
-            st.info("🔄 Review data ready for database storage (mock save completed)")
+            # Mis en file : écrit en arrière-plan par source/feedback_store.py (commit groupé SQLite)
+            if feedback_store.submit(review_data):
+                st.success("✅ Review saved successfully!")
+            else:
+                st.error("⚠️ Too many reviews are being saved right now, please try again.")
             
-            # Show what would be saved
+            # Show what was saved
             with st.expander("📊 Review Data (for debugging)"):
                 st.json(review_data)
             
             # Option to start new conversation
             if st.button("🔄 Start New Conversation", use_container_width=True):
-                st.session_state.school_selected = None
-                st.session_state.chat_history = []
-                st.session_state.show_review = False
-                st.session_state.conversation_closed = False
+                reset_conversation()
                 st.rerun()
     
     with col2:
@@ -262,11 +375,20 @@ with st.sidebar:
     if st.session_state.school_selected:
         st.markdown("---")
         st.markdown(f"**Current School:** {st.session_state.school_selected.upper()}")
-        st.markdown(f"**Messages:** {len(st.session_state.chat_history)}")
+        st.markdown(f"**Messages:** {message_count()}")
         
         if st.button("🔄 Reset Conversation", use_container_width=True):
-            st.session_state.school_selected = None
-            st.session_state.chat_history = []
-            st.session_state.show_review = False
-            st.session_state.conversation_closed = False
-            st.rerun()
\ No newline at end of file
+            reset_conversation()
+            st.rerun()
+
+# Mémoire de la session (messages gardés dans st.session_state) et taille de son archive
+session_bytes = deep_sizeof(st.session_state.chat_history)
+metrics.observe("helpai_session_state_bytes", session_bytes, buckets=SESSION_BYTES_BUCKETS)
+if SESSION_STATS:
+    with st.sidebar:
+        st.caption(
+            f"🧠 {len(st.session_state.chat_history)} messages en mémoire ({session_bytes / 1024:.1f} Ko) · "
+            f"{session_store.count(st.session_state.session_id)} archivés "
+            f"({session_store.session_bytes(st.session_state.session_id) / 1024:.1f} Ko compressés) · "
+            f"rendu {st.session_state.get('render_s', 0) * 1000:.1f} ms"
+        )
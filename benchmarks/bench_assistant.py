@@ -0,0 +1,249 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.fakes import FakeModelInference, HashingEncoder
+from source import assistant, resources
+from source.assistant import GENERATION_PARAMS, build_prompt, detect_language, school_assistant
+from source.filters import normalize_schools
+from source.llm_gateway import TokenBucket, llm_gateway
+from source.search_question import query_cache, search_by_vector, search_question
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+SCHOOLS = ["esilv", "emlv", "iim", "executive"]
+
+
+def percentiles(values) -> dict:
+    values = np.asarray(values, dtype=float) * 1000
+    if not len(values):
+        return {}
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process in MB (nan where `resource` is missing, e.g. Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    # ru_maxrss est en Ko sous Linux, en octets sous macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def load_questions(n: int, seed: int = 0) -> list:
+    """Sample (question, school) pairs from the checked-in qa_table."""
+    data = resources.get_table().to_arrow().select(["question", "ecole"]).to_pylist()
+    rng = random.Random(seed)
+    rng.shuffle(data)
+    pairs = []
+    for row in data[:n]:
+        schools = normalize_schools(row["ecole"]) or SCHOOLS
+        pairs.append((row["question"], rng.choice(schools)))
+    return pairs
+
+
+def bench_stages(questions: list) -> dict:
+    """Time each stage of the pipeline separately, one question at a time."""
+    stages = {name: [] for name in ("langdetect", "encode", "vector_search", "prompt_build", "llm", "post_processing")}
+    encoder, llm = resources.get_encoder(), resources.get_llm()
+    for question, school in questions:
+        t0 = time.perf_counter()
+        language_label = detect_language(question)
+        t1 = time.perf_counter()
+        query_vec = encoder.encode(resources.get_query_prefix() + question)
+        t2 = time.perf_counter()
+        retrieved = search_by_vector(query_vec, school, language_label)
+        t3 = time.perf_counter()
+        stages["langdetect"].append(t1 - t0)
+        stages["encode"].append(t2 - t1)
+        stages["vector_search"].append(t3 - t2)
+        if retrieved is None or retrieved.empty:
+            continue
+        prompt = build_prompt(question, school, language_label, retrieved, [])
+        t4 = time.perf_counter()
+        response = llm.generate(prompt=prompt, params=GENERATION_PARAMS)
+        t5 = time.perf_counter()
+        answer = response["results"][0]["generated_text"].strip()
+        assistant.log_request("bench", "sync", school, language_label, "llm", {"total_s": t5 - t0}, response)
+        t6 = time.perf_counter()
+        stages["prompt_build"].append(t4 - t3)
+        stages["llm"].append(t5 - t4)
+        stages["post_processing"].append(t6 - t5)
+    return {name: {**percentiles(values), "n": len(values)} for name, values in stages.items()}
+
+
+def bench_search(questions: list) -> dict:
+    """End-to-end search_question latency, cold (empty query cache) then warm."""
+    query_cache.clear()
+    cold, warm = [], []
+    for runs in (cold, warm):
+        for question, school in questions:
+            start = time.perf_counter()
+            search_question(question, school, detect_language(question))
+            runs.append(time.perf_counter() - start)
+    return {"cold": percentiles(cold), "warm": percentiles(warm), "query_cache": query_cache.stats()}
+
+
+def bench_concurrency(questions: list, concurrency: int) -> dict:
+    """
+    Throughput and latency of school_assistant with `concurrency` simultaneous callers.
+
+    Calls the LLM gateway shed, timed out or failed got the contact-form fallback
+    instead of an answer: they are reported in `unavailable`, not in the throughput.
+    """
+    latencies = []
+    before = llm_gateway.stats()
+
+    def call(item):
+        question, school = item
+        start = time.perf_counter()
+        school_assistant(question, school, chat_history=[])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, questions))
+    elapsed = time.perf_counter() - start
+    after = llm_gateway.stats()
+    unavailable = {k: after[k] - before[k] for k in ("shed", "timeouts", "errors")}
+    answered = len(questions) - sum(unavailable.values())
+    return {"concurrency": concurrency, "requests": len(questions), "unavailable": unavailable,
+            "throughput_rps": answered / elapsed, **percentiles(latencies)}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _flatten(prefix: str, value, out: dict):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)):
+        out[prefix] = value
+    return out
+
+
+def compare(current: dict, baseline_path: str, tolerance: float, min_delta_ms: float = 1.0) -> list:
+    """
+    Latency metrics (p50/p95) that got slower than `baseline * (1 + tolerance)`
+    by at least `min_delta_ms` (sub-millisecond stages are too noisy otherwise).
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    cur, base = _flatten("", current, {}), _flatten("", baseline, {})
+    regressions = []
+    for key, value in cur.items():
+        if not key.endswith(("p50_ms", "p95_ms")) or key not in base or not base[key]:
+            continue
+        if value > base[key] * (1 + tolerance) and value - base[key] >= min_delta_ms:
+            regressions.append({"metric": key, "baseline": base[key], "current": value,
+                                "change": value / base[key] - 1})
+    return regressions
+
+
+def run(n_queries: int, concurrency_levels, llm_ttft_s: float, llm_tokens_per_s: float,
+        fake_encoder: bool, verbose: bool) -> dict:
+    resources.set_llm(FakeModelInference(ttft_s=llm_ttft_s, tokens_per_s=llm_tokens_per_s))
+    if fake_encoder:
+        resources.set_encoder(HashingEncoder())
+    # Le cache de réponses masquerait l'appel LLM
+    assistant.ANSWER_CACHE_ENABLED = False
+    # Le faux LLM n'a pas de quota : la limite de débit de la passerelle ne ferait que
+    # remplacer des réponses par le formulaire de contact
+    llm_gateway.bucket = TokenBucket(0, 1)
+
+    output = sys.stdout if verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(output):
+        start = time.perf_counter()
+        resources.warm_up(background=False)
+        warm_up_s = time.perf_counter() - start
+        questions = load_questions(n_queries)
+        results = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "git_commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "queries": len(questions),
+                "fake_encoder": fake_encoder,
+                "fake_llm": {"ttft_s": llm_ttft_s, "tokens_per_s": llm_tokens_per_s},
+            },
+            "warm_up_s": warm_up_s,
+            "stages": bench_stages(questions),
+            "search_question": bench_search(questions),
+            "concurrency": [bench_concurrency(questions, c) for c in concurrency_levels],
+        }
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de bout en bout (watsonx simulé, sans réseau).")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--concurrency", default="1,4,16", help="Nombres d'appelants simultanés, ex: 1,4,16")
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="Latence simulée avant le 1er token (s)")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=40.0)
+    parser.add_argument("--fake-encoder", action="store_true",
+                        help="Encodeur déterministe sans modèle (si e5 n'est pas disponible en local)")
+    parser.add_argument("--output", help="Fichier JSON de sortie (défaut: benchmarks/results/bench-<date>.json)")
+    parser.add_argument("--compare", help="JSON d'une exécution précédente à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Régression tolérée (0.2 = +20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Écart absolu minimal pour signaler une régression")
+    parser.add_argument("--verbose", action="store_true", help="Garde les logs du pipeline")
+    args = parser.parse_args()
+
+    results = run(
+        n_queries=args.queries,
+        concurrency_levels=[int(c) for c in args.concurrency.split(",") if c],
+        llm_ttft_s=args.llm_ttft,
+        llm_tokens_per_s=args.llm_tokens_per_s,
+        fake_encoder=args.fake_encoder,
+        verbose=args.verbose,
+    )
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print("\n⏱️  Latence par étape (p50 / p95) :")
+    for name, stats in results["stages"].items():
+        if stats.get("n"):
+            print(f"   {name:<16} {stats['p50_ms']:8.2f} ms / {stats['p95_ms']:8.2f} ms")
+    print(f"🔍 search_question : froid p50={results['search_question']['cold']['p50_ms']:.2f} ms | "
+          f"chaud p50={results['search_question']['warm']['p50_ms']:.2f} ms")
+    for level in results["concurrency"]:
+        print(f"👥 {level['concurrency']:>3} appelants : {level['throughput_rps']:.1f} req/s, "
+              f"p50={level['p50_ms']:.0f} ms, p95={level['p95_ms']:.0f} ms, "
+              f"sans réponse LLM={sum(level['unavailable'].values())}/{level['requests']}")
+    print(f"🧠 RSS max : {results['peak_rss_mb']:.0f} Mo")
+    print(f"💾 Résultats : {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance, args.min_delta_ms)
+        for r in regressions:
+            print(f"❌ Régression {r['metric']} : {r['baseline']:.2f} -> {r['current']:.2f} ms ({r['change']:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print("✅ Pas de régression par rapport à", args.compare)
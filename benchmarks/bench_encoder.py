@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.bench_assistant import RESULTS_DIR, load_questions, peak_rss_mb, percentiles
+from source import resources
+from source.encoder import ENCODER_BACKENDS, QUERY_PREFIX, load_encoder, table_uses_prefixes
+from source.resources import MODEL_NAME
+from source.vector_index import VECTOR_COLUMN
+
+
+def exact_top_k(matrix: np.ndarray, queries: np.ndarray, k: int) -> list:
+    """Row ids of the k nearest stored questions (cosine) for each query."""
+    scores = queries @ matrix.T
+    return np.argsort(-scores, axis=1)[:, :k].tolist()
+
+
+def run_backend(backend: str, n_queries: int, k: int, batch_size: int, embeddings_out: str) -> dict:
+    """Measure one backend (called in its own process so that RSS figures are not mixed)."""
+    table = resources.get_table()
+    prefix = QUERY_PREFIX if table_uses_prefixes(table) else ""
+    questions = [prefix + q for q, _ in load_questions(n_queries)]
+    stored = np.asarray(table.to_arrow()[VECTOR_COLUMN].to_pylist(), dtype=np.float32)
+    stored /= np.linalg.norm(stored, axis=1, keepdims=True)
+    rss_before = peak_rss_mb()
+
+    start = time.perf_counter()
+    model = load_encoder(MODEL_NAME, backend)
+    model.encode("warm-up")
+    load_s = time.perf_counter() - start
+
+    # Une question à la fois (cas d'une requête utilisateur)
+    single, vectors = [], []
+    for question in questions:
+        t0 = time.perf_counter()
+        vectors.append(model.encode(question))
+        single.append(time.perf_counter() - t0)
+
+    # Par batchs (cas de l'ingestion)
+    t0 = time.perf_counter()
+    model.encode(questions, batch_size=batch_size)
+    batch_s = time.perf_counter() - t0
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.save(embeddings_out, vectors)
+    return {
+        "backend": backend,
+        "load_s": load_s,
+        "single_query": percentiles(single),
+        "batch_texts_per_s": len(questions) / batch_s,
+        "peak_rss_mb": peak_rss_mb(),
+        "model_rss_mb": peak_rss_mb() - rss_before,
+        "top_k": exact_top_k(stored, vectors, k),
+    }
+
+
+def compare_to_reference(results: dict, vectors: dict, reference: str, k: int):
+    """Add top-k overlap and embedding cosine against the `reference` backend to every result."""
+    ref = results[reference]
+    for backend, res in results.items():
+        if "error" in res:
+            continue
+        overlap = [len(set(a) & set(b)) / k for a, b in zip(res["top_k"], ref["top_k"])]
+        res["top_k_overlap"] = float(np.mean(overlap))
+        res["top_1_agreement"] = float(np.mean([a[0] == b[0] for a, b in zip(res["top_k"], ref["top_k"])]))
+        res["cosine_to_reference"] = float(np.mean(np.sum(vectors[backend] * vectors[reference], axis=1)))
+
+
+def run(backends, n_queries: int, k: int, batch_size: int) -> dict:
+    results, vectors = {}, {}
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    for backend in backends:
+        out = os.path.join(RESULTS_DIR, f".encoder-{backend}.npy")
+        cmd = [sys.executable, "-m", "benchmarks.bench_encoder", "--worker", backend,
+               "--queries", str(n_queries), "--k", str(k), "--batch-size", str(batch_size), "--embeddings-out", out]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            error = (proc.stderr.strip().splitlines() or ["?"])[-1]
+            print(f"⚠️  Backend {backend} ignoré : {error}")
+            results[backend] = {"backend": backend, "error": error}
+            continue
+        results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+        vectors[backend] = np.load(out)
+        os.remove(out)
+
+    reference = backends[0]
+    if "error" not in results.get(reference, {"error": True}):
+        compare_to_reference(results, vectors, reference, k)
+    for res in results.values():
+        res.pop("top_k", None)
+    return {
+        "meta": {"timestamp": datetime.now().isoformat(), "model": MODEL_NAME, "queries": n_queries,
+                 "k": k, "reference": reference},
+        "backends": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare les backends de l'encodeur (torch fp32, ONNX, ONNX int8).")
+    parser.add_argument("--backends", default=",".join(ENCODER_BACKENDS),
+                        help="Backends à comparer, le premier sert de référence")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output", help="Fichier JSON de sortie (défaut: benchmarks/results/encoder-<date>.json)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--embeddings-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Processus enfant : une ligne JSON sur stdout, le reste est silencieux
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            result = run_backend(args.worker, args.queries, args.k, args.batch_size, args.embeddings_out)
+            sys.stdout = stdout
+        print(json.dumps(result))
+        raise SystemExit(0)
+
+    results = run([b for b in args.backends.split(",") if b], args.queries, args.k, args.batch_size)
+    output = args.output or os.path.join(RESULTS_DIR, f"encoder-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(f"\n⏱️  Encodeur ({results['meta']['queries']} questions, référence {results['meta']['reference']}) :")
+    for backend, res in results["backends"].items():
+        if "error" in res:
+            print(f"   {backend:<10} ❌ {res['error']}")
+            continue
+        print(f"   {backend:<10} p50={res['single_query']['p50_ms']:6.1f} ms  p95={res['single_query']['p95_ms']:6.1f} ms  "
+              f"batch={res['batch_texts_per_s']:6.1f} textes/s  RSS modèle={res['model_rss_mb']:5.0f} Mo  "
+              f"top-{results['meta']['k']}={res.get('top_k_overlap', 0):.1%}  cos={res.get('cosine_to_reference', 0):.4f}")
+    print(f"💾 Résultats : {output}")
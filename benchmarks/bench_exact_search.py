@@ -0,0 +1,114 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.bench_assistant import RESULTS_DIR, SCHOOLS, _git_commit, percentiles
+from source import resources, search_question
+from source.exact_search import load_exact_index
+from source.vector_index import sample_queries
+
+LANGUAGES = ["Français", "English"]
+
+
+def _keys(found) -> list:
+    if found is None:
+        return []
+    return list(zip(found["question"], found["answer"], found["ecole"]))
+
+
+def _time_engine(engine: str, queries, filters, k: int):
+    search_question.RETRIEVAL_ENGINE = engine
+    search_question.search_by_vector(queries[0], *filters[0], k)  # chauffe
+    results, latencies = [], []
+    for vec, (school, language) in zip(queries, filters):
+        start = time.perf_counter()
+        results.append(search_question.search_by_vector(vec, school, language, k))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def run(n_queries: int, k: int, seed: int = 0) -> dict:
+    table = resources.get_table()
+    queries = sample_queries(table, n_queries, seed=seed)
+    rng = random.Random(seed)
+    filters = [(rng.choice(SCHOOLS), rng.choice(LANGUAGES)) for _ in queries]
+
+    # --- Chargement : export initial puis ouverture en memmap ---
+    cache_dir = tempfile.mkdtemp(prefix="exact-search-")
+    try:
+        start = time.perf_counter()
+        load_exact_index(table, cache_dir)
+        build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        index = load_exact_index(table, cache_dir)
+        load_s = time.perf_counter() - start
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    resources._resources["exact_index"] = index
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        lance_results, lance_lat = _time_engine("lancedb", queries, filters, k)
+        numpy_results, numpy_lat = _time_engine("numpy", queries, filters, k)
+
+    # Cœur du moteur NumPy seul (sans span ni métriques)
+    core_lat = []
+    for vec, (school, language) in zip(queries, filters):
+        start = time.perf_counter()
+        index.search(vec, school, language, k)
+        core_lat.append(time.perf_counter() - start)
+
+    same, max_gap = 0, 0.0
+    for a, b in zip(lance_results, numpy_results):
+        same += _keys(a) == _keys(b)
+        if a is not None and b is not None and len(a) == len(b):
+            max_gap = max(max_gap, float(np.abs(a["_distance"].to_numpy() - b["_distance"].to_numpy()).max()))
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": _git_commit(),
+            "rows": len(index),
+            "queries": len(queries),
+            "k": k,
+            "lancedb_index_config": resources.get_index_config(),
+        },
+        "numpy_build_s": build_s,
+        "numpy_load_s": load_s,
+        "lancedb": percentiles(lance_lat),
+        "numpy": percentiles(numpy_lat),
+        "numpy_core": percentiles(core_lat),
+        "identical_results": same / len(queries),
+        "max_distance_gap": max_gap,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recherche exacte NumPy en mémoire vs LanceDB (latence et résultats).")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--output", help="Fichier JSON de sortie (défaut: benchmarks/results/exact-search-<date>.json)")
+    args = parser.parse_args()
+
+    results = run(args.queries, args.k)
+    output = args.output or os.path.join(RESULTS_DIR, f"exact-search-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(f"\n🔍 search_by_vector ({results['meta']['queries']} requêtes, {results['meta']['rows']} lignes, "
+          f"k={results['meta']['k']}) :")
+    for name in ("lancedb", "numpy", "numpy_core"):
+        r = results[name]
+        print(f"   {name:<11} p50={r['p50_ms']:.3f} ms  p95={r['p95_ms']:.3f} ms  p99={r['p99_ms']:.3f} ms")
+    print(f"✅ Résultats identiques : {results['identical_results']:.1%} "
+          f"(écart de distance max {results['max_distance_gap']:.2e})")
+    print(f"📦 Export de la matrice {results['numpy_build_s'] * 1000:.0f} ms | ouverture memmap "
+          f"{results['numpy_load_s'] * 1000:.1f} ms")
+    print(f"💾 Résultats : {output}")
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.bench_assistant import RESULTS_DIR, percentiles
+from source.context_builder import html_to_text
+from source.language_id import LangdetectIdentifier, NgramLanguageIdentifier, train_from_csv
+from source.load_QA import CSV_PATH, iter_csv_chunks
+
+
+def load_dataset(csv_path: str) -> pd.DataFrame:
+    data = pd.concat(iter_csv_chunks(csv_path), ignore_index=True)
+    return data[data["langue"].isin(["Français", "English"])].reset_index(drop=True)
+
+
+def short_variant(text: str, n_words: int) -> str:
+    """First `n_words` words: stands in for terse chat messages ("absences ?")."""
+    return " ".join(text.split()[:n_words])
+
+
+def evaluate(predict, texts, labels) -> dict:
+    latencies, correct, undecided = [], 0, 0
+    for text, label in zip(texts, labels):
+        start = time.perf_counter()
+        found = predict(text)
+        latencies.append(time.perf_counter() - start)
+        correct += found == label
+        undecided += found is None
+    lat = percentiles(latencies)
+    return {
+        "accuracy": correct / len(texts),
+        "undecided": undecided / len(texts),
+        "p50_us": lat["p50_ms"] * 1000,
+        "p95_us": lat["p95_ms"] * 1000,
+    }
+
+
+def run(csv_path: str, folds: int, seed: int = 0) -> dict:
+    data = load_dataset(csv_path)
+    order = list(range(len(data)))
+    random.Random(seed).shuffle(order)
+
+    variants = {"questions": lambda t: t, "3_words": lambda t: short_variant(t, 3), "2_words": lambda t: short_variant(t, 2)}
+    results = {"ngram": {v: [] for v in variants}, "langdetect": {}}
+
+    # --- n-grammes : validation croisée (jamais évalué sur ses propres questions d'entraînement) ---
+    for fold in range(folds):
+        test_ids = set(order[fold::folds])
+        train = data[~data.index.isin(test_ids)]
+        test = data[data.index.isin(test_ids)]
+        model = NgramLanguageIdentifier().fit(train["question"], train["langue"])
+        model.fit((html_to_text(a) for a in train["answer"]), train["langue"])
+        for name, transform in variants.items():
+            results["ngram"][name].append(
+                evaluate(model.predict, [transform(t) for t in test["question"]], test["langue"].tolist()))
+    results["ngram"] = {
+        name: {key: sum(r[key] for r in runs) / len(runs) for key in runs[0]} for name, runs in results["ngram"].items()
+    }
+
+    # --- langdetect (graine fixe), sans entraînement ---
+    detector = LangdetectIdentifier()
+    for name, transform in variants.items():
+        results["langdetect"][name] = evaluate(detector.predict, [transform(t) for t in data["question"]],
+                                               data["langue"].tolist())
+
+    # --- Démarrage à froid : entraînement complet vs chargement des profils langdetect ---
+    start = time.perf_counter()
+    train_from_csv(csv_path).predict("warm-up")
+    results["ngram"]["cold_start_s"] = time.perf_counter() - start
+    results["langdetect"]["cold_start_s"] = _langdetect_cold_start()
+    return {"meta": {"timestamp": datetime.now().isoformat(), "rows": len(data), "folds": folds}, **results}
+
+
+def _langdetect_cold_start() -> float:
+    # Les profils sont chargés une fois par processus : on repart d'une fabrique vide
+    from langdetect import detector_factory
+    detector_factory._factory = None
+    start = time.perf_counter()
+    LangdetectIdentifier().predict("warm-up")
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Précision et latence de l'identification de langue (n-grammes vs langdetect).")
+    parser.add_argument("--csv", default=CSV_PATH)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--output", help="Fichier JSON de sortie (défaut: benchmarks/results/language-<date>.json)")
+    args = parser.parse_args()
+
+    results = run(args.csv, args.folds)
+    output = args.output or os.path.join(RESULTS_DIR, f"language-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(f"\n🌍 Identification de langue ({results['meta']['rows']} questions du CSV) :")
+    for backend in ("ngram", "langdetect"):
+        for name in ("questions", "3_words", "2_words"):
+            r = results[backend][name]
+            print(f"   {backend:<10} {name:<10} précision={r['accuracy']:.1%}  indécis={r['undecided']:.1%}  "
+                  f"p50={r['p50_us']:.0f} µs  p95={r['p95_us']:.0f} µs")
+        print(f"   {backend:<10} démarrage à froid : {results[backend]['cold_start_s']:.2f}s")
+    print(f"💾 Résultats : {output}")
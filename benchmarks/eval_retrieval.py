@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_assistant import RESULTS_DIR, _git_commit, percentiles
+from benchmarks.fakes import HashingEncoder
+from source import resources
+from source.encoder import ENCODER_BACKEND
+from source.filters import normalize_language, normalize_schools
+from source.search_question import search_by_vector
+from source.vector_index import VECTOR_COLUMN
+
+# Métriques de qualité : une baisse au-delà de la tolérance est une régression
+QUALITY_METRICS = ("recall_at_k", "hit_at_k", "mrr")
+
+POLITE_PREFIX = {"fr": "Bonjour, ", "en": "Hi, "}
+
+
+def _row_key(question: str, answer: str, ecole: str) -> tuple:
+    # Les résultats de search_by_vector n'ont pas d'identifiant de ligne
+    return question, answer, ecole
+
+
+def _strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+
+def paraphrases(title: str, lang: str, rng: random.Random) -> dict:
+    """
+    Rule-based variants of a CSV title, standing in for how students type it:
+    {"title", "casual", "polite", "dropped_word", "short"} (the last two only for titles of 4+ words).
+    """
+    words = title.split()
+    variants = {
+        "title": title,
+        "casual": _strip_accents(title.lower()).rstrip(" ?!."),
+        "polite": POLITE_PREFIX.get(lang, "") + title[:1].lower() + title[1:],
+    }
+    if len(words) >= 4:
+        dropped = rng.randrange(1, len(words))
+        variants["dropped_word"] = " ".join(words[:dropped] + words[dropped + 1:])
+        variants["short"] = " ".join(words[:max(2, round(len(words) * 0.6))])
+    return variants
+
+
+def load_corpus(table) -> dict:
+    """Text columns, normalized filters and the question vectors (float32) of the table."""
+    data = table.to_arrow()
+    column = data.column(VECTOR_COLUMN).combine_chunks()
+    vectors = column.flatten().to_numpy().reshape(len(column), -1).astype(np.float32)
+    rows = data.select(["question", "answer", "ecole", "langue"]).to_pylist()
+    return {
+        "rows": rows,
+        "keys": [_row_key(r["question"], r["answer"], r["ecole"]) for r in rows],
+        "schools": [set(normalize_schools(r["ecole"])) for r in rows],
+        "langs": [normalize_language(r["langue"]) for r in rows],
+        "vectors": vectors,
+    }
+
+
+def build_queries(corpus: dict, n_titles: int = None, paraphrase_csv: str = None, seed: int = 0) -> list:
+    """
+    Labelled queries: every variant of a sampled title, asked from one of its
+    schools, must retrieve the row it comes from.
+
+    `paraphrase_csv` (columns title;paraphrase) adds hand-written variants.
+    """
+    rng = random.Random(seed)
+    order = [i for i, r in enumerate(corpus["rows"]) if r["question"].strip() and corpus["schools"][i]]
+    rng.shuffle(order)
+    if n_titles:
+        order = order[:n_titles]
+
+    manual = defaultdict(list)
+    if paraphrase_csv:
+        extra = pd.read_csv(paraphrase_csv, sep=";", dtype=str).fillna("")
+        for title, text in zip(extra["title"], extra["paraphrase"]):
+            manual[title.strip()].append(text)
+
+    queries = []
+    for i in order:
+        row = corpus["rows"][i]
+        school = rng.choice(sorted(corpus["schools"][i]))
+        variants = list(paraphrases(row["question"], corpus["langs"][i], rng).items())
+        variants += [("manual", text) for text in manual.get(row["question"].strip(), [])]
+        for variant, text in variants:
+            queries.append({"text": text, "variant": variant, "school": school,
+                            "language": row["langue"], "target": i})
+    return queries
+
+
+def exact_ground_truth(corpus: dict, query_vectors: np.ndarray, queries: list, k: int):
+    """
+    Exact filtered L2 neighbours (same metric and school/language filter as the
+    production search) for every query, from a single matrix product.
+
+    Returns:
+        tuple: (top-k row indices per query, 1-based rank of each target row)
+    """
+    stored = corpus["vectors"]
+    # ||q - x||² = ||q||² - 2 q.x + ||x||² ; ||q||² ne change pas l'ordre
+    distances = (stored * stored).sum(axis=1)[None, :] - 2 * (query_vectors @ stored.T)
+
+    allowed = {}
+    for q, query in enumerate(queries):
+        group = (query["school"], normalize_language(query["language"]))
+        if group not in allowed:
+            allowed[group] = np.array([group[0] in s and group[1] == l
+                                       for s, l in zip(corpus["schools"], corpus["langs"])])
+        distances[q, ~allowed[group]] = np.inf
+
+    top = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    targets = np.array([query["target"] for query in queries])
+    target_d = distances[np.arange(len(queries)), targets]
+    ranks = (distances < target_d[:, None]).sum(axis=1) + 1
+    truth = [[i for i in row if np.isfinite(distances[q, i])] for q, row in enumerate(top)]
+    return truth, ranks
+
+
+def _summary(records: list) -> dict:
+    n = len(records)
+    if not n:
+        return {}
+    return {
+        "queries": n,
+        "recall_at_k": float(np.mean([r["recall"] for r in records])),
+        "hit_at_k": float(np.mean([r["hit"] for r in records])),
+        "mrr": float(np.mean([r["rr"] for r in records])),
+        "exact_hit_at_k": float(np.mean([r["exact_hit"] for r in records])),
+        "exact_mrr": float(np.mean([r["exact_rr"] for r in records])),
+    }
+
+
+def evaluate(k: int = 3, n_titles: int = None, paraphrase_csv: str = None, batch_size: int = 64,
+             fake_encoder: bool = False, seed: int = 0) -> dict:
+    """
+    Embed the labelled queries in one batched pass, compute the exact ground truth
+    and run the production search (`search_by_vector`) on every query.
+
+    Metrics (averaged per query):
+        recall_at_k: share of the exact top-k returned by the production search.
+        hit_at_k / mrr: the labelled row is in the results / 1 / its rank (0 if absent).
+        exact_hit_at_k / exact_mrr: same, for the exact ranking (what the encoder alone allows).
+    """
+    if fake_encoder:
+        resources.set_encoder(HashingEncoder())
+    table = resources.get_table()
+    corpus = load_corpus(table)
+    queries = build_queries(corpus, n_titles, paraphrase_csv, seed)
+
+    # --- Encodage en une passe (batchs) ---
+    prefix = resources.get_query_prefix()
+    encoder = resources.get_encoder()
+    encoder.encode(prefix + "warm-up")
+    start = time.perf_counter()
+    query_vectors = np.asarray(encoder.encode([prefix + q["text"] for q in queries], batch_size=batch_size),
+                               dtype=np.float32)
+    encode_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    truth, ranks = exact_ground_truth(corpus, query_vectors, queries, k)
+    exact_s = time.perf_counter() - start
+
+    # --- Chemin de production ---
+    search_by_vector(query_vectors[0], queries[0]["school"], queries[0]["language"], k)  # chauffe
+    records, latencies = [], []
+    for q, query in enumerate(queries):
+        t0 = time.perf_counter()
+        found = search_by_vector(query_vectors[q], query["school"], query["language"], k)
+        latencies.append(time.perf_counter() - t0)
+        found_keys = [] if found is None else [_row_key(r.question, r.answer, r.ecole) for r in found.itertuples()]
+        expected = {corpus["keys"][i] for i in truth[q]}
+        target_key = corpus["keys"][query["target"]]
+        rank = found_keys.index(target_key) + 1 if target_key in found_keys else 0
+        records.append({
+            "school": query["school"],
+            "variant": query["variant"],
+            "recall": len(expected & set(found_keys)) / len(expected) if expected else 1.0,
+            "hit": rank > 0,
+            "rr": 1 / rank if rank else 0.0,
+            "exact_hit": ranks[q] <= k,
+            "exact_rr": 1 / ranks[q] if ranks[q] <= k else 0.0,
+        })
+    search_s = sum(latencies)
+
+    by_school, by_variant = defaultdict(list), defaultdict(list)
+    for r in records:
+        by_school[r["school"]].append(r)
+        by_variant[r["variant"]].append(r)
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": _git_commit(),
+            "table_version": resources.get_table_version(),
+            "encoder_backend": "fake" if fake_encoder else ENCODER_BACKEND,
+            "index_config": resources.get_index_config(),
+            "k": k,
+            "rows": len(corpus["rows"]),
+            "titles": len({q["target"] for q in queries}),
+        },
+        "overall": _summary(records),
+        "per_school": {s: _summary(rs) for s, rs in sorted(by_school.items())},
+        "per_variant": {v: _summary(rs) for v, rs in by_variant.items()},
+        "throughput": {
+            "encode_texts_per_s": len(queries) / encode_s,
+            "exact_ground_truth_s": exact_s,
+            "search_qps": len(queries) / search_s,
+            "search": percentiles(latencies),
+        },
+    }
+
+
+def compare(current: dict, baseline_path: str, tolerance: float) -> list:
+    """Quality metrics (overall and per school) that dropped by more than `tolerance` (absolute)."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    sections = [("overall", current["overall"], baseline.get("overall", {}))]
+    sections += [(f"per_school.{s}", v, baseline.get("per_school", {}).get(s, {}))
+                 for s, v in current["per_school"].items()]
+    for name, cur, base in sections:
+        for metric in QUALITY_METRICS:
+            if metric in base and cur[metric] < base[metric] - tolerance:
+                regressions.append({"metric": f"{name}.{metric}", "baseline": base[metric], "current": cur[metric]})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Évaluation hors ligne de la recherche (recall@k, MRR, débit).")
+    parser.add_argument("--k", type=int, default=3, help="Taille du top-k (3 = valeur utilisée par l'assistant)")
+    parser.add_argument("--titles", type=int, help="Nombre de titres échantillonnés (défaut : tous)")
+    parser.add_argument("--paraphrases", help="CSV title;paraphrase de reformulations écrites à la main")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--fake-encoder", action="store_true",
+                        help="Encodeur déterministe sans modèle (seul recall_at_k reste significatif)")
+    parser.add_argument("--output", help="Fichier JSON de sortie (défaut: benchmarks/results/retrieval-<date>.json)")
+    parser.add_argument("--compare", help="JSON d'une évaluation précédente à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Baisse absolue tolérée (0.01 = 1 point)")
+    args = parser.parse_args()
+
+    results = evaluate(args.k, args.titles, args.paraphrases, args.batch_size, args.fake_encoder)
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    k = results["meta"]["k"]
+    print(f"\n🎯 Recherche ({results['overall']['queries']} requêtes, {results['meta']['titles']} titres, k={k}) :")
+    for name, r in [("global", results["overall"]), *results["per_school"].items(), *results["per_variant"].items()]:
+        print(f"   {name:<14} recall@{k}={r['recall_at_k']:.3f}  hit@{k}={r['hit_at_k']:.3f}  MRR={r['mrr']:.3f}  "
+              f"(exact : hit@{k}={r['exact_hit_at_k']:.3f} MRR={r['exact_mrr']:.3f})")
+    t = results["throughput"]
+    print(f"⚡ Encodage {t['encode_texts_per_s']:.0f} textes/s | vérité exacte {t['exact_ground_truth_s'] * 1000:.1f} ms | "
+          f"recherche {t['search_qps']:.0f} req/s (p50={t['search']['p50_ms']:.2f} ms, p95={t['search']['p95_ms']:.2f} ms)")
+    print(f"💾 Résultats : {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for r in regressions:
+            print(f"❌ Régression {r['metric']} : {r['baseline']:.3f} -> {r['current']:.3f}")
+        if regressions:
+            sys.exit(1)
+        print("✅ Pas de régression par rapport à", args.compare)
@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import time
+
+import numpy as np
+
+
+class FakeModelInference:
+    """
+    Local stand-in for ibm_watsonx_ai ModelInference (no network, no credentials).
+
+    Simulates a fixed time-to-first-token plus a constant token rate and returns
+    responses shaped like watsonx's (`results[0].generated_text`, token counts).
+    """
+
+    def __init__(self, ttft_s: float = 0.3, tokens_per_s: float = 40.0, answer_tokens: int = 60):
+        self.ttft_s = ttft_s
+        self.tokens_per_s = tokens_per_s
+        self.answer_tokens = answer_tokens
+        self.calls = 0
+
+    def _tokens(self, prompt: str):
+        words = ["<p>Réponse", "simulée", "pour", "le", "benchmark."]
+        return [words[i % len(words)] + " " for i in range(self.answer_tokens)]
+
+    def _response(self, prompt: str, text: str, generated: int) -> dict:
+        return {
+            "model_id": "fake/model",
+            "results": [{
+                "generated_text": text,
+                "generated_token_count": generated,
+                # ~4 caractères par token : ordre de grandeur suffisant pour le benchmark
+                "input_token_count": len(prompt) // 4,
+                "stop_reason": "max_tokens",
+            }],
+        }
+
+    def generate(self, prompt=None, params=None, **kwargs):
+        self.calls += 1
+        tokens = self._tokens(prompt)
+        time.sleep(self.ttft_s + len(tokens) / self.tokens_per_s)
+        return self._response(prompt, "".join(tokens), len(tokens))
+
+    def generate_text_stream(self, prompt=None, params=None, raw_response=False, **kwargs):
+        self.calls += 1
+        time.sleep(self.ttft_s)
+        for i, token in enumerate(self._tokens(prompt), start=1):
+            time.sleep(1 / self.tokens_per_s)
+            yield self._response(prompt, token, i) if raw_response else token
+
+    async def agenerate(self, prompt=None, params=None, **kwargs):
+        self.calls += 1
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self.ttft_s + len(tokens) / self.tokens_per_s)
+        return self._response(prompt, "".join(tokens), len(tokens))
+
+    async def aclose_persistent_connection(self):
+        pass
+
+
+class HashingEncoder:
+    """
+    Deterministic stand-in for the e5 encoder when the model is not available
+    locally: same text -> same unit vector. Retrieval results are meaningless,
+    only the timings of the other stages are.
+    """
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+
+    def _one(self, text: str) -> np.ndarray:
+        seed = int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+        vec = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return vec / np.linalg.norm(vec)
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs):
+        if isinstance(sentences, str):
+            return self._one(sentences)
+        return np.stack([self._one(s) for s in sentences])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
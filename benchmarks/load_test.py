@@ -0,0 +1,266 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.bench_assistant import RESULTS_DIR, SCHOOLS, _git_commit, peak_rss_mb, percentiles
+from benchmarks.fakes import HashingEncoder
+from benchmarks.watsonx_stub import WatsonxHTTPClient, WatsonxStub
+from source import assistant, resources
+from source.filters import normalize_schools
+from source.llm_gateway import llm_gateway
+
+LANGUAGES = {"Français": "fr", "English": "en"}
+
+# Relances courtes, sans le contexte la question n'a pas de sens (teste l'historique / la mémoire)
+FOLLOW_UPS = {
+    "Français": ["Et pour les alternants ?", "Vous pouvez préciser ?", "Et si je suis en première année ?",
+                 "Qui dois-je contacter pour ça ?", "C'est pareil pour les étudiants internationaux ?"],
+    "English": ["And for apprentices?", "Can you be more specific?", "What if I'm a first-year student?",
+                "Who should I contact about that?", "Is it the same for international students?"],
+}
+
+
+def load_question_pool() -> dict:
+    """(school, language label) -> questions of the checked-in qa_table."""
+    rows = resources.get_table().to_arrow().select(["question", "ecole", "langue"]).to_pylist()
+    pool = {}
+    for row in rows:
+        language = "English" if "english" in str(row["langue"]).lower() else "Français"
+        for school in normalize_schools(row["ecole"]) or SCHOOLS:
+            pool.setdefault((school, language), []).append(row["question"])
+    return pool
+
+
+def build_sessions(pool: dict, n: int, turns: int, french_share: float, follow_up_share: float, seed: int) -> list:
+    """
+    `n` scripted chat sessions: a school, a language (French with probability
+    `french_share`) and `turns` questions mixing new questions and follow-ups.
+    """
+    rng = random.Random(seed)
+    sessions = []
+    for _ in range(n):
+        language = "Français" if rng.random() < french_share else "English"
+        choices = [s for s in SCHOOLS if pool.get((s, language))] or SCHOOLS
+        school = rng.choice(choices)
+        questions = pool.get((school, language)) or [q for qs in pool.values() for q in qs]
+        script = [rng.choice(questions)]
+        for _ in range(turns - 1):
+            script.append(rng.choice(FOLLOW_UPS[language]) if rng.random() < follow_up_share else rng.choice(questions))
+        sessions.append({"school": school, "language": language, "questions": script})
+    return sessions
+
+
+def run_session(answer_stream, session: dict, think_s: float, rng: random.Random, remote: bool = False) -> list:
+    """
+    Play one session like app.py (streamed answers, growing chat_history); one record per turn.
+
+    With `remote` (ServiceClient), `cached` / `unavailable` come from the outcome the
+    service sends after the text. When it did not arrive, `cached` is None and the
+    answer counts as degraded ("no_outcome"): it cannot be shown to be within the SLO.
+    """
+    session_id = uuid.uuid4().hex
+    chat_history, records = [], []
+    for i, question in enumerate(session["questions"]):
+        if i and think_s:
+            time.sleep(rng.expovariate(1 / think_s))
+        timings = {}
+        start = time.perf_counter()
+        record = {"school": session["school"], "language": session["language"], "turn": i}
+        try:
+            answer = "".join(answer_stream(question, session["school"], chat_history[-8:], timings=timings,
+                                           session_id=session_id))
+            known = not remote or "cached" in timings
+            # degraded : watsonx saturé / trop lent, l'étudiant a reçu le formulaire de contact
+            record.update(ok=True, cached=bool(timings.get("cached")) if known else None,
+                          degraded=timings.get("unavailable") if known else "no_outcome")
+        except Exception as e:
+            answer = None
+            record.update(ok=False, error=type(e).__name__)
+        record["total_s"] = time.perf_counter() - start
+        record["ttft_s"] = timings.get("ttft_s", record["total_s"])
+        records.append(record)
+        chat_history.append({"role": "user", "content": question})
+        if answer is not None:
+            chat_history.append({"role": "assistant", "content": answer})
+    return records
+
+
+def run_level(answer_stream, sessions: list, think_s: float, seed: int, remote: bool = False) -> dict:
+    """All `sessions` at once, one thread each."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        futures = [pool.submit(run_session, answer_stream, s, think_s, random.Random(seed + i), remote)
+                   for i, s in enumerate(sessions)]
+        records = [r for f in futures for r in f.result()]
+    elapsed = time.perf_counter() - start
+    ok = [r for r in records if r["ok"]]
+    known = [r for r in ok if r["cached"] is not None]
+    errors = {}
+    for r in records:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    return {
+        "sessions": len(sessions),
+        "turns": len(records),
+        "elapsed_s": elapsed,
+        "throughput_turns_per_s": len(ok) / elapsed,
+        "error_rate": 1 - len(ok) / len(records) if records else 0.0,
+        "errors": errors,
+        # None : issue inconnue pour toutes les réponses (service sans issue)
+        "cached_share": sum(r["cached"] for r in known) / len(known) if known else None,
+        "degraded_share": sum(bool(r["degraded"]) for r in ok) / len(ok) if ok else 0.0,
+        "no_outcome_share": 1 - len(known) / len(ok) if ok else 0.0,
+        "ttft": percentiles([r["ttft_s"] for r in ok]),
+        "total": percentiles([r["total_s"] for r in ok]),
+        "by_language": {lang: len([r for r in records if r["language"] == lang]) for lang in LANGUAGES},
+    }
+
+
+def find_saturation(levels: list, slo_p95_s: float, max_error_rate: float, min_gain: float = 0.1) -> dict:
+    """
+    Largest session count within the SLO (p95 total latency, errors + degraded answers), and
+    the first level where adding sessions stops adding throughput (< `min_gain`
+    of the ideal linear gain).
+    """
+    within_slo, plateau = None, None
+    for prev, level in zip([None] + levels[:-1], levels):
+        failed = level["error_rate"] + level["degraded_share"] * (1 - level["error_rate"])
+        if level["total"] and level["total"]["p95_ms"] / 1000 <= slo_p95_s and failed <= max_error_rate:
+            within_slo = level["sessions"]
+        if prev is not None and plateau is None and prev["throughput_turns_per_s"]:
+            ideal = prev["throughput_turns_per_s"] * (level["sessions"] / prev["sessions"] - 1)
+            gain = level["throughput_turns_per_s"] - prev["throughput_turns_per_s"]
+            if gain < min_gain * ideal:
+                plateau = level["sessions"]
+    return {"max_sessions_within_slo": within_slo, "throughput_plateau_at": plateau,
+            "peak_throughput_turns_per_s": max(level["throughput_turns_per_s"] for level in levels)}
+
+
+def _start_service(workers: int, max_pending: int):
+    """source.service in a background thread of this process (same stub and encoder)."""
+    from source.service import AssistantHandler, PooledHTTPServer
+    from source.service_client import ServiceClient
+
+    server = PooledHTTPServer(("127.0.0.1", 0), AssistantHandler, workers, max_pending)
+    threading.Thread(target=server.serve_forever, name="load-test-service", daemon=True).start()
+    return server, ServiceClient(f"http://127.0.0.1:{server.server_address[1]}")
+
+
+def run(args) -> dict:
+    stub = WatsonxStub(ttft_s=args.llm_ttft, tokens_per_s=args.llm_tokens_per_s, answer_tokens=args.answer_tokens,
+                       error_rate=args.error_rate, max_concurrency=args.llm_max_concurrency).start()
+    resources.set_llm(WatsonxHTTPClient(stub.url))
+    if args.fake_encoder:
+        resources.set_encoder(HashingEncoder())
+    if args.no_answer_cache:
+        assistant.ANSWER_CACHE_ENABLED = False
+
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    server = None
+    try:
+        with contextlib.redirect_stdout(output):
+            resources.warm_up(background=False)
+            pool = load_question_pool()
+            if args.service:
+                server, client = _start_service(args.service_workers, args.service_max_pending)
+                answer_stream = client.answer_stream
+            else:
+                answer_stream = assistant.school_assistant_stream
+
+            levels = []
+            for i, n in enumerate(args.sessions):
+                # Sessions différentes à chaque palier ; cache de réponses remis à zéro pour comparer
+                assistant.answer_cache.invalidate()
+                sessions = build_sessions(pool, n, args.turns, args.french_share, args.follow_up_share, args.seed + i)
+                level = run_level(answer_stream, sessions, args.think_s, args.seed + 1000 * i, args.service)
+                level["llm_max_in_flight"] = stub.stats()["max_in_flight"]
+                levels.append(level)
+                print(f"👥 {n} sessions : {level['throughput_turns_per_s']:.1f} tours/s", file=sys.__stdout__)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        stub.stop()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": _git_commit(),
+            "target": "service" if args.service else "in-process",
+            "turns_per_session": args.turns,
+            "french_share": args.french_share,
+            "follow_up_share": args.follow_up_share,
+            "think_s": args.think_s,
+            "answer_cache": not args.no_answer_cache,
+            "fake_encoder": args.fake_encoder,
+            "stub": {"ttft_s": args.llm_ttft, "tokens_per_s": args.llm_tokens_per_s,
+                     "answer_tokens": args.answer_tokens, "error_rate": args.error_rate,
+                     "max_concurrency": args.llm_max_concurrency},
+        },
+        "levels": levels,
+        "saturation": find_saturation(levels, args.slo_p95_s, args.max_error_rate),
+        "stub": stub.stats(),
+        "llm_gateway": llm_gateway.stats(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge : N sessions de chat simultanées, watsonx simulé en HTTP.")
+    parser.add_argument("--sessions", default="1,4,16,64", help="Paliers de sessions simultanées, ex: 1,4,16,64")
+    parser.add_argument("--turns", type=int, default=4, help="Questions par session")
+    parser.add_argument("--french-share", type=float, default=0.6, help="Part des sessions en français")
+    parser.add_argument("--follow-up-share", type=float, default=0.4, help="Part des relances courtes après la 1re question")
+    parser.add_argument("--think-s", type=float, default=1.0, help="Temps de réflexion moyen entre deux questions (s)")
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="Latence du faux watsonx avant le 1er token (s)")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=40.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Part des appels watsonx en erreur 503")
+    parser.add_argument("--llm-max-concurrency", type=int, default=0, help="Appels watsonx simultanés max, au-delà 429")
+    parser.add_argument("--service", action="store_true", help="Passe par source.service (HTTP) au lieu de l'appel direct")
+    parser.add_argument("--service-workers", type=int, default=8)
+    parser.add_argument("--service-max-pending", type=int, default=32)
+    parser.add_argument("--no-answer-cache", action="store_true", help="Chaque question appelle watsonx")
+    parser.add_argument("--fake-encoder", action="store_true",
+                        help="Encodeur déterministe sans modèle (si e5 n'est pas disponible en local)")
+    parser.add_argument("--slo-p95-s", type=float, default=5.0, help="Latence totale p95 acceptable (s)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Fichier JSON de sortie (défaut: benchmarks/results/load-<date>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Garde les logs du pipeline")
+    args = parser.parse_args()
+    args.sessions = [int(n) for n in args.sessions.split(",") if n]
+
+    results = run(args)
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(f"\n📈 {results['meta']['target']}, {args.turns} questions/session, watsonx simulé "
+          f"(TTFT {args.llm_ttft}s, {args.llm_tokens_per_s:.0f} tokens/s, erreurs {args.error_rate:.0%}) :")
+    print(f"   {'sessions':>8} {'tours/s':>8} {'TTFT p50':>9} {'TTFT p95':>9} {'total p95':>10} {'total p99':>10} "
+          f"{'erreurs':>8} {'dégradé':>8} {'cache':>6}")
+    for level in results["levels"]:
+        ttft, total = level["ttft"] or {}, level["total"] or {}
+        cached = "n/a" if level["cached_share"] is None else f"{level['cached_share']:.0%}"
+        print(f"   {level['sessions']:>8} {level['throughput_turns_per_s']:>8.1f} "
+              f"{ttft.get('p50_ms', np.nan) / 1000:>8.2f}s {ttft.get('p95_ms', np.nan) / 1000:>8.2f}s "
+              f"{total.get('p95_ms', np.nan) / 1000:>9.2f}s {total.get('p99_ms', np.nan) / 1000:>9.2f}s "
+              f"{level['error_rate']:>8.1%} {level['degraded_share']:>8.1%} {cached:>6}")
+    sat = results["saturation"]
+    print(f"✅ Sessions max dans le SLO (p95 ≤ {args.slo_p95_s}s, erreurs ≤ {args.max_error_rate:.0%}) : "
+          f"{sat['max_sessions_within_slo'] or 'aucune'}")
+    print(f"📉 Débit plafonné à partir de : {sat['throughput_plateau_at'] or 'non atteint'} sessions "
+          f"(pic {sat['peak_throughput_turns_per_s']:.1f} tours/s)")
+    print(f"💾 Résultats : {output}")
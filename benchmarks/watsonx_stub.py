@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Routes de l'API REST watsonx.ai utilisées par ModelInference.generate / generate_text_stream
+GENERATION_PATH = "/ml/v1/text/generation"
+STREAM_PATH = "/ml/v1/text/generation_stream"
+API_VERSION = "2024-05-01"
+
+
+class WatsonxHTTPError(RuntimeError):
+    """Error status returned by the watsonx endpoint (429 / 5xx)."""
+
+    def __init__(self, status: int, body: str):
+        super().__init__(f"watsonx HTTP {status}: {body[:200]}")
+        self.status = status
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        path = urllib.parse.urlsplit(self.path).path
+        if path not in (GENERATION_PATH, STREAM_PATH):
+            self._send_json(404, {"errors": [{"code": "not_found", "message": path}], "status_code": 404})
+            return
+        status = stub.admit()
+        if status != 200:
+            self._send_json(status, {"errors": [{"code": "stub_error", "message": f"simulated {status}"}],
+                                     "status_code": status})
+            return
+        try:
+            prompt = body.get("input", "")
+            max_tokens = (body.get("parameters") or {}).get("max_new_tokens") or stub.answer_tokens
+            tokens = stub.tokens(min(max_tokens, stub.answer_tokens))
+            time.sleep(stub.ttft_s * random.uniform(1 - stub.jitter, 1 + stub.jitter))
+            if path == GENERATION_PATH:
+                time.sleep(len(tokens) / stub.tokens_per_s)
+                self._send_json(200, stub.response(body, prompt, "".join(tokens), len(tokens)))
+            else:
+                self._stream(stub, body, prompt, tokens)
+        finally:
+            stub.release()
+
+    def _stream(self, stub, body: dict, prompt: str, tokens: list):
+        # Server-sent events, un événement par token, comme l'API watsonx
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens, start=1):
+                if i > 1:
+                    time.sleep(1 / stub.tokens_per_s)
+                event = json.dumps(stub.response(body, prompt, token, i))
+                data = f"id: {i}\nevent: message\ndata: {event}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client parti en cours de flux (délai dépassé côté assistant)
+            self.close_connection = True
+
+
+class WatsonxStub:
+    """
+    Local HTTP server standing in for the watsonx.ai text generation endpoints.
+
+    Answers after `ttft_s` (± `jitter`) then `tokens_per_s`, streamed as SSE on
+    the stream route. `error_rate` of the requests get a 503, and requests
+    beyond `max_concurrency` in flight get a 429 (0 = no limit), like the rate
+    limit of a watsonx deployment.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ttft_s: float = 0.3, tokens_per_s: float = 40.0,
+                 answer_tokens: int = 60, error_rate: float = 0.0, jitter: float = 0.2, max_concurrency: int = 0):
+        self.ttft_s = ttft_s
+        self.tokens_per_s = tokens_per_s
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def admit(self) -> int:
+        """HTTP status of a new request (200, or the simulated error); 200 counts it in flight."""
+        with self._lock:
+            self.requests += 1
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                self.rate_limited += 1
+                return 429
+            if random.random() < self.error_rate:
+                self.errors += 1
+                return 503
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return 200
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def tokens(self, n: int) -> list:
+        words = ["<p>Réponse", "simulée", "pour", "le", "test", "de", "charge."]
+        return [words[i % len(words)] + " " for i in range(n)]
+
+    def response(self, body: dict, prompt: str, text: str, generated: int) -> dict:
+        return {
+            "model_id": body.get("model_id", "stub/model"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "results": [{
+                "generated_text": text,
+                "generated_token_count": generated,
+                "input_token_count": len(prompt) // 4,
+                "stop_reason": "max_tokens" if generated >= self.answer_tokens else "not_finished",
+            }],
+        }
+
+    def start(self) -> "WatsonxStub":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="watsonx-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited,
+                    "max_in_flight": self.max_in_flight}
+
+
+class WatsonxHTTPClient:
+    """
+    Minimal watsonx.ai REST client with the ModelInference methods used by the
+    assistant (`generate`, `generate_text_stream`, `agenerate`).
+
+    ibm_watsonx_ai only accepts https:// cloud URLs, so the stub is reached through
+    this client: same requests and responses over a real keep-alive HTTP
+    connection (one per thread), errors raised as `WatsonxHTTPError`.
+    """
+
+    def __init__(self, url: str, model_id: str = "mistralai/mistral-medium-2505", project_id: str = "load-test",
+                 timeout: float = 60.0):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.model_id = model_id
+        self.project_id = project_id
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _post(self, path: str, prompt: str, params: dict) -> http.client.HTTPResponse:
+        body = json.dumps({"input": prompt, "parameters": params or {}, "model_id": self.model_id,
+                           "project_id": self.project_id}).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Authorization": "Bearer load-test"}
+        conn = self._connection()
+        try:
+            conn.request("POST", f"{path}?version={API_VERSION}", body, headers)
+            response = conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Connexion keep-alive fermée par le serveur : une seule nouvelle tentative
+            conn.close()
+            conn.request("POST", f"{path}?version={API_VERSION}", body, headers)
+            response = conn.getresponse()
+        if response.status >= 400:
+            raise WatsonxHTTPError(response.status, response.read().decode("utf-8", "replace"))
+        return response
+
+    def generate(self, prompt=None, params=None, **kwargs) -> dict:
+        return json.loads(self._post(GENERATION_PATH, prompt, params).read())
+
+    def generate_text_stream(self, prompt=None, params=None, raw_response=False, **kwargs):
+        response = self._post(STREAM_PATH, prompt, params)
+        for line in response:
+            if line.startswith(b"data:"):
+                event = json.loads(line[5:])
+                yield event if raw_response else event["results"][0]["generated_text"]
+
+    async def agenerate(self, prompt=None, params=None, **kwargs) -> dict:
+        return await asyncio.to_thread(self.generate, prompt, params)
+
+    async def aclose_persistent_connection(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Faux endpoint watsonx.ai (génération simple et streaming SSE).")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Latence avant le 1er token (s)")
+    parser.add_argument("--tokens-per-s", type=float, default=40.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Part des requêtes en 503")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Au-delà : 429 (0 = pas de limite)")
+    args = parser.parse_args()
+
+    stub = WatsonxStub(port=args.port, ttft_s=args.ttft, tokens_per_s=args.tokens_per_s,
+                       answer_tokens=args.answer_tokens, error_rate=args.error_rate,
+                       max_concurrency=args.max_concurrency)
+    print(f"🤖 Faux watsonx sur {stub.url}{GENERATION_PATH} (Ctrl+C pour arrêter)")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n👋 {stub.stats()}")
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Cache of generated answers, looked up by question similarity.
+
+    Entries are grouped by (school, language). A new question reuses a cached
+    answer when the cosine similarity between its embedding and a cached
+    question embedding is at least `threshold`. Entries expire after `ttl_s`
+    seconds, the oldest are evicted beyond `max_size`, and everything is
+    dropped when the `qa_table` version changes (table rebuilt).
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl_s: float = 3600, max_size: int = 2048,
+                 version_fn=None, version_check_s: float = 5.0):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_size = max_size
+        self.version_fn = version_fn
+        self.version_check_s = version_check_s
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.latency_saved_s = 0.0
+        self._llm_latency_avg = None
+        self._buckets = {}  # (school, language) -> {"entries": [...], "matrix": np.ndarray | None}
+        self._size = 0
+        self._version = None
+        self._version_checked_at = 0.0
+        self._lock = threading.Lock()
+
+    # --- Invalidation ---
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_s:
+            return
+        self._version_checked_at = now
+        version = self.version_fn()
+        if self._version is not None and version != self._version:
+            self._clear()
+            self.invalidations += 1
+            print(f"♻️  qa_table v{self._version} -> v{version} : cache de réponses vidé")
+        self._version = version
+
+    def _clear(self):
+        self._buckets.clear()
+        self._size = 0
+
+    def invalidate(self):
+        """Drop every cached answer (e.g. after rebuilding `qa_table`)."""
+        with self._lock:
+            self._clear()
+            self.invalidations += 1
+
+    # --- Lookup / store ---
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _bucket(self, school: str, language: str) -> dict:
+        key = (school.lower(), language)
+        return self._buckets.setdefault(key, {"entries": [], "matrix": None})
+
+    def _expire(self, bucket: dict, now: float):
+        alive = [e for e in bucket["entries"] if now - e["created"] < self.ttl_s]
+        if len(alive) != len(bucket["entries"]):
+            self._size -= len(bucket["entries"]) - len(alive)
+            bucket["entries"] = alive
+            bucket["matrix"] = None
+
+    def lookup(self, school: str, language: str, embedding):
+        """
+        Return the cached answer of the most similar question, or None.
+
+        Returns:
+            dict | None: {"answer", "question", "similarity"} on a hit.
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            self._check_version()
+            bucket = self._bucket(school, language)
+            self._expire(bucket, time.monotonic())
+            if bucket["entries"]:
+                if bucket["matrix"] is None:
+                    bucket["matrix"] = np.stack([e["embedding"] for e in bucket["entries"]])
+                scores = bucket["matrix"] @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry = bucket["entries"][best]
+                    self.hits += 1
+                    if self._llm_latency_avg is not None:
+                        self.latency_saved_s += self._llm_latency_avg
+                    return {"answer": entry["answer"], "question": entry["question"],
+                            "similarity": float(scores[best])}
+            self.misses += 1
+            return None
+
+    def store(self, school: str, language: str, question: str, embedding, answer: str):
+        """Cache `answer` for `question` (embedding) within (school, language)."""
+        entry = {"question": question, "embedding": self._normalize(embedding),
+                 "answer": answer, "created": time.monotonic()}
+        with self._lock:
+            self._check_version()
+            bucket = self._bucket(school, language)
+            bucket["entries"].append(entry)
+            bucket["matrix"] = None
+            self._size += 1
+            if self._size > self.max_size:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        now = time.monotonic()
+        for bucket in self._buckets.values():
+            self._expire(bucket, now)
+        while self._size > self.max_size:
+            oldest = min((b for b in self._buckets.values() if b["entries"]),
+                         key=lambda b: b["entries"][0]["created"])
+            oldest["entries"].pop(0)
+            oldest["matrix"] = None
+            self._size -= 1
+
+    # --- Metrics ---
+    def observe_llm_latency(self, seconds: float):
+        """Feed the latency of an actual LLM call (moving average used to estimate time saved)."""
+        with self._lock:
+            if self._llm_latency_avg is None:
+                self._llm_latency_avg = seconds
+            else:
+                self._llm_latency_avg = 0.9 * self._llm_latency_avg + 0.1 * seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "invalidations": self.invalidations,
+                "avg_llm_latency_s": self._llm_latency_avg,
+                "latency_saved_s": self.latency_saved_s,
+            }
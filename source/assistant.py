@@ -1,95 +1,161 @@
-import json
+import logging
 import os
-from ibm_watsonx_ai.foundation_models import ModelInference
-from ibm_watsonx_ai import Credentials
-from source.search_question import search_question  # ⚠️ Ton fichier précédent
-from sentence_transformers import SentenceTransformer
-from langdetect import detect, detect_langs
-from dotenv import load_dotenv
-
+import time
+from source.search_question import embed_question, search_question  # ⚠️ Ton fichier précédent
+from source.resources import get_table_version, record_query_latency
+from source.answer_cache import SemanticAnswerCache
+from source.telemetry import new_request_id, telemetry, token_usage
+from source.context_builder import PROMPT_TOKEN_BUDGET, assemble_context, estimate_tokens
+from source.conversation_memory import conversation_memory
+from source.instrumentation import (
+    metrics, observe_tokens, record_span, request_context, sampled, span,
+)
+from source.language_id import DEFAULT_LANGUAGE, identify
+from source.llm_gateway import LLMUnavailable, llm_gateway
 
-# Charger .env local si présent (optionnel)
-load_dotenv()
 
-# --- IBM Watsonx credentials (lues depuis les variables d'environnement) ---
-API_KEY = os.getenv("API_KEY")
-PROJECT_ID = os.getenv("PROJECT_ID")
-REGION = os.getenv("REGION", "eu-de")  # valeur par défaut si souhaitée
+# Le client watsonx (ModelInference) est créé à la première utilisation et partagé
+# par tout le processus : voir source/resources.py. Les appels passent par
+# source/llm_gateway.py (coalescing, limite de débit, délais, relances).
 
-if not API_KEY or not PROJECT_ID:
-    raise RuntimeError(
-        "Missing IBM Watsonx credentials. Set IBM_WATSONX_API_KEY and IBM_WATSONX_PROJECT_ID in your environment."
-    )
+logger = logging.getLogger(__name__)
 
+GENERATION_PARAMS = {
+    "max_new_tokens": 180,
+    "temperature": 0.2,
+    "top_p": 0.9,
+    "repetition_penalty": 1.1,
+    # "stop_sequences": ["\n\nQ:", "\n\nÉtudiant:", "\n\nStudent:"],  # optionnel
+}
 
-# --- Initialize credentials and model ---
-creds = Credentials(
-    url=f"https://{REGION}.ml.cloud.ibm.com",
-    api_key=API_KEY
+# --- Cache sémantique des réponses (par école + langue, vidé quand qa_table est reconstruite) ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") != "0"
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl_s=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    max_size=int(os.getenv("ANSWER_CACHE_SIZE", "2048")),
+    version_fn=get_table_version,
 )
+metrics.register_collector("helpai_answer_cache", answer_cache.stats)
 
-llm_model = ModelInference(
-    model_id="mistralai/mistral-medium-2505",
-    credentials=creds,
-    project_id=PROJECT_ID
-)
 
+def _is_follow_up(question: str, chat_history) -> bool:
+    """True when the conversation holds anything besides the current question."""
+    for msg in chat_history or []:
+        content = (msg.get("content") or "").strip()
+        if not content:
+            continue
+        if msg.get("role") == "user" and content == question.strip():
+            continue
+        return True
+    return False
 
-def school_assistant(question: str, school: str, chat_history=None):
+
+def session_context(session_id: str, chat_history=None):
     """
-    Answer a student's question using retrieved Q&A + conversation context.
-    chat_history: list[ {role: 'user'|'assistant', content: str, timestamp: str } ]
+    History and rolling summary for the prompt: the recent turns and summary kept
+    by the conversation memory for `session_id`, or `chat_history` as given when
+    the session is unknown (first question, or memory lost on restart).
+
+    Returns:
+        tuple: (chat_history, summary)
     """
-    # Step 0 - Language from current question
-    language = detect(question)
-    if language == "fr":
-        language_label = "Français"
+    recent, summary = conversation_memory.context(session_id)
+    return (chat_history if recent is None else recent), summary
+
+
+def cached_answer(question: str, school: str, language_label: str, chat_history=None):
+    """Answer of a near-identical question already asked for this school/language, or None."""
+    if not ANSWER_CACHE_ENABLED or _is_follow_up(question, chat_history):
+        return None
+    hit = answer_cache.lookup(school, language_label, embed_question(question))
+    if hit is None:
+        return None
+    logger.info("Answer served from cache (similarity %.3f with '%s')", hit["similarity"], hit["question"])
+    return hit["answer"]
+
+
+def remember_answer(question: str, school: str, language_label: str, chat_history, answer: str, llm_s: float):
+    """Record the LLM latency and cache `answer` when the question had no follow-up context."""
+    answer_cache.observe_llm_latency(llm_s)
+    if ANSWER_CACHE_ENABLED and answer and not _is_follow_up(question, chat_history):
+        answer_cache.store(school, language_label, question, embed_question(question), answer)
+
+
+def log_request(request_id: str, mode: str, school: str, language_label: str, outcome: str,
+                timings: dict, response: dict = None):
+    """Queue one telemetry record (written in the background, see source/telemetry.py) and update the metrics."""
+    usage = token_usage(response)
+    telemetry.emit({
+        "request_id": request_id,
+        "mode": mode,
+        "school": school,
+        "language": language_label,
+        "outcome": outcome,  # "llm" | "cache" | "fallback" | "shed" | "timeout" | "llm_error"
+        **usage,
+        "timings": {k: round(v, 4) for k, v in timings.items() if isinstance(v, float)},
+    })
+    metrics.inc("helpai_requests", mode=mode, outcome=outcome)
+    if "total_s" in timings:
+        metrics.observe("helpai_request_seconds", timings["total_s"], mode=mode, outcome=outcome)
+    observe_tokens("prompt_tokens", usage["input_tokens"])
+    observe_tokens("generated_tokens", usage["generated_tokens"])
+
+
+def _log_answer(answer: str, language_label: str, mode: str):
+    # Réponse complète : seulement pour un échantillon de requêtes
+    if sampled():
+        logger.debug("Assistant answer (%s, %s): %s", mode, language_label, answer)
+
+
+def detect_language(question: str, chat_history=None) -> str:
+    """
+    Language label of the question: "Français" or "English".
+
+    When the question alone is not enough (e.g. "ok ?"), the language of the
+    previous user message is kept, then DEFAULT_LANGUAGE.
+    """
+    label = identify(question.strip())
+    if label is None and chat_history:
+        for msg in reversed(chat_history):
+            content = (msg.get("content") or "").strip()
+            if msg.get("role") == "user" and content and content != question.strip():
+                label = identify(content)
+                if label is not None:
+                    break
+    return label or DEFAULT_LANGUAGE
+
+
+def contact_form_message(language_label: str) -> str:
+    """Apology + contact-form link, in the language of the question."""
+    if language_label == "Français":
+        return "Je suis désolé, je n'ai pas pu trouver la réponse à votre question. S'il vous plaît utilisez le formulaire suivant: https://forms.office.com/"
+    return "I'm sorry, I couldn't find relevant information. Please use the contact form: https://forms.office.com/"
+
+
+def fallback_message(school: str, language_label: str) -> str:
+    """Contact-form message returned when no relevant Q&A is found."""
+    if language_label == "Français":
+        logger.info("Aucun contexte trouvé pour '%s', redirection vers un formulaire.", school)
+    else:
+        logger.info("No context found for '%s', redirecting to form.", school)
+    return contact_form_message(language_label)
+
+
+def unavailable_message(school: str, language_label: str, error: LLMUnavailable) -> str:
+    """Contact-form message returned when watsonx is overloaded, too slow or failing."""
+    logger.warning("LLM unavailable for '%s' (%s: %s), redirecting to form.", school, error.outcome, error)
+    return contact_form_message(language_label)
+
+
+def render_prompt(question: str, school: str, language_label: str, retrieval_context: str = "",
+                  conv_context: str = "", last_assistant_answer: str = "", summary: str = "") -> str:
+    """Fill the RAG prompt template (FR or EN) with already-assembled contexts."""
+    if language_label == "Français":
         lang_rule = "Réponds STRICTEMENT en français. Ne mélange pas les langues."
     else:
-        language_label = "English"
         lang_rule = "Answer STRICTLY in English. Do not mix languages."
 
-    # Step 1 - Retrieve relevant Q&A
-    retrieved = search_question(question, school, language_label)
-    if retrieved is None or retrieved.empty:
-        if language_label == "Français":
-            print(f"❌ Aucun contexte trouvé pour '{school}', redirection vers un formulaire.")
-            return "Je suis désolé, je n'ai pas pu trouver la réponse à votre question. S'il vous plaît utilisez le formulaire suivant: https://forms.office.com/"
-        else:
-            print(f"❌ No context found for '{school}', redirecting to form.")
-            return "I'm sorry, I couldn't find relevant information. Please use the contact form: https://forms.office.com/"
-
-    # Step 2 - Build retrieval context
-    retrieval_context = ""
-    for _, row in retrieved.iterrows():
-        retrieval_context += f"Q: {row['question']}\nA: {row['answer']}\n\n"
-
-    # Step 3 - Build conversation context (short)
-    conv_context = ""
-    last_assistant_answer = ""
-    if chat_history:
-        # Keep last 8 messages
-        for msg in chat_history[-8:]:
-            role = msg.get("role")
-            content = msg.get("content", "")
-            if not content:
-                continue
-            if language_label == "Français":
-                if role == "user":
-                    conv_context += f"Étudiant: {content}\n"
-                elif role == "assistant":
-                    conv_context += f"Assistant: {content}\n"
-            else:
-                if role == "user":
-                    conv_context += f"Student: {content}\n"
-                elif role == "assistant":
-                    conv_context += f"Assistant: {content}\n"
-        # Dernière réponse de l'assistant (utile pour les relances du type "et après ?")
-        for msg in reversed(chat_history):
-            if msg.get("role") == "assistant" and msg.get("content"):
-                last_assistant_answer = msg["content"]
-                break
-
     # Step 4 - Prompt (favorise la continuité de la conversation et évite le FR/EN mix)
     if language_label == "Français":
         prompt = (
@@ -102,7 +168,8 @@ def school_assistant(question: str, school: str, chat_history=None):
             f"3) Utilise le contexte Q&R pour vérifier les faits. En cas de conflit, signale l'incertitude et reste prudent. "
             f"4) Si ni la conversation ni le Q&R ne contiennent l'information, indique-le et propose le formulaire de contact.\n\n"
             f"--- Contexte Q&R ---\n{retrieval_context}\n"
-            f"--- Contexte conversationnel (récent) ---\n{conv_context if conv_context else '(aucun)'}\n"
+            + (f"--- Résumé de la conversation (plus ancienne) ---\n{summary}\n" if summary else "")
+            + f"--- Contexte conversationnel (récent) ---\n{conv_context if conv_context else '(aucun)'}\n"
             f"--- Dernière réponse de l'assistant ---\n{(last_assistant_answer or '(aucune)')}\n"
             f"--- Nouvelle question ---\n{question}\n\n"
             f"Réponse:"
@@ -118,33 +185,200 @@ def school_assistant(question: str, school: str, chat_history=None):
             f"3) Use the Q&A context to verify facts. If conflicting, acknowledge uncertainty and stay cautious. "
             f"4) If neither conversation nor Q&A has the info, say so and offer the contact form.\n\n"
             f"--- Q&A Context ---\n{retrieval_context}\n"
-            f"--- Conversational Context (recent) ---\n{conv_context if conv_context else '(none)'}\n"
+            + (f"--- Conversation summary (older) ---\n{summary}\n" if summary else "")
+            + f"--- Conversational Context (recent) ---\n{conv_context if conv_context else '(none)'}\n"
             f"--- Last assistant answer ---\n{(last_assistant_answer or '(none)')}\n"
             f"--- New Question ---\n{question}\n\n"
             f"Answer:"
         )
 
-    params = {
-        "max_new_tokens": 180,
-        "temperature": 0.2,
-        "top_p": 0.9,
-        "repetition_penalty": 1.1,
-        # "stop_sequences": ["\n\nQ:", "\n\nÉtudiant:", "\n\nStudent:"],  # optionnel
-    }
+    return prompt
 
-    response = llm_model.generate(prompt=prompt, params=params)
-    answer = response["results"][0]["generated_text"].strip()
 
-    if language_label == "Français":
-        print(f"\n🤖 Réponse de l'assistant:\n{answer}\n")
-    else:
-        print(f"\n🤖 Assistant response:\n{answer}\n")
+def build_prompt(question: str, school: str, language_label: str, retrieved, chat_history=None,
+                 budget: int = PROMPT_TOKEN_BUDGET, stats: dict = None, summary: str = "") -> str:
+    """
+    Assemble the RAG prompt from the retrieved Q&A and the conversation context,
+    within `budget` estimated tokens (see source/context_builder.py).
+
+    Args:
+        stats: Optional dict filled with prompt_tokens, rows_used and rows_dropped.
+        summary: Rolling summary of the older turns (fixed size, see source/conversation_memory.py).
+    """
+    # Steps 2-3 - Retrieval + conversation contexts, sized to what the template (and summary) leaves
+    overhead = estimate_tokens(render_prompt(question, school, language_label, summary=summary))
+    context = assemble_context(question, retrieved, chat_history, language_label, max(0, budget - overhead))
+    prompt = render_prompt(question, school, language_label, context["retrieval_context"],
+                           context["conv_context"], context["last_assistant_answer"], summary)
+    if stats is not None:
+        stats.update(prompt_tokens=estimate_tokens(prompt), rows_used=context["rows_used"],
+                     rows_dropped=context["rows_dropped"])
+    return prompt
+
+
+def prepare_prompt(question: str, school: str, chat_history=None, summary: str = ""):
+    """
+    Detect the language, retrieve the relevant Q&A and build the RAG prompt.
+
+    Returns:
+        tuple: (language_label, prompt, fallback). When nothing relevant is found,
+        `prompt` is None and `fallback` is the contact-form message to show instead.
+    """
+    # Step 0 - Language from current question
+    with span("langdetect") as rec:
+        language_label = rec["language"] = detect_language(question, chat_history)
+
+    # Step 1 - Retrieve relevant Q&A
+    with span("retrieval", school=school):
+        retrieved = search_question(question, school, language_label)
+    if retrieved is None or retrieved.empty:
+        return language_label, None, fallback_message(school, language_label)
+
+    # Steps 2-4 - Contexts and prompt
+    with span("prompt_build") as rec:
+        prompt = build_prompt(question, school, language_label, retrieved, chat_history, stats=rec, summary=summary)
+    observe_tokens("prompt_tokens_est", rec["prompt_tokens"])
+    logger.debug("Prompt: ~%d tokens, %d Q&A row(s) kept, %d dropped",
+                 rec["prompt_tokens"], rec["rows_used"], rec["rows_dropped"])
+    return language_label, prompt, None
+
+
+def school_assistant(question: str, school: str, chat_history=None, session_id: str = None):
+    """
+    Answer a student's question using retrieved Q&A + conversation context.
+    chat_history: list[ {role: 'user'|'assistant', content: str, timestamp: str } ]
+    session_id: when given, the conversation memory of this session (recent turns +
+    rolling summary) replaces `chat_history` and records the new turn.
+    """
+    request_id = new_request_id()
+    with request_context(request_id):
+        start = time.perf_counter()
+        timings = {}
+
+        chat_history, summary = session_context(session_id, chat_history)
+        language_label, prompt, fallback = prepare_prompt(question, school, chat_history, summary)
+        timings["prompt_s"] = time.perf_counter() - start
+        if prompt is None:
+            timings["total_s"] = time.perf_counter() - start
+            log_request(request_id, "sync", school, language_label, "fallback", timings)
+            return fallback
+
+        answer = cached_answer(question, school, language_label, chat_history)
+        if answer is not None:
+            timings["total_s"] = time.perf_counter() - start
+            log_request(request_id, "sync", school, language_label, "cache", timings)
+            conversation_memory.record_turn(session_id, question, answer, language_label)
+            record_query_latency(timings["total_s"])
+            return answer
+
+        try:
+            with span("llm") as rec:
+                response = llm_gateway.generate(prompt, GENERATION_PARAMS)
+                rec.update(token_usage(response))
+        except LLMUnavailable as e:
+            # Surcharge, délai dépassé ou erreur watsonx : formulaire de contact plutôt qu'une attente sans fin
+            timings["total_s"] = time.perf_counter() - start
+            log_request(request_id, "sync", school, language_label, e.outcome, timings)
+            return unavailable_message(school, language_label, e)
+        timings["llm_s"] = rec["duration_s"]
+
+        with span("post_processing"):
+            answer = response["results"][0]["generated_text"].strip()
+            remember_answer(question, school, language_label, chat_history, answer, timings["llm_s"])
+            conversation_memory.record_turn(session_id, question, answer, language_label)
+            _log_answer(answer, language_label, "sync")
+
+        timings["total_s"] = time.perf_counter() - start
+        log_request(request_id, "sync", school, language_label, "llm", timings, response)
+        record_query_latency(timings["total_s"])
+        return answer
+
 
-    with open("assistant_response.json", "w", encoding="utf-8") as f:
-        json.dump(response, f, ensure_ascii=False, indent=4)
+def school_assistant_stream(question: str, school: str, chat_history=None, timings: dict = None,
+                            session_id: str = None):
+    """
+    Streaming variant of `school_assistant`: yields the answer chunk by chunk
+    as watsonx generates it.
+
+    Args:
+        timings (dict): Optional dict filled with `ttft_s` (time to first token)
+            and `total_s` once the stream is exhausted.
+        session_id (str): Conversation memory to use and update (see `school_assistant`).
+
+    Yields:
+        str: Pieces of the answer (the contact-form message in one piece when
+        nothing relevant is found).
+    """
+    request_id = new_request_id()
+    start = time.perf_counter()
+    timings = timings if timings is not None else {}
+
+    # Pas de `yield` dans ce bloc : le contexte de requête ne fuit pas chez l'appelant
+    with request_context(request_id):
+        chat_history, summary = session_context(session_id, chat_history)
+        language_label, prompt, fallback = prepare_prompt(question, school, chat_history, summary)
+        timings["prompt_s"] = time.perf_counter() - start
+        answer = None
+        if prompt is not None:
+            answer = cached_answer(question, school, language_label, chat_history)
+    if prompt is None:
+        timings["ttft_s"] = timings["total_s"] = time.perf_counter() - start
+        log_request(request_id, "stream", school, language_label, "fallback", timings)
+        yield fallback
+        return
+
+    if answer is not None:
+        timings["ttft_s"] = timings["total_s"] = time.perf_counter() - start
+        timings["cached"] = True
+        log_request(request_id, "stream", school, language_label, "cache", timings)
+        conversation_memory.record_turn(session_id, question, answer, language_label)
+        yield answer
+        record_query_latency(timings["total_s"])
+        return
+
+    llm_start = time.perf_counter()
+    pieces = []
+    usage = {}
+    try:
+        for event in llm_gateway.generate_text_stream(prompt, GENERATION_PARAMS):
+            result = event["results"][0]
+            # Compteurs de tokens : présents sur tout ou partie des événements selon le modèle
+            for key in ("input_token_count", "generated_token_count", "stop_reason"):
+                if result.get(key) is not None:
+                    usage[key] = result[key]
+            chunk = result.get("generated_text", "")
+            if not chunk:
+                continue
+            if not pieces:
+                # Le premier token arrivé : c'est ce que l'étudiant ressent comme latence
+                timings["ttft_s"] = time.perf_counter() - start
+            pieces.append(chunk)
+            yield chunk
+    except LLMUnavailable as e:
+        timings["total_s"] = time.perf_counter() - start
+        timings.setdefault("ttft_s", timings["total_s"])
+        timings["unavailable"] = e.outcome
+        log_request(request_id, "stream", school, language_label, e.outcome, timings)
+        if not pieces:
+            yield unavailable_message(school, language_label, e)
+        else:
+            # Réponse déjà en partie affichée : on s'arrête là, sans la mettre en cache
+            logger.warning("Stream interrupted after %d chunk(s): %s", len(pieces), e)
+        return
 
-    print("✅ Full JSON response saved to assistant_response.json")
-    return answer
+    # Inclut le temps passé par l'appelant entre deux chunks (rendu Streamlit)
+    timings["llm_s"] = time.perf_counter() - llm_start
+    record_span("llm", timings["llm_s"], request_id=request_id, mode="stream",
+                ttft_s=timings.get("ttft_s"), **token_usage({"results": [usage]}))
+    timings["total_s"] = time.perf_counter() - start
+    answer = "".join(pieces).strip()
+    with request_context(request_id):
+        remember_answer(question, school, language_label, chat_history, answer, timings["llm_s"])
+        conversation_memory.record_turn(session_id, question, answer, language_label)
+        _log_answer(answer, language_label, "stream")
+    log_request(request_id, "stream", school, language_label, "llm", timings, {"results": [usage]})
+    logger.info("Stream answered: TTFT %.2fs | total %.2fs", timings.get("ttft_s", timings["total_s"]), timings["total_s"])
+    record_query_latency(timings["total_s"])
 
 
 # --- Example usage ---
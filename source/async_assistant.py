@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import functools
+import os
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from source.assistant import (
+    GENERATION_PARAMS, cached_answer, log_request, prepare_prompt, remember_answer, session_context,
+    unavailable_message,
+)
+from source.conversation_memory import conversation_memory
+from source.instrumentation import request_context, span
+from source.llm_gateway import LLM_MAX_CONCURRENCY, LLMUnavailable, llm_gateway
+from source.resources import get_llm, record_query_latency
+from source.telemetry import new_request_id
+
+# Threads pour les étapes CPU (détection de langue, encodage, recherche LanceDB)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="assistant-cpu")
+# asyncio.Semaphore est lié à une boucle : un sémaphore par boucle d'événements
+_llm_semaphores = weakref.WeakKeyDictionary()
+
+
+def _llm_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _llm_semaphores.get(loop)
+    if sem is None:
+        sem = _llm_semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return sem
+
+
+async def school_assistant_async(question: str, school: str, chat_history=None, session_id: str = None):
+    """
+    Async version of `school_assistant`.
+
+    Language detection, encoding and retrieval run in a shared thread pool; the
+    watsonx call goes through ModelInference.agenerate (persistent, pooled HTTP
+    connection), via the LLM gateway, and is capped process-wide by LLM_MAX_CONCURRENCY.
+    """
+    request_id = new_request_id()
+    with request_context(request_id):
+        return await _answer(request_id, question, school, chat_history, session_id)
+
+
+async def _answer(request_id: str, question: str, school: str, chat_history, session_id: str = None):
+    start = time.perf_counter()
+    timings = {}
+    loop = asyncio.get_running_loop()
+    chat_history, summary = session_context(session_id, chat_history)
+
+    # copy_context : les spans exécutés dans le thread gardent le request id
+    ctx = contextvars.copy_context()
+    language_label, prompt, fallback = await loop.run_in_executor(
+        _cpu_executor, functools.partial(ctx.run, prepare_prompt, question, school, chat_history, summary)
+    )
+    timings["prompt_s"] = time.perf_counter() - start
+    if prompt is None:
+        timings["total_s"] = time.perf_counter() - start
+        log_request(request_id, "async", school, language_label, "fallback", timings)
+        return fallback
+
+    # Le cache peut encoder la question et relire la version de qa_table : hors de la boucle
+    answer = await loop.run_in_executor(
+        _cpu_executor, functools.partial(ctx.run, cached_answer, question, school, language_label, chat_history)
+    )
+    if answer is not None:
+        timings["total_s"] = time.perf_counter() - start
+        log_request(request_id, "async", school, language_label, "cache", timings)
+        conversation_memory.record_turn(session_id, question, answer, language_label)
+        record_query_latency(timings["total_s"])
+        return answer
+
+    queued_at = time.perf_counter()
+    try:
+        async with _llm_semaphore():
+            timings["llm_queue_s"] = time.perf_counter() - queued_at
+            with span("llm", mode="async", queue_s=timings["llm_queue_s"]) as rec:
+                response = await llm_gateway.agenerate(prompt, GENERATION_PARAMS)
+            timings["llm_s"] = rec["duration_s"]
+    except LLMUnavailable as e:
+        timings["total_s"] = time.perf_counter() - start
+        log_request(request_id, "async", school, language_label, e.outcome, timings)
+        return unavailable_message(school, language_label, e)
+    with span("post_processing"):
+        answer = response["results"][0]["generated_text"].strip()
+        await loop.run_in_executor(_cpu_executor, functools.partial(
+            ctx.run, remember_answer, question, school, language_label, chat_history, answer, timings["llm_s"]
+        ))
+        conversation_memory.record_turn(session_id, question, answer, language_label)
+
+    timings["total_s"] = time.perf_counter() - start
+    log_request(request_id, "async", school, language_label, "llm", timings, response)
+    record_query_latency(timings["total_s"])
+    return answer
+
+
+async def answer_many(requests):
+    """
+    Answer several questions concurrently.
+
+    Args:
+        requests: Iterable of (question, school, chat_history) tuples.
+
+    Returns:
+        list: Answers, in the same order as `requests`.
+    """
+    return await asyncio.gather(*(school_assistant_async(q, s, h) for q, s, h in requests))
+
+
+async def aclose():
+    """Close the pooled async connection of the watsonx client."""
+    await get_llm().aclose_persistent_connection()
+
+
+# --- Example usage ---
+if __name__ == "__main__":
+    async def _demo():
+        questions = [
+            ("A combien d'absence ai-je droit?", "esilv", []),
+            ("How many absences are allowed?", "emlv", []),
+            ("Quand ont lieu les examens ?", "iim", []),
+        ]
+        start = time.perf_counter()
+        answers = await answer_many(questions)
+        for (q, s, _), a in zip(questions, answers):
+            print(f"❓ [{s}] {q}\n🤖 {a}\n")
+        print(f"⏱️  {len(questions)} questions en {time.perf_counter() - start:.2f}s")
+        await aclose()
+
+    asyncio.run(_demo())
@@ -0,0 +1,166 @@
+import html
+import os
+import re
+
+# Budget total du prompt (consignes + contextes + question), en tokens estimés
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+# Au-delà, une réponse de la FAQ est réduite à ses phrases les plus pertinentes
+ANSWER_TOKEN_CAP = int(os.getenv("ANSWER_TOKEN_CAP", "180"))
+# Part du budget restant réservée à l'historique de conversation
+HISTORY_SHARE = float(os.getenv("HISTORY_SHARE", "0.3"))
+HISTORY_MAX_MESSAGES = 8
+# Deux réponses dont les mots se recouvrent à ce point sont considérées comme des doublons
+DUPLICATE_JACCARD = 0.8
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_TAG_RE = re.compile(r"<[^>]+>")
+_HREF_RE = re.compile(r"""<a\s[^>]*href=["']([^"']+)["'][^>]*>(.*?)</a>""", re.IGNORECASE | re.DOTALL)
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token count estimate (no tokenizer download, no API call).
+
+    Counts words and punctuation; long words are split like a subword
+    tokenizer would (~1 extra token per 6 characters). The exact count is the
+    `input_token_count` returned by watsonx (logged in the telemetry).
+    """
+    if not text:
+        return 0
+    return sum(1 + len(t) // 6 for t in _TOKEN_RE.findall(text))
+
+
+def html_to_text(text: str) -> str:
+    """Strip the HTML markup of a FAQ answer, keeping link targets."""
+    text = _HREF_RE.sub(lambda m: f"{m.group(2)} ({m.group(1)})", text)
+    text = re.sub(r"<br\s*/?>|</p>|</li>|</div>", "\n", text, flags=re.IGNORECASE)
+    text = html.unescape(_TAG_RE.sub(" ", text))
+    text = re.sub(r"[ \t\xa0]+", " ", text)
+    return re.sub(r"\s*\n\s*", "\n", text).strip()
+
+
+def _words(text: str) -> set:
+    return {w for w in re.findall(r"\w+", text.lower()) if len(w) > 2}
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` at the last word boundary that fits in `max_tokens`."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used, end = 0, 0
+    for m in _TOKEN_RE.finditer(text):
+        used += 1 + len(m.group()) // 6
+        if used > max_tokens:
+            break
+        end = m.end()
+    return text[:end].rstrip() + " …"
+
+
+def extract_relevant(text: str, question: str, max_tokens: int) -> str:
+    """
+    Shorten a long answer to its sentences sharing the most words with the
+    question, kept in their original order, within `max_tokens`.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sentences = [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()]
+    query = _words(question)
+    # Score : mots en commun avec la question ; à égalité, la phrase la plus tôt (souvent la réponse directe)
+    ranked = sorted(range(len(sentences)),
+                    key=lambda i: (len(query & _words(sentences[i])), -i), reverse=True)
+    kept, used = set(), 0
+    for i in ranked:
+        cost = estimate_tokens(sentences[i])
+        if used + cost > max_tokens:
+            continue
+        kept.add(i)
+        used += cost
+    if not kept:
+        return truncate_to_tokens(sentences[ranked[0]], max_tokens)
+    return " ".join(sentences[i] for i in sorted(kept))
+
+
+def assemble_context(question: str, retrieved, chat_history, language_label: str,
+                     budget: int, answer_cap: int = ANSWER_TOKEN_CAP, history_share: float = HISTORY_SHARE) -> dict:
+    """
+    Fit the retrieved Q&A and the conversation into `budget` tokens.
+
+    - the last assistant answer (shown in its own section) is capped and not repeated in the history;
+    - retrieved rows are cleaned of HTML, deduplicated, long answers reduced to
+      their most relevant sentences, and added best-first (lowest `_distance`)
+      until their share is used: the lowest-scoring rows are dropped first;
+    - history messages are added newest-first with what is left.
+
+    Returns:
+        dict: retrieval_context, conv_context, last_assistant_answer, rows_used,
+        rows_dropped, tokens (estimated tokens of the three contexts).
+    """
+    student = "Étudiant" if language_label == "Français" else "Student"
+    history = [m for m in (chat_history or [])[-HISTORY_MAX_MESSAGES:] if m.get("content")]
+
+    # --- Dernière réponse de l'assistant ---
+    last_assistant_answer, last_index = "", None
+    for i in range(len(history) - 1, -1, -1):
+        if history[i].get("role") == "assistant":
+            last_index = i
+            last_assistant_answer = truncate_to_tokens(history[i]["content"], min(answer_cap, budget // 4))
+            break
+    remaining = max(0, budget - estimate_tokens(last_assistant_answer))
+    history_budget = int(remaining * history_share) if len(history) > 1 else 0
+
+    # --- Contexte Q&R ---
+    if "_distance" in retrieved.columns:
+        retrieved = retrieved.sort_values("_distance")
+    blocks, seen, dropped = [], [], 0
+    retrieval_budget = remaining - history_budget
+    used = 0
+    for _, row in retrieved.iterrows():
+        answer = html_to_text(str(row["answer"]))
+        words = _words(f"{row['question']} {answer}")
+        if any(_jaccard(words, other) >= DUPLICATE_JACCARD for other in seen):
+            dropped += 1
+            continue
+        block = f"Q: {row['question']}\nA: {extract_relevant(answer, question, answer_cap)}\n\n"
+        cost = estimate_tokens(block)
+        if used + cost > retrieval_budget:
+            if blocks:
+                dropped += 1
+                continue
+            # Toujours au moins la meilleure ligne, tronquée
+            block = truncate_to_tokens(block, retrieval_budget) + "\n\n"
+            cost = estimate_tokens(block)
+        blocks.append(block)
+        seen.append(words)
+        used += cost
+
+    # --- Contexte conversationnel : du plus récent au plus ancien ---
+    history_budget = remaining - used
+    lines, history_used = [], 0
+    for i in range(len(history) - 1, -1, -1):
+        msg = history[i]
+        if i == last_index or msg.get("role") not in ("user", "assistant"):
+            continue
+        # app.py ajoute la question courante à l'historique : elle a déjà sa propre section
+        if i == len(history) - 1 and msg["content"].strip() == question.strip():
+            continue
+        speaker = student if msg["role"] == "user" else "Assistant"
+        line = f"{speaker}: {msg['content']}\n"
+        cost = estimate_tokens(line)
+        if history_used + cost > history_budget:
+            break
+        lines.append(line)
+        history_used += cost
+
+    return {
+        "retrieval_context": "".join(blocks),
+        "conv_context": "".join(reversed(lines)),
+        "last_assistant_answer": last_assistant_answer,
+        "rows_used": len(blocks),
+        "rows_dropped": dropped,
+        "tokens": used + history_used + estimate_tokens(last_assistant_answer),
+    }
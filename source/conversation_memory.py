@@ -0,0 +1,183 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from source.context_builder import estimate_tokens, html_to_text, truncate_to_tokens
+from source.instrumentation import metrics
+
+# Derniers échanges (question + réponse) gardés mot pour mot dans le prompt ; les plus
+# anciens sont repliés dans un résumé de taille fixe
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "3"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "200"))
+# extractive (défaut : une ligne par échange, sans appel LLM) | llm (résumé réécrit par watsonx)
+SUMMARY_BACKEND = os.getenv("SUMMARY_BACKEND", "extractive")
+MEMORY_TTL_S = float(os.getenv("MEMORY_TTL_S", str(6 * 3600)))
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "1000"))
+
+# Taille max d'une ligne du résumé extractif
+TURN_LINE_TOKENS = 40
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def _first_sentence(text: str) -> str:
+    text = html_to_text(text).replace("\n", " ")
+    return _SENTENCE_END.split(text, 1)[0]
+
+
+def extractive_summary(previous: str, turns: list, language_label: str, budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Fold `turns` into `previous`: one line per exchange (question and first
+    sentence of the answer); the oldest lines go first when over `budget`.
+    """
+    lines = [l for l in previous.splitlines() if l.strip()]
+    for turn in turns:
+        lines.append(truncate_to_tokens(f"- {turn['question']} → {_first_sentence(turn['answer'])}", TURN_LINE_TOKENS))
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > budget:
+        lines.pop(0)
+    return truncate_to_tokens("\n".join(lines), budget)
+
+
+def llm_summary(previous: str, turns: list, language_label: str, budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """Rewrite `previous` + `turns` into one short summary with watsonx (extractive on failure)."""
+    from source.llm_gateway import llm_gateway
+
+    exchanges = "\n".join(f"Q: {t['question']}\nA: {html_to_text(t['answer'])}" for t in turns)
+    if language_label == "Français":
+        prompt = (f"Résume en quelques phrases (moins de {budget} mots) ce que l'étudiant a demandé et ce qui "
+                  f"lui a été répondu. Garde les faits utiles (dates, montants, démarches).\n\n"
+                  f"--- Résumé précédent ---\n{previous or '(aucun)'}\n--- Nouveaux échanges ---\n{exchanges}\n\nRésumé:")
+    else:
+        prompt = (f"Summarize in a few sentences (under {budget} words) what the student asked and what they "
+                  f"were told. Keep useful facts (dates, amounts, procedures).\n\n"
+                  f"--- Previous summary ---\n{previous or '(none)'}\n--- New exchanges ---\n{exchanges}\n\nSummary:")
+    try:
+        response = llm_gateway.generate(prompt, {"max_new_tokens": budget, "temperature": 0})
+        return truncate_to_tokens(response["results"][0]["generated_text"].strip(), budget)
+    except Exception:
+        logger.exception("LLM summary failed, falling back to the extractive summary")
+        return extractive_summary(previous, turns, language_label, budget)
+
+
+class ConversationMemory:
+    """
+    Per-session rolling memory: the last `recent_turns` exchanges verbatim plus a
+    summary of everything older.
+
+    Recording a turn never waits for the summary: once exchanges fall out of the
+    recent window they are folded into the summary by a background thread, one
+    refresh at a time per session. Until that refresh lands, the previous summary
+    is used (the prompt stays the same size).
+    """
+
+    def __init__(self, summarize=None, recent_turns: int = MEMORY_RECENT_TURNS,
+                 max_sessions: int = MEMORY_MAX_SESSIONS, ttl_s: float = MEMORY_TTL_S):
+        self.summarize = summarize or (llm_summary if SUMMARY_BACKEND == "llm" else extractive_summary)
+        self.recent_turns = recent_turns
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.refreshes = 0
+        self._sessions = OrderedDict()  # session_id -> {"summary", "turns", "refreshing", "touched"}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-summary")
+
+    def _evict(self, now: float):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session["touched"] < self.ttl_s:
+                break
+            del self._sessions[session_id]
+
+    def record_turn(self, session_id: str, question: str, answer: str, language_label: str):
+        """Add one exchange; schedules a summary refresh when older turns are waiting to be folded."""
+        if not session_id or not answer:
+            return
+        with self._lock:
+            now = time.monotonic()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = {"summary": "", "turns": [], "refreshing": False}
+            session["touched"] = now
+            self._sessions.move_to_end(session_id)
+            session["turns"].append({"question": question, "answer": answer, "language": language_label})
+            schedule = len(session["turns"]) > self.recent_turns and not session["refreshing"]
+            if schedule:
+                session["refreshing"] = True
+            self._evict(now)
+        if schedule:
+            self._executor.submit(self._refresh, session_id)
+
+    def _refresh(self, session_id: str):
+        while True:
+            with self._lock:
+                session = self._sessions.get(session_id)
+                if session is None:
+                    return
+                n_fold = len(session["turns"]) - self.recent_turns
+                if n_fold <= 0:
+                    session["refreshing"] = False
+                    return
+                previous, turns = session["summary"], session["turns"][:n_fold]
+            start = time.perf_counter()
+            try:
+                summary = self.summarize(previous, turns, turns[-1]["language"])
+            except Exception:
+                logger.exception("Conversation summary failed for session %s", session_id)
+                with self._lock:
+                    session["refreshing"] = False
+                return
+            metrics.observe("helpai_summary_refresh_seconds", time.perf_counter() - start)
+            with self._lock:
+                session["summary"] = summary
+                del session["turns"][:n_fold]
+                self.refreshes += 1
+            # Des échanges ont pu arriver pendant le résumé : on reboucle
+
+    def context(self, session_id: str):
+        """
+        (recent messages, summary) of `session_id`, or (None, "") for an unknown session.
+
+        The messages use the chat_history format ({"role", "content"}).
+        """
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                return None, ""
+            messages = []
+            for turn in session["turns"][-self.recent_turns:]:
+                messages.append({"role": "user", "content": turn["question"]})
+                messages.append({"role": "assistant", "content": turn["answer"]})
+            return messages, session["summary"]
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def wait_idle(self, timeout: float = 5.0) -> bool:
+        """Wait for the pending summary refreshes (tests, benchmarks)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not any(s["refreshing"] for s in self._sessions.values()):
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "refreshes": self.refreshes,
+                "refreshing": sum(s["refreshing"] for s in self._sessions.values()),
+                "summary_tokens": sum(estimate_tokens(s["summary"]) for s in self._sessions.values()),
+            }
+
+
+conversation_memory = ConversationMemory()
+metrics.register_collector("helpai_conversation_memory", conversation_memory.stats)
@@ -0,0 +1,119 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_question(text: str) -> str:
+    """Normalize a question so trivial variants (case, accents form, spaces) share a cache entry."""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = re.sub(r"\s+", " ", text).strip().lower()
+    # Ponctuation finale ("?", "!", ".") sans impact sur le sens de la question
+    return text.rstrip(" ?!.")
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings, keyed by (embedding model id, normalized question).
+
+    Entries live in a bounded in-memory OrderedDict. When `persist_path` is set,
+    every embedding is also written to a small SQLite file so the cache survives
+    restarts; memory misses fall back to that file before calling the encoder.
+    """
+
+    def __init__(self, model_id: str, max_size: int = 1024, persist_path: str = None):
+        self.model_id = model_id
+        self.max_size = max_size
+        self.persist_path = persist_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    def _key(self, text: str) -> str:
+        raw = f"{self.model_id}\x00{normalize_question(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, text: str):
+        """Return the cached embedding for `text`, or None."""
+        key = self._key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector) -> np.ndarray:
+        """Store the embedding of `text` (in memory, and on disk when persistence is enabled) and return it."""
+        key = self._key(text)
+        vector = np.array(vector, dtype=np.float32)
+        # Lecture seule : les appelants partagent le même tableau
+        vector.setflags(write=False)
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector) VALUES (?, ?)",
+                    (key, vector.tobytes()),
+                )
+                self._db.commit()
+        return vector
+
+    def get_or_encode(self, text: str, encode_fn):
+        """Return the cached embedding of `text`, calling `encode_fn(text)` only on a miss."""
+        vector = self.get(text)
+        if vector is None:
+            vector = self.put(text, encode_fn(text))
+        return vector
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "model_id": self.model_id,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def clear(self):
+        """Drop every entry (memory and disk) and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM query_embeddings")
+                self._db.commit()
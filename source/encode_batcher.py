@@ -0,0 +1,117 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from source.instrumentation import metrics
+
+# Nombre max de questions par appel à encode() et attente max pour remplir un lot.
+# ENCODE_BATCH_MAX=1 désactive le regroupement (un appel à encode() par question).
+ENCODE_BATCH_MAX = int(os.getenv("ENCODE_BATCH_MAX", "16"))
+ENCODE_BATCH_WAIT_MS = float(os.getenv("ENCODE_BATCH_WAIT_MS", "2"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class EncodeBatcher:
+    """
+    Micro-batching scheduler in front of an encoder.
+
+    Concurrent callers of `encode` are queued; a single worker thread takes the
+    first pending text, waits up to `max_wait_ms` for more (or until `max_batch`
+    texts), encodes them in one `encode_many` call and hands each caller its vector.
+    While a batch is being encoded new texts keep queueing, so under load the
+    batches grow on their own even with a tiny `max_wait_ms`.
+    """
+
+    def __init__(self, encode_many, max_batch: int = ENCODE_BATCH_MAX, max_wait_ms: float = ENCODE_BATCH_WAIT_MS,
+                 name: str = "encode"):
+        self.encode_many = encode_many
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue `text` and return a Future resolved with its vector."""
+        self._ensure_worker()
+        future = Future()
+        future.stats = {}
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, text: str, stats: dict = None):
+        """
+        Vector of `text`, encoded together with the other pending texts.
+
+        Args:
+            stats (dict | None): Filled with the batch size and the queueing delay (queue_s).
+        """
+        if self.max_batch == 1:
+            # Pas de regroupement : appel direct, sans passer par le thread
+            return self.encode_many([text])[0]
+        future = self.submit(text)
+        vector = future.result()
+        if stats is not None:
+            stats.update(future.stats)
+        return vector
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch) < self.max_batch:
+            try:
+                # Ce qui attend déjà part dans le lot, sans délai
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                vectors = self.encode_many([text for text, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            metrics.observe(f"helpai_{self.name}_batch_size", len(batch), buckets=BATCH_SIZE_BUCKETS)
+            for (_, future, queued_at), vector in zip(batch, vectors):
+                queue_s = started - queued_at
+                metrics.observe(f"helpai_{self.name}_queue_seconds", queue_s)
+                future.stats = {"batch_size": len(batch), "queue_s": queue_s}
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        """Batch counters (mean batch size since start)."""
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait_s * 1000,
+        }
@@ -0,0 +1,86 @@
+import argparse
+import os
+
+# --- Backend de l'encodeur e5 ---
+# torch     : SentenceTransformer PyTorch fp32 (comportement historique)
+# onnx      : graphe ONNX exporté (ONNX Runtime, CPU)
+# onnx-int8 : même graphe, poids quantifiés en int8 (quantification dynamique)
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join("models", "multilingual-e5-base-onnx"))
+# Jeu d'instructions ciblé par la quantification : avx2 (tous les x86 récents), avx512, avx512_vnni, arm64
+ONNX_QUANTIZATION = os.getenv("ONNX_QUANTIZATION", "avx2")
+
+# e5 est entraîné avec ces préfixes. Les questions de la FAQ et la question de
+# l'utilisateur se comparent entre elles (tâche symétrique) : "query: " des deux côtés ;
+# les réponses sont des documents : "passage: ".
+QUERY_PREFIX = "query: "
+PASSAGE_PREFIX = "passage: "
+# Posé dans le schéma des tables encodées avec préfixes (les anciennes tables n'en ont pas)
+PREFIX_METADATA_KEY = b"e5_prefixes"
+
+
+def quantized_file_name(quantization: str = ONNX_QUANTIZATION) -> str:
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+
+def load_encoder(model_name: str, backend: str = ENCODER_BACKEND, onnx_dir: str = ONNX_MODEL_DIR,
+                 quantization: str = ONNX_QUANTIZATION):
+    """
+    Load the sentence encoder with the requested backend.
+
+    Args:
+        model_name (str): Hugging Face model id (used by the "torch" backend).
+        backend (str): "torch", "onnx" or "onnx-int8".
+        onnx_dir (str): Folder written by `export_onnx` (ONNX backends).
+
+    Returns:
+        SentenceTransformer: Same `encode` API whatever the backend.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device="cpu")
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}' (expected one of {', '.join(ENCODER_BACKENDS)})")
+    if not os.path.isdir(onnx_dir):
+        raise FileNotFoundError(
+            f"ONNX model not found in '{onnx_dir}'. Export it first: python -m source.encoder --export"
+        )
+    model_kwargs = {"file_name": quantized_file_name(quantization)} if backend == "onnx-int8" else None
+    return SentenceTransformer(onnx_dir, backend="onnx", device="cpu", model_kwargs=model_kwargs)
+
+
+def export_onnx(model_name: str, output_dir: str = ONNX_MODEL_DIR, quantization: str = ONNX_QUANTIZATION):
+    """
+    Export `model_name` to ONNX in `output_dir` (onnx/model.onnx) plus its
+    dynamically int8-quantized variant (onnx/model_qint8_<quantization>.onnx).
+
+    Requires `optimum[onnxruntime]`.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+    model.save_pretrained(output_dir)
+    export_dynamic_quantized_onnx_model(model, quantization, output_dir)
+    print(f"✅ Modèle ONNX exporté dans '{output_dir}' (fp32 + {quantized_file_name(quantization)})")
+
+
+def table_uses_prefixes(table) -> bool:
+    """True when `table` was encoded with the e5 prefixes (see load_QA.qa_schema)."""
+    return (table.schema.metadata or {}).get(PREFIX_METADATA_KEY) == b"1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporte l'encodeur e5 en ONNX (fp32 + int8).")
+    parser.add_argument("--export", action="store_true", help="Exporte le modèle et sa version quantifiée")
+    parser.add_argument("--model", default="intfloat/multilingual-e5-base")
+    parser.add_argument("--output", default=ONNX_MODEL_DIR)
+    parser.add_argument("--quantization", default=ONNX_QUANTIZATION,
+                        choices=["arm64", "avx2", "avx512", "avx512_vnni"])
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx(args.model, args.output, args.quantization)
+    else:
+        parser.print_help()
@@ -0,0 +1,120 @@
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from source.filters import normalize_language, normalize_schools
+from source.vector_index import VECTOR_COLUMN
+
+# lancedb (défaut) | numpy : recherche exacte en mémoire, pour un qa_table de quelques centaines de lignes
+RETRIEVAL_ENGINE = os.getenv("RETRIEVAL_ENGINE", "lancedb")
+# Matrice des embeddings (.npy, ouverte en memmap) et colonnes texte, une paire de fichiers par version de la table
+EXACT_SEARCH_DIR = os.getenv("EXACT_SEARCH_DIR", "exact_search_cache")
+# Intervalle minimal entre deux vérifications de la version de qa_table
+VERSION_CHECK_S = 5.0
+
+ROW_COLUMNS = ["question", "answer", "ecole", "langue"]
+
+
+class ExactSearchIndex:
+    """
+    Brute-force L2 search over a memory-mapped float32 matrix.
+
+    Row masks per school and per language are precomputed; a query is one
+    matrix-vector product, a mask and an `argpartition`. Distances are the
+    squared L2 distances LanceDB returns, so both engines rank identically.
+    """
+
+    def __init__(self, vectors: np.ndarray, rows: dict, version: int):
+        self.vectors = vectors
+        self.sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+        self.rows = {col: np.asarray(rows[col], dtype=object) for col in ROW_COLUMNS}
+        self.version = version
+        self._checked_at = time.monotonic()
+
+        n = len(vectors)
+        schools = [normalize_schools(e) for e in rows["ecole"]]
+        langs = [normalize_language(l) for l in rows["langue"]]
+        self.school_masks = {}
+        for i, row_schools in enumerate(schools):
+            for school in row_schools:
+                self.school_masks.setdefault(school, np.zeros(n, dtype=bool))[i] = True
+        self.language_masks = {code: np.array([l == code for l in langs]) for code in set(langs)}
+        self._subsets = {}
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _subset(self, school: str, language: str) -> np.ndarray:
+        key = ((school or "").strip().lower(), normalize_language(language) if language else "")
+        rows = self._subsets.get(key)
+        if rows is None:
+            mask = np.ones(len(self), dtype=bool)
+            if key[0]:
+                mask &= self.school_masks.get(key[0], np.zeros(len(self), dtype=bool))
+            if key[1]:
+                mask &= self.language_masks.get(key[1], np.zeros(len(self), dtype=bool))
+            rows = self._subsets[key] = np.flatnonzero(mask)
+        return rows
+
+    def search(self, query_vec, school: str, language: str, top_k: int = 3) -> pd.DataFrame:
+        """Exact top_k rows of `school` in `language` (same columns as the LanceDB path)."""
+        query = np.asarray(query_vec, dtype=np.float32)
+        subset = self._subset(school, language)
+        if not len(subset) or top_k <= 0:
+            return pd.DataFrame(columns=ROW_COLUMNS + ["_distance"])
+        # ||q - x||² = ||x||² - 2 q.x + ||q||²
+        distances = (self.sq_norms - 2 * (self.vectors @ query))[subset]
+        k = min(top_k, len(subset))
+        best = np.argpartition(distances, k - 1)[:k] if k < len(subset) else np.arange(len(subset))
+        best = best[np.argsort(distances[best], kind="stable")]
+        rows = subset[best]
+        found = {col: self.rows[col][rows] for col in ROW_COLUMNS}
+        found["_distance"] = distances[best] + float(query @ query)
+        return pd.DataFrame(found)
+
+    def is_current(self, version_fn, every_s: float = VERSION_CHECK_S) -> bool:
+        """False when `version_fn()` reports a new table version (checked at most every `every_s`)."""
+        now = time.monotonic()
+        if now - self._checked_at < every_s:
+            return True
+        self._checked_at = now
+        return version_fn() == self.version
+
+
+def _cache_files(cache_dir: str, table_name: str, version) -> tuple:
+    base = os.path.join(cache_dir, f"{table_name}-v{version}")
+    return base + ".npy", base + ".json"
+
+
+def load_exact_index(table, cache_dir: str = EXACT_SEARCH_DIR, vector_column: str = VECTOR_COLUMN) -> ExactSearchIndex:
+    """
+    Exact-search index of `table`, memory-mapped from `cache_dir`.
+
+    The matrix and text columns are exported on first use for each table
+    version; files of older versions are removed.
+    """
+    version = table.version
+    npy_path, json_path = _cache_files(cache_dir, table.name, version)
+    if not (os.path.exists(npy_path) and os.path.exists(json_path)):
+        data = table.to_arrow()
+        column = data.column(vector_column).combine_chunks()
+        # float16 possible après maintenance : la matrice en mémoire est toujours en float32
+        vectors = np.ascontiguousarray(column.flatten().to_numpy().reshape(len(column), -1), dtype=np.float32)
+        os.makedirs(cache_dir, exist_ok=True)
+        for old in glob.glob(os.path.join(cache_dir, f"{table.name}-v*")):
+            os.remove(old)
+        # Écriture atomique : un autre processus peut lire le cache en même temps
+        with open(npy_path + ".tmp", "wb") as f:
+            np.save(f, vectors)
+        with open(json_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({col: data.column(col).to_pylist() for col in ROW_COLUMNS}, f, ensure_ascii=False)
+        os.replace(npy_path + ".tmp", npy_path)
+        os.replace(json_path + ".tmp", json_path)
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        rows = json.load(f)
+    return ExactSearchIndex(np.load(npy_path, mmap_mode="r"), rows, version)
@@ -0,0 +1,323 @@
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from source.instrumentation import metrics
+
+# Base SQLite (mode WAL) des avis de fin de conversation
+FEEDBACK_DB_PATH = os.getenv("FEEDBACK_DB_PATH", "feedback.sqlite")
+# Commit groupé : au plus FEEDBACK_BATCH_MAX avis par transaction, au plus FEEDBACK_FLUSH_MS d'attente
+FEEDBACK_BATCH_MAX = int(os.getenv("FEEDBACK_BATCH_MAX", "64"))
+FEEDBACK_FLUSH_MS = float(os.getenv("FEEDBACK_FLUSH_MS", "500"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    hash TEXT PRIMARY KEY,
+    text BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    review_id TEXT PRIMARY KEY,
+    ts TEXT NOT NULL,
+    school TEXT,
+    rating INTEGER,
+    review_text TEXT,
+    n_messages INTEGER NOT NULL,
+    transcript BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reviews_school_ts ON reviews (school, ts);
+"""
+
+_STOP = object()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    # WAL : les lectures (export, stats) ne bloquent pas l'écrivain, et plusieurs
+    # instances Streamlit peuvent partager le même fichier
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def _answer_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def pack_transcript(messages: list):
+    """
+    (compressed transcript, {hash: answer}) of `messages`.
+
+    Assistant answers are replaced by the hash of their text: the same FAQ
+    answers come back in many conversations and are stored once in `answers`.
+    """
+    answers, packed = {}, []
+    for message in messages:
+        if message.get("role") == "assistant" and message.get("content"):
+            digest = _answer_hash(message["content"])
+            answers[digest] = message["content"]
+            packed.append({**{k: v for k, v in message.items() if k != "content"}, "ref": digest})
+        else:
+            packed.append(message)
+    blob = zlib.compress(json.dumps(packed, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return blob, answers
+
+
+def unpack_transcript(blob: bytes, answers: dict) -> list:
+    """Inverse of `pack_transcript` (`answers` maps hash -> answer text)."""
+    messages = []
+    for message in json.loads(zlib.decompress(blob)):
+        if "ref" in message:
+            message = {**{k: v for k, v in message.items() if k != "ref"}, "content": answers.get(message["ref"], "")}
+        messages.append(message)
+    return messages
+
+
+class FeedbackStore:
+    """
+    Durable store of the end-of-conversation reviews (rating, text, transcript).
+
+    `submit()` only queues the review, so the UI never waits on disk. A daemon
+    thread drains the queue and group-commits the reviews in one SQLite
+    transaction (every `batch_size` reviews or `flush_interval_s` seconds).
+    Submitting the same `review_id` again replaces the previous review.
+    """
+
+    def __init__(self, path: str = FEEDBACK_DB_PATH, batch_size: int = FEEDBACK_BATCH_MAX,
+                 flush_interval_s: float = FEEDBACK_FLUSH_MS / 1000, queue_size: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.written = 0
+        self.dropped = 0
+        self.commits = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Relancé aussi si l'écrivain s'est arrêté sur une erreur imprévue
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None:
+                    atexit.register(self.close)
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+                    self._thread.start()
+
+    def submit(self, review: dict) -> bool:
+        """
+        Queue one review. Never blocks.
+
+        Args:
+            review (dict): `review_id`, `school`, `rating`, `review_text`,
+                `chat_history` (list of {"role", "content"}) and optionally `timestamp`.
+
+        Returns:
+            bool: False if the queue is full (the review is dropped and counted).
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(review)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc("helpai_feedback_dropped")
+            return False
+
+    def _run(self):
+        db = None
+        batch, waiters = [], []
+        deadline = time.monotonic() + self.flush_interval_s
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None and item is not _STOP:
+                batch.append(item)
+            if item is _STOP or waiters or len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                if batch:
+                    try:
+                        # Connexion (re)tentée à chaque lot : dossier en lecture seule, base verrouillée…
+                        db = db or _connect(self.path)
+                        self._write(db, batch)
+                    except Exception as e:
+                        self._drop(len(batch), e)
+                for event in waiters:
+                    event.set()
+                batch, waiters = [], []
+                deadline = time.monotonic() + self.flush_interval_s
+            if item is _STOP:
+                if db is not None:
+                    db.close()
+                return
+
+    def _drop(self, n: int, error: Exception):
+        self.dropped += n
+        metrics.inc("helpai_feedback_dropped", n)
+        print(f"⚠️  {n} avis non enregistré(s) : {type(error).__name__} {error}")
+
+    def _write(self, db: sqlite3.Connection, batch: list):
+        start = time.perf_counter()
+        rows, answers = [], {}
+        for review in batch:
+            try:
+                messages = review.get("chat_history") or []
+                blob, review_answers = pack_transcript(messages)
+                row = (
+                    review["review_id"],
+                    review.get("timestamp") or datetime.now().isoformat(),
+                    review.get("school"),
+                    review.get("rating"),
+                    review.get("review_text") or "",
+                    len(messages),
+                    blob,
+                )
+            except Exception as e:
+                # Avis mal formé : écarté seul, le reste du lot est écrit
+                self._drop(1, e)
+                continue
+            answers.update(review_answers)
+            rows.append(row)
+        if not rows:
+            return
+        try:
+            with db:
+                db.executemany(
+                    "INSERT OR IGNORE INTO answers (hash, text) VALUES (?, ?)",
+                    [(h, zlib.compress(t.encode("utf-8"))) for h, t in answers.items()],
+                )
+                db.executemany("INSERT OR REPLACE INTO reviews VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.written += len(rows)
+            self.commits += 1
+            metrics.observe("helpai_feedback_commit_seconds", time.perf_counter() - start)
+        except Exception as e:  # sqlite3.Error, valeur non stockable…
+            self._drop(len(rows), e)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until every review queued so far is committed."""
+        self._ensure_started()
+        done = threading.Event()
+        self._queue.put(done, timeout=timeout)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """Commit pending reviews and stop the writer thread."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            self.dropped += 1
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {"written": self.written, "dropped": self.dropped, "commits": self.commits,
+                "pending": self._queue.qsize()}
+
+    # --- Lecture / export (connexion dédiée : ne bloque pas l'écrivain en mode WAL) ---
+
+    def _read(self) -> sqlite3.Connection:
+        db = _connect(self.path)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def ratings_by_school(self, since: str = None) -> list:
+        """
+        Rating statistics per school.
+
+        Args:
+            since (str): Only reviews with an ISO timestamp >= `since`.
+
+        Returns:
+            list[dict]: `school`, `reviews`, `avg_rating` and the count of each rating (`stars_1`..`stars_5`).
+        """
+        stars = ", ".join(f"SUM(rating = {i}) AS stars_{i}" for i in range(1, 6))
+        db = self._read()
+        try:
+            rows = db.execute(
+                f"SELECT school, COUNT(*) AS reviews, AVG(rating) AS avg_rating, {stars} "
+                "FROM reviews WHERE ts >= ? GROUP BY school ORDER BY school",
+                (since or "",),
+            ).fetchall()
+        finally:
+            db.close()
+        return [dict(r) for r in rows]
+
+    def reviews(self, school: str = None, since: str = None, with_transcript: bool = False):
+        """Reviews (oldest first) as dicts, optionally with the full `chat_history`."""
+        query = "SELECT * FROM reviews WHERE ts >= ?"
+        params = [since or ""]
+        if school:
+            query += " AND school = ?"
+            params.append(school)
+        db = self._read()
+        try:
+            answers = {}
+            for row in db.execute(query + " ORDER BY ts", params):
+                review = {k: row[k] for k in row.keys() if k != "transcript"}
+                if with_transcript:
+                    blob = row["transcript"]
+                    missing = {m["ref"] for m in json.loads(zlib.decompress(blob)) if "ref" in m} - answers.keys()
+                    for h in missing:
+                        found = db.execute("SELECT text FROM answers WHERE hash = ?", (h,)).fetchone()
+                        answers[h] = zlib.decompress(found[0]).decode("utf-8") if found else ""
+                    review["chat_history"] = unpack_transcript(blob, answers)
+                yield review
+        finally:
+            db.close()
+
+    def export(self, output: str, school: str = None, since: str = None, with_transcript: bool = True) -> int:
+        """Write the reviews to `output` as JSONL; returns the number of reviews."""
+        n = 0
+        with open(output, "w", encoding="utf-8") as f:
+            for review in self.reviews(school, since, with_transcript):
+                f.write(json.dumps(review, ensure_ascii=False) + "\n")
+                n += 1
+        return n
+
+    def disk_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+
+
+# Store partagé par tout le processus
+feedback_store = FeedbackStore()
+metrics.register_collector("helpai_feedback_store", feedback_store.stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Avis enregistrés : notes par école et export JSONL.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    stats_parser = sub.add_parser("stats", help="Note moyenne et répartition par école")
+    stats_parser.add_argument("--since", help="Date ISO minimale (ex: 2025-01-01)")
+    export_parser = sub.add_parser("export", help="Exporter les avis (et les conversations) en JSONL")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--school")
+    export_parser.add_argument("--since", help="Date ISO minimale (ex: 2025-01-01)")
+    export_parser.add_argument("--no-transcript", action="store_true", help="Sans le contenu des conversations")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        rows = feedback_store.ratings_by_school(args.since)
+        if not rows:
+            print("📭 Aucun avis enregistré.")
+        for r in rows:
+            spread = " ".join(f"{i}⭐:{r[f'stars_{i}']}" for i in range(1, 6))
+            print(f"🏫 {str(r['school']).upper():<10} {r['reviews']:>5} avis  moyenne {r['avg_rating']:.2f}  {spread}")
+    else:
+        n = feedback_store.export(args.output, args.school, args.since, not args.no_transcript)
+        print(f"💾 {n} avis exportés dans {args.output}")
@@ -0,0 +1,84 @@
+import re
+
+import pyarrow as pa
+
+# Colonnes normalisées ajoutées à qa_table au chargement (indexées pour le pré-filtrage)
+SCHOOLS_COLUMN = "ecoles"        # list<string> : ["emlv", "esilv", ...]
+LANGUAGE_COLUMN = "langue_code"  # string : "fr" | "en"
+FILTER_COLUMNS = (SCHOOLS_COLUMN, LANGUAGE_COLUMN)
+
+LANGUAGE_CODES = {
+    "français": "fr",
+    "francais": "fr",
+    "french": "fr",
+    "fr": "fr",
+    "english": "en",
+    "anglais": "en",
+    "en": "en",
+}
+
+
+def normalize_schools(raw: str) -> list:
+    """Split the CSV `Écoles` field ("EMLV|ESILV|IIM") into lowercase school ids."""
+    if not raw:
+        return []
+    schools = []
+    for part in re.split(r"[|,;]", str(raw)):
+        part = part.strip().lower()
+        if part and part != "nan" and part not in schools:
+            schools.append(part)
+    return schools
+
+
+def normalize_language(raw: str) -> str:
+    """Map a language label ("Français", "English", "Anglais", "fr"...) to its ISO code."""
+    label = str(raw or "").strip().lower()
+    return LANGUAGE_CODES.get(label, label)
+
+
+def filter_columns(ecole: list, langue: list) -> list:
+    """Build the normalized filter columns (as Arrow arrays) for raw `ecole` / `langue` values."""
+    return [
+        pa.array([normalize_schools(e) for e in ecole], type=pa.list_(pa.string())),
+        pa.array([normalize_language(l) for l in langue], type=pa.string()),
+    ]
+
+
+def filter_fields() -> list:
+    """Arrow fields of the normalized filter columns."""
+    return [
+        pa.field(SCHOOLS_COLUMN, pa.list_(pa.string())),
+        pa.field(LANGUAGE_COLUMN, pa.string()),
+    ]
+
+
+def create_filter_indexes(table):
+    """Create the scalar indexes used by the `where` pre-filter."""
+    table.create_scalar_index(SCHOOLS_COLUMN, index_type="LABEL_LIST", replace=True)
+    table.create_scalar_index(LANGUAGE_COLUMN, index_type="BITMAP", replace=True)
+
+
+def _literal(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def build_where(school: str, language: str, column_names) -> str:
+    """
+    SQL pre-filter selecting the rows of `school` written in `language`.
+
+    Uses the normalized indexed columns when the table has them, and falls
+    back to substring matching on the raw `ecole` / `langue` columns for
+    tables built before they existed.
+    """
+    clauses = []
+    if all(col in column_names for col in FILTER_COLUMNS):
+        if school:
+            clauses.append(f"array_has_any({SCHOOLS_COLUMN}, [{_literal(school.strip().lower())}])")
+        if language:
+            clauses.append(f"{LANGUAGE_COLUMN} = {_literal(normalize_language(language))}")
+    else:
+        if school:
+            clauses.append(f"lower(ecole) LIKE {_literal('%' + school.strip().lower() + '%')}")
+        if language:
+            clauses.append(f"lower(langue) LIKE {_literal('%' + language.strip().lower() + '%')}")
+    return " AND ".join(clauses)
@@ -0,0 +1,212 @@
+import bisect
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Fraction des requêtes dont le détail (lignes retrouvées, réponse) est loggé en DEBUG
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.05"))
+# Si défini, chaque span est aussi écrit en JSONL (via le writer de source/telemetry.py)
+TRACE_PATH = os.getenv("TRACE_PATH")
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DISTANCE_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1, 1.5, 2)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_sampled = contextvars.ContextVar("sampled", default=False)
+
+
+class Metrics:
+    """Minimal in-process metrics registry (counters + histograms) with Prometheus text output."""
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=STAGE_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": tuple(buckets), "counts": [0] * len(buckets),
+                                                "sum": 0.0, "count": 0}
+            i = bisect.bisect_left(hist["buckets"], value)
+            if i < len(hist["counts"]):
+                hist["counts"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def register_collector(self, name: str, fn):
+        """Export `fn()` (a dict of numbers) as gauges `name_<key>` at every scrape."""
+        self._collectors.append((name, fn))
+
+    def snapshot(self) -> dict:
+        """Stage latency summary: {stage: {"count", "sum_s", "mean_s"}}."""
+        with self._lock:
+            out = {}
+            for (name, labels), hist in self._histograms.items():
+                if name != "helpai_stage_seconds":
+                    continue
+                stage = dict(labels)["stage"]
+                out[stage] = {"count": hist["count"], "sum_s": hist["sum"],
+                              "mean_s": hist["sum"] / hist["count"] if hist["count"] else 0.0}
+            return out
+
+    def render_prometheus(self) -> str:
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{name}_total{fmt(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(hist["buckets"], hist["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{name}_sum{fmt(labels)} {hist['sum']}")
+                lines.append(f"{name}_count{fmt(labels)} {hist['count']}")
+        for prefix, fn in self._collectors:
+            for key, value in fn().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+_hooks = []
+
+
+def add_hook(fn):
+    """Call `fn(record)` for every finished span (record: stage, duration_s, request_id, attributes)."""
+    _hooks.append(fn)
+
+
+def remove_hook(fn):
+    if fn in _hooks:
+        _hooks.remove(fn)
+
+
+@contextmanager
+def request_context(request_id: str):
+    """Bind `request_id` to the spans of the current request and decide whether its logs are sampled."""
+    token_id = _request_id.set(request_id)
+    token_sampled = _sampled.set(random.random() < LOG_SAMPLE_RATE)
+    try:
+        yield
+    finally:
+        _request_id.reset(token_id)
+        _sampled.reset(token_sampled)
+
+
+def sampled() -> bool:
+    """True when the current request was picked for detailed debug logging."""
+    return _sampled.get()
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    Time one pipeline stage.
+
+    The yielded dict can be enriched by the caller (e.g. `rec["rows"] = 3`);
+    it is passed to every hook once the stage ends.
+    """
+    record = {"stage": stage, "request_id": _request_id.get(), **attributes}
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = type(e).__name__
+        metrics.inc("helpai_stage_errors", stage=stage)
+        raise
+    finally:
+        record["duration_s"] = time.perf_counter() - start
+        metrics.observe("helpai_stage_seconds", record["duration_s"], stage=stage)
+        for hook in list(_hooks):
+            hook(record)
+
+
+def record_span(stage: str, duration_s: float, **attributes):
+    """Report a stage timed by the caller (e.g. an LLM stream consumed across yields)."""
+    record = {"stage": stage, "request_id": _request_id.get(), **attributes, "duration_s": duration_s}
+    metrics.observe("helpai_stage_seconds", duration_s, stage=stage)
+    for hook in list(_hooks):
+        hook(record)
+
+
+def observe_distances(distances):
+    for d in distances:
+        metrics.observe("helpai_retrieval_distance", float(d), buckets=DISTANCE_BUCKETS)
+
+
+def observe_tokens(kind: str, count):
+    """kind: "prompt_tokens_est" | "prompt_tokens" | "generated_tokens"."""
+    if count is not None:
+        metrics.observe(f"helpai_{kind}", count, buckets=TOKEN_BUCKETS)
+
+
+# --- Exports ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """Serve `/metrics` (Prometheus text format) from a daemon thread. Idempotent."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            logging.getLogger(__name__).info("Metrics exposed on http://%s:%d/metrics", host, port)
+    return _server
+
+
+def _jsonl_trace_hook(path: str):
+    from source.telemetry import TelemetryLog
+    sink = TelemetryLog(path=path)
+
+    def hook(record):
+        sink.emit({k: (round(v, 6) if isinstance(v, float) else v) for k, v in record.items()})
+    return hook
+
+
+if TRACE_PATH:
+    add_hook(_jsonl_trace_hook(TRACE_PATH))
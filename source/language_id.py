@@ -0,0 +1,190 @@
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+FRENCH = "Français"
+ENGLISH = "English"
+LABELS = (FRENCH, ENGLISH)
+
+# ngram (défaut, entraîné sur la colonne Langues du CSV) | langdetect (ancien comportement, graine fixe)
+LANGUAGE_ID_BACKEND = os.getenv("LANGUAGE_ID_BACKEND", "ngram")
+# Langue retenue quand rien ne permet de trancher (question très courte, sans mot connu)
+DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", FRENCH)
+LANGUAGE_CACHE_SIZE = int(os.getenv("LANGUAGE_CACHE_SIZE", "4096"))
+
+NGRAM_RANGE = (1, 4)
+# En dessous, le score n-gramme est complété par le lexique
+SHORT_TEXT_CHARS = 20
+# Écart minimal de log-vraisemblance moyenne (par n-gramme) pour trancher sans le lexique
+MIN_MARGIN = 0.05
+
+# Mots-outils fréquents : suffisent pour les questions de 1 à 3 mots
+LEXICON = {
+    FRENCH: {
+        "le", "la", "les", "un", "une", "des", "du", "de", "et", "ou", "est", "sont", "je", "tu", "il",
+        "nous", "vous", "mon", "ma", "mes", "quand", "comment", "pourquoi", "quoi", "quel", "quelle",
+        "quels", "quelles", "où", "combien", "puis", "peut", "faire", "pour", "avec", "sans", "dans",
+        "sur", "pas", "après", "avant", "merci", "bonjour", "oui", "non", "ai", "suis", "cours", "absence",
+    },
+    ENGLISH: {
+        # pas de "a" ni "on" : ce sont aussi des mots français
+        "the", "an", "and", "or", "is", "are", "i", "you", "he", "we", "my", "when", "how", "why",
+        "what", "which", "where", "can", "could", "do", "does", "for", "with", "without", "in",
+        "not", "after", "before", "thanks", "thank", "hello", "hi", "yes", "no", "am", "course",
+        "many", "much", "should", "will", "there", "about", "of", "to",
+    },
+}
+_FRENCH_CHARS = set("éèêëàâçîïôûùœ")
+_WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFC", text.lower())
+    return " " + " ".join(_WORD_RE.findall(text)) + " "
+
+
+def char_ngrams(text: str, ngram_range=NGRAM_RANGE) -> Counter:
+    """Character n-grams of the normalized text (words padded with spaces)."""
+    text = _normalize(text)
+    grams = Counter()
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        for i in range(len(text) - n + 1):
+            gram = text[i:i + n]
+            if gram.strip():
+                grams[gram] += 1
+    return grams
+
+
+def lexicon_vote(text: str):
+    """FRENCH / ENGLISH from function words and accents, or None when undecided."""
+    words = _WORD_RE.findall(text.lower())
+    fr = sum(w in LEXICON[FRENCH] for w in words) + (2 if _FRENCH_CHARS & set(text.lower()) else 0)
+    en = sum(w in LEXICON[ENGLISH] for w in words)
+    if fr == en:
+        return None
+    return FRENCH if fr > en else ENGLISH
+
+
+class NgramLanguageIdentifier:
+    """
+    Multinomial naive Bayes over character 1-4-grams, deterministic and
+    trained in milliseconds on labelled texts (the `Langues` column of the export).
+    """
+
+    def __init__(self, ngram_range=NGRAM_RANGE, alpha: float = 0.5):
+        self.ngram_range = ngram_range
+        self.alpha = alpha
+        self.counts = {label: Counter() for label in LABELS}
+        self.totals = {label: 0 for label in LABELS}
+        self.docs = {label: 0 for label in LABELS}
+        self.vocab = set()
+        self._log_probs = None
+
+    def fit(self, texts, labels):
+        """Add labelled examples (labels: "Français" / "English"; others are ignored)."""
+        for text, label in zip(texts, labels):
+            if label not in self.counts or not text:
+                continue
+            grams = char_ngrams(text, self.ngram_range)
+            self.counts[label].update(grams)
+            self.totals[label] += sum(grams.values())
+            self.docs[label] += 1
+            self.vocab.update(grams)
+        self._log_probs = None
+        return self
+
+    def _tables(self):
+        # log P(n-gramme | langue) précalculés au premier appel après fit()
+        if self._log_probs is None:
+            n_docs = sum(self.docs.values())
+            tables = {}
+            for label in LABELS:
+                denom = self.totals[label] + self.alpha * len(self.vocab)
+                tables[label] = (
+                    {g: math.log((c + self.alpha) / denom) for g, c in self.counts[label].items()},
+                    math.log(self.alpha / denom),
+                    math.log((self.docs[label] + 1) / (n_docs + 2)),
+                )
+            self._log_probs = tables
+        return self._log_probs
+
+    def scores(self, text: str) -> dict:
+        """Mean log-likelihood per n-gram of `text` for each label (higher is more likely)."""
+        grams = char_ngrams(text, self.ngram_range)
+        n = sum(grams.values())
+        if not n or not self.vocab:
+            return {}
+        out = {}
+        for label, (log_probs, unseen, prior) in self._tables().items():
+            loglik = sum(c * log_probs.get(g, unseen) for g, c in grams.items())
+            out[label] = (loglik + prior) / n
+        return out
+
+    def predict(self, text: str):
+        """
+        Language label of `text`, or None when neither the n-grams nor the
+        lexicon can tell (caller decides the default).
+        """
+        scores = self.scores(text)
+        if not scores:
+            return lexicon_vote(text)
+        best, other = sorted(scores, key=scores.get, reverse=True)
+        margin = scores[best] - scores[other]
+        if len(text.strip()) >= SHORT_TEXT_CHARS and margin >= MIN_MARGIN:
+            return best
+        # Texte court ou indécis : les mots-outils priment, les n-grammes départagent
+        vote = lexicon_vote(text)
+        if vote is not None:
+            return vote
+        return best if margin >= MIN_MARGIN else None
+
+
+class LangdetectIdentifier:
+    """Previous behaviour (langdetect), made deterministic with a fixed seed."""
+
+    def __init__(self):
+        from langdetect import DetectorFactory
+        DetectorFactory.seed = 0
+
+    def predict(self, text: str):
+        from langdetect import detect
+        from langdetect.lang_detect_exception import LangDetectException
+        try:
+            return FRENCH if detect(text) == "fr" else ENGLISH
+        except LangDetectException:  # pas de lettres
+            return None
+
+
+def train_from_csv(csv_path: str = None) -> NgramLanguageIdentifier:
+    """Train the n-gram identifier on the questions and answers of the Q&A export."""
+    from source.context_builder import html_to_text
+    from source.load_QA import CSV_PATH, iter_csv_chunks
+
+    model = NgramLanguageIdentifier()
+    for chunk in iter_csv_chunks(csv_path or CSV_PATH):
+        model.fit(chunk["question"], chunk["langue"])
+        model.fit((html_to_text(a) for a in chunk["answer"]), chunk["langue"])
+    return model
+
+
+def build_identifier(backend: str = LANGUAGE_ID_BACKEND):
+    """Language identifier for `backend` ("ngram" falls back to the lexicon alone without the CSV)."""
+    if backend == "langdetect":
+        return LangdetectIdentifier()
+    if backend != "ngram":
+        raise ValueError(f"Unknown language-ID backend '{backend}' (expected ngram or langdetect)")
+    try:
+        return train_from_csv()
+    except FileNotFoundError:
+        print("⚠️  CSV introuvable : identification de langue par lexique seulement")
+        return NgramLanguageIdentifier()
+
+
+@lru_cache(maxsize=LANGUAGE_CACHE_SIZE)
+def identify(text: str):
+    """Cached language label of `text` (None when undecided), with the shared identifier."""
+    from source.resources import get_language_identifier
+    return get_language_identifier().predict(text)
@@ -0,0 +1,456 @@
+import asyncio
+import hashlib
+import http.client
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from source.instrumentation import metrics
+from source.resources import get_llm
+
+# Appels watsonx en vol max pour tout le processus (au-delà, file d'attente bornée)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+# Token bucket : appels watsonx par seconde (0 = pas de limite) et rafale autorisée
+LLM_RATE_PER_S = float(os.getenv("LLM_RATE_PER_S", "8"))
+LLM_BURST = int(os.getenv("LLM_BURST", "16"))
+# Attente max d'un jeton avant de renvoyer vers le formulaire de contact
+LLM_QUEUE_WAIT_S = float(os.getenv("LLM_QUEUE_WAIT_S", "2"))
+# Délai max d'un appel, relances comprises
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "30"))
+# Appels watsonx sans réponse après le délai de tous leurs appelants : ils ne comptent plus
+# dans LLM_MAX_CONCURRENCY / LLM_MAX_QUEUE, mais leur thread reste pris jusqu'à la réponse.
+# Au-delà de LLM_MAX_ABANDONED à la fois (watsonx bloqué), les nouveaux appels sont délestés
+LLM_MAX_ABANDONED = int(os.getenv("LLM_MAX_ABANDONED", str(LLM_MAX_CONCURRENCY)))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF_S = float(os.getenv("LLM_BACKOFF_S", "0.5"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailable(RuntimeError):
+    """The LLM could not answer (upstream error after retries); `outcome` is logged in the telemetry."""
+    outcome = "llm_error"
+
+
+class LLMOverloaded(LLMUnavailable):
+    """Call shed: too many calls in flight, or no rate-limit token in time."""
+    outcome = "shed"
+
+
+class LLMTimeout(LLMUnavailable):
+    """The call deadline expired."""
+    outcome = "timeout"
+
+
+def _status(error) -> int:
+    for attr in ("status", "status_code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def is_retriable(error) -> bool:
+    """Rate limiting, 5xx and connection errors are worth retrying; anything else is not."""
+    status = _status(error)
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(error, (ConnectionError, TimeoutError, http.client.HTTPException))
+
+
+def backoff_delay(attempt: int, base_s: float = LLM_BACKOFF_S) -> float:
+    """Exponential backoff with full jitter (attempt 1 -> [0, base], 2 -> [0, 2 * base], ...)."""
+    return random.uniform(0, base_s * 2 ** (attempt - 1))
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `burst` saved up."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token if one is available (returns 0), else the wait before the next one."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def aacquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    def available(self) -> float:
+        with self._lock:
+            return min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+
+
+class _Flight:
+    """One upstream call shared by every caller of the same prompt: buffered events + end state."""
+
+    def __init__(self, key: str, deadline: float):
+        self.key = key
+        self.deadline = deadline
+        self.events = []
+        self.done = False
+        self.error = None
+        self.consumers = 0
+        self.cond = threading.Condition()
+        # État des slots de la passerelle (protégé par le verrou de LLMGateway)
+        self.running = False   # tient un slot d'appel amont
+        self.released = False  # slot de capacité rendu (fin de l'appel ou abandon)
+
+    def push(self, event, last: bool = False):
+        with self.cond:
+            self.events.append(event)
+            self.done = self.done or last
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done, self.error = True, error
+            self.cond.notify_all()
+
+    def follow(self, deadline: float):
+        """Yield the events from the first one, until the end of the call or `deadline`."""
+        i = 0
+        try:
+            while True:
+                with self.cond:
+                    while i >= len(self.events) and not self.done:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise LLMTimeout("watsonx call deadline expired")
+                        self.cond.wait(remaining)
+                    events, done, error = self.events[i:], self.done, self.error
+                i += len(events)
+                yield from events
+                if done and i >= len(self.events):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self.cond:
+                self.consumers -= 1
+
+
+class LLMGateway:
+    """
+    Process-wide gateway in front of the watsonx client.
+
+    - Identical prompts in flight share one upstream call (singleflight).
+    - Upstream calls (retries included) take a token from a token bucket.
+    - At most `max_concurrency` calls run at once, `max_queue` more may wait;
+      beyond that, or without a token within `queue_wait_s`, the call is shed
+      with `LLMOverloaded`.
+    - Each caller waits at most `timeout_s` (`LLMTimeout`). Retriable errors
+      (429, 5xx, connection) are retried with jittered exponential backoff as
+      long as nothing was streamed yet; other failures raise `LLMUnavailable`.
+    - A call nobody waits for any more (all its callers timed out or left) is
+      abandoned: it stops counting against the limits above, but its thread is
+      only freed when watsonx answers. With `max_abandoned` such calls pending,
+      new calls are shed.
+    """
+
+    def __init__(self, client_fn=get_llm, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_queue: int = LLM_MAX_QUEUE, rate_per_s: float = LLM_RATE_PER_S, burst: int = LLM_BURST,
+                 queue_wait_s: float = LLM_QUEUE_WAIT_S, timeout_s: float = LLM_TIMEOUT_S,
+                 retries: int = LLM_RETRIES, backoff_s: float = LLM_BACKOFF_S,
+                 max_abandoned: int = LLM_MAX_ABANDONED):
+        self.client_fn = client_fn
+        self.max_concurrency = max_concurrency
+        self.capacity = max_concurrency + max_queue
+        self.bucket = TokenBucket(rate_per_s, burst)
+        self.queue_wait_s = queue_wait_s
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.max_abandoned = max_abandoned
+        self.counts = {"calls": 0, "upstream": 0, "coalesced": 0, "shed": 0, "timeouts": 0, "retries": 0,
+                       "errors": 0, "abandoned": 0}
+        self.active = 0
+        self.abandoned = 0
+        self._flights = {}
+        self._async_flights = weakref.WeakKeyDictionary()  # boucle asyncio -> {clé: tâche}
+        self._lock = threading.Lock()
+        # Un thread par appel admis ou abandonné ; le sémaphore borne les appels amont suivis
+        self._upstream = threading.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.capacity + max_abandoned,
+                                            thread_name_prefix="llm-gateway")
+
+    def _count(self, name: str, **labels):
+        with self._lock:
+            self.counts[name] += 1
+        metrics.inc(f"helpai_llm_{name}", **labels)
+
+    @staticmethod
+    def _key(prompt: str, params: dict, stream: bool) -> str:
+        raw = json.dumps([prompt, params or {}, stream], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _admit(self):
+        """Reserve a slot for a new upstream call, or shed it."""
+        with self._lock:
+            stalled = self.abandoned > 0 and self.abandoned >= self.max_abandoned
+            admitted = self.active < self.capacity and not stalled
+            if admitted:
+                self.active += 1
+        if stalled:
+            self._count("shed", reason="stalled")
+            raise LLMOverloaded(f"{self.abandoned} abandoned watsonx calls still pending")
+        if not admitted:
+            self._count("shed", reason="capacity")
+            raise LLMOverloaded(f"{self.capacity} watsonx calls already in flight or queued")
+
+    def _release(self):
+        with self._lock:
+            self.active -= 1
+
+    # --- Appels synchrones (threads Streamlit, service HTTP) ---
+
+    def _coalesce(self, key: str, deadline: float):
+        """The in-flight call of `key`, joined by one more consumer (lock held), or None."""
+        flight = self._flights.get(key)
+        if flight is None or flight.done:
+            return None
+        with flight.cond:
+            flight.consumers += 1
+            flight.deadline = max(flight.deadline, deadline)
+        return flight
+
+    def _join(self, prompt: str, params: dict, stream: bool, deadline: float) -> _Flight:
+        key = self._key(prompt, params, stream)
+        self._count("calls")
+        with self._lock:
+            flight = self._coalesce(key, deadline)
+        if flight is None:
+            self._admit()
+            try:
+                token = self.bucket.acquire(min(self.queue_wait_s, deadline - time.monotonic()))
+            except BaseException:
+                self._release()
+                raise
+            if not token:
+                self._release()
+                self._count("shed", reason="rate_limit")
+                raise LLMOverloaded("watsonx rate limit reached")
+            with self._lock:
+                # Un appel identique a pu partir pendant l'attente du jeton
+                flight = self._coalesce(key, deadline)
+                if flight is None:
+                    flight = self._flights[key] = _Flight(key, deadline)
+                    flight.consumers = 1
+                    self._executor.submit(self._pump, key, flight, prompt, params, stream)
+                    return flight
+            self._release()
+        self._count("coalesced")
+        return flight
+
+    def _pump(self, key: str, flight: _Flight, prompt: str, params: dict, stream: bool):
+        attempt = 0
+        try:
+            acquired = self._upstream.acquire(timeout=max(0.0, flight.deadline - time.monotonic()))
+            with self._lock:
+                flight.running = acquired and not flight.released
+                if acquired and not flight.running:
+                    self._upstream.release()
+            if not flight.running:
+                # Délai dépassé en file d'attente, ou plus personne n'attend
+                flight.finish(LLMTimeout("watsonx call deadline expired"))
+                return
+            while True:
+                attempt += 1
+                try:
+                    self._count("upstream")
+                    client = self.client_fn()
+                    if stream:
+                        events = client.generate_text_stream(prompt=prompt, params=params, raw_response=True)
+                        for event in events:
+                            flight.push(event)
+                            # Plus personne n'attend (session fermée, délai dépassé) : on libère le worker
+                            if not flight.consumers or time.monotonic() > flight.deadline:
+                                events.close()
+                                raise LLMTimeout("stream abandoned")
+                    else:
+                        flight.push(client.generate(prompt=prompt, params=params), last=True)
+                    flight.finish()
+                    return
+                except LLMTimeout as e:
+                    flight.finish(e)
+                    return
+                except Exception as e:
+                    delay = backoff_delay(attempt, self.backoff_s)
+                    if (flight.events or attempt > self.retries or not is_retriable(e)
+                            or time.monotonic() + delay >= flight.deadline
+                            or not self.bucket.acquire(max(0.0, flight.deadline - time.monotonic() - delay))):
+                        logger.warning("watsonx call failed after %d attempt(s): %s", attempt, e)
+                        self._count("errors")
+                        error = LLMUnavailable(f"watsonx call failed: {e}")
+                        error.__cause__ = e
+                        flight.finish(error)
+                        return
+                    self._count("retries")
+                    logger.info("watsonx call failed (%s), retry %d in %.2fs", e, attempt, delay)
+                    time.sleep(delay)
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if flight.released:
+                    self.abandoned -= 1
+                else:
+                    flight.released = True
+                    self.active -= 1
+                if flight.running:
+                    flight.running = False
+                    self._upstream.release()
+
+    def _abandon(self, flight: _Flight):
+        """Give back the slots of a call nobody follows any more (its thread finishes on its own)."""
+        with self._lock:
+            with flight.cond:
+                if flight.consumers or flight.done or flight.released:
+                    return
+            flight.released = True
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            self.active -= 1
+            self.abandoned += 1
+            if flight.running:
+                flight.running = False
+                self._upstream.release()
+        self._count("abandoned")
+
+    def _follow(self, flight: _Flight, deadline: float):
+        try:
+            yield from flight.follow(deadline)
+        except LLMTimeout:
+            self._count("timeouts")
+            raise
+        finally:
+            self._abandon(flight)
+
+    def generate(self, prompt: str, params: dict = None, timeout_s: float = None) -> dict:
+        """Same response as ModelInference.generate, within the gateway limits."""
+        deadline = time.monotonic() + (timeout_s or self.timeout_s)
+        flight = self._join(prompt, params, False, deadline)
+        for response in self._follow(flight, deadline):
+            return response
+        raise LLMUnavailable("empty watsonx response")
+
+    def generate_text_stream(self, prompt: str, params: dict = None, timeout_s: float = None):
+        """
+        Events of ModelInference.generate_text_stream(raw_response=True).
+
+        Admission (shedding, rate limit) happens on the call itself; timeouts and
+        upstream errors are raised while iterating.
+        """
+        deadline = time.monotonic() + (timeout_s or self.timeout_s)
+        return self._follow(self._join(prompt, params, True, deadline), deadline)
+
+    # --- Appels asynchrones (async_assistant : agenerate sur la connexion HTTP poolée) ---
+
+    async def agenerate(self, prompt: str, params: dict = None, timeout_s: float = None) -> dict:
+        timeout_s = timeout_s or self.timeout_s
+        deadline = time.monotonic() + timeout_s
+        flights = self._async_flights.setdefault(asyncio.get_running_loop(), {})
+        key = self._key(prompt, params, False)
+        self._count("calls")
+        task = flights.get(key)
+        if task is not None:
+            self._count("coalesced")
+        else:
+            self._admit()
+            try:
+                token = await self.bucket.aacquire(min(self.queue_wait_s, timeout_s))
+            except BaseException:
+                # Appelant annulé pendant l'attente du jeton : le slot ne doit pas fuir
+                self._release()
+                raise
+            if not token:
+                self._release()
+                self._count("shed", reason="rate_limit")
+                raise LLMOverloaded("watsonx rate limit reached")
+            task = flights[key] = asyncio.ensure_future(self._acall(prompt, params, deadline))
+
+            def _done(t):
+                if flights.get(key) is t:
+                    del flights[key]
+                # Erreur déjà remontée aux appelants (ou tous partis avant la fin)
+                if not t.cancelled():
+                    t.exception()
+
+            task.add_done_callback(_done)
+        try:
+            # shield : le délai d'un appelant n'annule pas l'appel partagé
+            return await asyncio.wait_for(asyncio.shield(task), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            raise LLMTimeout("watsonx call deadline expired") from None
+
+    async def _acall(self, prompt: str, params: dict, deadline: float) -> dict:
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                try:
+                    self._count("upstream")
+                    return await asyncio.wait_for(self.client_fn().agenerate(prompt=prompt, params=params),
+                                                  max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    raise LLMTimeout("watsonx call deadline expired") from None
+                except Exception as e:
+                    delay = backoff_delay(attempt, self.backoff_s)
+                    if (attempt > self.retries or not is_retriable(e) or time.monotonic() + delay >= deadline
+                            or not await self.bucket.aacquire(max(0.0, deadline - time.monotonic() - delay))):
+                        logger.warning("watsonx call failed after %d attempt(s): %s", attempt, e)
+                        self._count("errors")
+                        raise LLMUnavailable(f"watsonx call failed: {e}") from e
+                    self._count("retries")
+                    await asyncio.sleep(delay)
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "active": self.active, "capacity": self.capacity,
+                    "abandoned_pending": self.abandoned, "rate_tokens": self.bucket.available()}
+
+
+# Passerelle partagée par tout le processus
+llm_gateway = LLMGateway()
+metrics.register_collector("helpai_llm_gateway", llm_gateway.stats)
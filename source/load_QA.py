@@ -1,51 +1,224 @@
-import pandas as pd
-import lancedb
-from sentence_transformers import SentenceTransformer
+import argparse
+import os
+import time
+from typing import TYPE_CHECKING
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import lancedb
 
-csv_path = "data\Questions-Export-2025-October-27-1237 (1)(Questions-Export-2025-October-2).csv"
+from source.encoder import (
+    ENCODER_BACKEND, ENCODER_BACKENDS, PASSAGE_PREFIX, PREFIX_METADATA_KEY, QUERY_PREFIX, load_encoder,
+)
+from source.filters import create_filter_indexes, filter_columns, filter_fields
 
-# Essaie d’abord ISO-8859-1
-df = pd.read_csv(csv_path, sep=';', encoding='ISO-8859-1')
+if TYPE_CHECKING:
+    # Chargé par load_encoder seulement : language_id importe ce module sans la pile d'embedding
+    from sentence_transformers import SentenceTransformer
 
-print(df.head())
+# --- 1. Paramètres par défaut ---
+CSV_PATH = os.path.join("data", "Questions-Export-2025-October-27-1237 (1)(Questions-Export-2025-October-2).csv")
+DB_PATH = "lancedb_questions"
+TABLE_NAME = "qa_table"
+MODEL_NAME = "intfloat/multilingual-e5-base"
 
-# --- 3. Vérification des colonnes disponibles ---
-print("Colonnes détectées :", df.columns.tolist())
+CHUNK_SIZE = 256   # lignes CSV lues à la fois (borne la mémoire)
+BATCH_SIZE = 32    # taille des batchs passés à SentenceTransformer.encode
 
-# --- 4. Sélection des colonnes nécessaires ---
-# (adapte si les noms exacts diffèrent, ex: 'Question', 'Réponse', etc.)
-df = df[['Title', 'Content', 'Écoles', 'Langues']].rename(columns={
+# Colonnes CSV -> colonnes de la table
+CSV_COLUMNS = {
     'Title': 'question',
     'Content': 'answer',
     'Écoles': 'ecole',
-    'Langues': 'langue'
-})
-# --- Conversion sécurisée en chaînes ---
-for col in ['question', 'answer', 'ecole', 'langue']:
-    df[col] = df[col].astype(str)
-
-# --- 5. Chargement du modèle d'embedding ---
-# model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-# model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-model = SentenceTransformer("intfloat/multilingual-e5-base")
-
-# --- 6. Génération des embeddings séparés ---
-df["question_embedding"] = df["question"].fillna("").apply(lambda x: model.encode(x))
-df["answer_embedding"]  = df["answer"].fillna("").apply(lambda x: model.encode(x))
-
-# --- 7. Connexion à la base LanceDB ---
-db = lancedb.connect("lancedb_questions")
-table = db.create_table("qa_table", data=df.to_dict(orient="records"), mode="overwrite")
-
-print(f"✅ Base créée : {len(df)} lignes insérées")
-print("Champs vectoriels : question_embedding, answer_embedding")
-
-# --- 8. Exemple de recherche ---
-query = "Comment fonctionne l'apprentissage automatique ?"
-query_vec = model.encode(query)
-results = table.search(query_vec, vector_column_name="question_embedding").limit(3).to_pandas()
-
-print("\n🔍 Résultats similaires :")
-print(results[['question', 'answer', 'ecole', 'langue']])
\ No newline at end of file
+    'Langues': 'langue',
+}
+
+
+def qa_schema(dim: int) -> pa.Schema:
+    """Arrow schema of `qa_table` for an embedding model of dimension `dim`."""
+    vector = pa.list_(pa.float32(), dim)
+    return pa.schema([
+        ("question", pa.string()),
+        ("answer", pa.string()),
+        ("ecole", pa.string()),
+        ("langue", pa.string()),
+        ("question_embedding", vector),
+        ("answer_embedding", vector),
+        *filter_fields(),
+    ], metadata={PREFIX_METADATA_KEY: b"1"})
+
+
+def iter_csv_chunks(csv_path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Read the Q&A export chunk by chunk.
+
+    Yields:
+        pd.DataFrame: At most `chunk_size` rows with the columns
+        question / answer / ecole / langue, as strings.
+    """
+    reader = pd.read_csv(
+        csv_path,
+        sep=';',
+        encoding='ISO-8859-1',
+        usecols=list(CSV_COLUMNS),
+        chunksize=chunk_size,
+    )
+    for chunk in reader:
+        chunk = chunk.rename(columns=CSV_COLUMNS)[list(CSV_COLUMNS.values())]
+        # --- Conversion sécurisée en chaînes ---
+        for col in chunk.columns:
+            chunk[col] = chunk[col].fillna("").astype(str)
+        yield chunk
+
+
+def encode_texts(model: "SentenceTransformer", texts: list, batch_size: int = BATCH_SIZE, pool=None) -> np.ndarray:
+    """
+    Encode a list of texts in batches, optionally through a multi-process pool.
+
+    Returns:
+        np.ndarray: float32 matrix of shape (len(texts), dim).
+    """
+    if pool is not None:
+        embeddings = model.encode_multi_process(texts, pool, batch_size=batch_size)
+    else:
+        embeddings = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def _vector_array(embeddings: np.ndarray) -> pa.FixedSizeListArray:
+    dim = embeddings.shape[1]
+    return pa.FixedSizeListArray.from_arrays(pa.array(embeddings.ravel(), type=pa.float32()), dim)
+
+
+def build_record_batch(chunk: pd.DataFrame, question_emb: np.ndarray, answer_emb: np.ndarray, schema: pa.Schema) -> pa.RecordBatch:
+    """Assemble one chunk and its embeddings into an Arrow record batch matching `schema`."""
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(chunk["question"].tolist(), type=pa.string()),
+            pa.array(chunk["answer"].tolist(), type=pa.string()),
+            pa.array(chunk["ecole"].tolist(), type=pa.string()),
+            pa.array(chunk["langue"].tolist(), type=pa.string()),
+            _vector_array(question_emb),
+            _vector_array(answer_emb),
+            *filter_columns(chunk["ecole"].tolist(), chunk["langue"].tolist()),
+        ],
+        schema=schema,
+    )
+
+
+def ingest(
+    csv_path: str = CSV_PATH,
+    db_path: str = DB_PATH,
+    table_name: str = TABLE_NAME,
+    model_name: str = MODEL_NAME,
+    chunk_size: int = CHUNK_SIZE,
+    batch_size: int = BATCH_SIZE,
+    workers: int = 1,
+    model: "SentenceTransformer" = None,
+    backend: str = ENCODER_BACKEND,
+):
+    """
+    Stream the CSV export into LanceDB.
+
+    The CSV is read `chunk_size` rows at a time; each chunk is embedded with
+    batched `encode` calls (spread over `workers` processes when > 1) and
+    written as one Arrow record batch. Only one chunk is held in memory.
+    Questions are encoded as e5 queries, answers as e5 passages.
+
+    Returns:
+        lancedb.table.Table: The rebuilt table.
+    """
+    model = model or load_encoder(model_name, backend)
+    schema = qa_schema(model.get_sentence_embedding_dimension())
+
+    pool = None
+    if workers > 1:
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * workers)
+
+    stats = {"rows": 0, "start": time.perf_counter()}
+
+    def batches():
+        for chunk in iter_csv_chunks(csv_path, chunk_size):
+            question_emb = encode_texts(model, [QUERY_PREFIX + q for q in chunk["question"]], batch_size, pool)
+            answer_emb = encode_texts(model, [PASSAGE_PREFIX + a for a in chunk["answer"]], batch_size, pool)
+            stats["rows"] += len(chunk)
+            elapsed = time.perf_counter() - stats["start"]
+            print(f"⏳ {stats['rows']} lignes encodées ({stats['rows'] / elapsed:.1f} lignes/s)")
+            yield build_record_batch(chunk, question_emb, answer_emb, schema)
+
+    try:
+        db = lancedb.connect(db_path)
+        # Les batchs sont consommés au fil de l'eau : une seule écriture, mémoire bornée
+        table = db.create_table(table_name, data=batches(), schema=schema, mode="overwrite")
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+    # Index scalaires pour le pré-filtrage école / langue
+    create_filter_indexes(table)
+
+    elapsed = time.perf_counter() - stats["start"]
+    print(f"✅ Base créée : {stats['rows']} lignes insérées en {elapsed:.1f}s ({stats['rows'] / max(elapsed, 1e-9):.1f} lignes/s)")
+    print("Champs vectoriels : question_embedding, answer_embedding")
+    print("Champs de filtrage indexés : ecoles, langue_code")
+    return table
+
+
+def add_filter_columns(db_path: str = DB_PATH, table_name: str = TABLE_NAME):
+    """
+    Add the normalized `ecoles` / `langue_code` columns to an existing table
+    without re-encoding anything, then index them.
+
+    Returns:
+        lancedb.table.Table: The migrated table.
+    """
+    db = lancedb.connect(db_path)
+    data = db.open_table(table_name).to_arrow()
+    data = data.drop_columns([f.name for f in filter_fields() if f.name in data.column_names])
+    for field, column in zip(filter_fields(), filter_columns(data["ecole"].to_pylist(), data["langue"].to_pylist())):
+        data = data.append_column(field, column)
+    table = db.create_table(table_name, data=data, mode="overwrite")
+    create_filter_indexes(table)
+    print(f"✅ Colonnes de filtrage ajoutées à '{table_name}' ({table.count_rows()} lignes)")
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Charge l'export Q&A (CSV) dans LanceDB.")
+    parser.add_argument("--csv", default=CSV_PATH, help="Chemin du CSV exporté")
+    parser.add_argument("--db", default=DB_PATH, help="Dossier LanceDB")
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Lignes lues par chunk")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Taille de batch pour l'encodage")
+    parser.add_argument("--workers", type=int, default=1, help="Processus d'encodage (1 = pas de pool)")
+    parser.add_argument("--backend", default=ENCODER_BACKEND, choices=ENCODER_BACKENDS,
+                        help="Backend de l'encodeur (onnx / onnx-int8 : exporter d'abord avec python -m source.encoder --export)")
+    parser.add_argument("--add-filter-columns", action="store_true",
+                        help="Ajoute seulement les colonnes ecoles / langue_code à une table existante (sans ré-encoder)")
+    args = parser.parse_args()
+
+    if args.add_filter_columns:
+        add_filter_columns(args.db, args.table)
+        raise SystemExit(0)
+
+    model = load_encoder(args.model, args.backend)
+    table = ingest(
+        csv_path=args.csv,
+        db_path=args.db,
+        table_name=args.table,
+        model_name=args.model,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        model=model,
+    )
+
+    # --- Exemple de recherche ---
+    query = "Comment fonctionne l'apprentissage automatique ?"
+    query_vec = model.encode(QUERY_PREFIX + query)
+    results = table.search(query_vec, vector_column_name="question_embedding").limit(3).to_pandas()
+
+    print("\n🔍 Résultats similaires :")
+    print(results[['question', 'answer', 'ecole', 'langue']])
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import time
+from datetime import timedelta
+
+import numpy as np
+import pyarrow as pa
+import lancedb
+
+from source.filters import FILTER_COLUMNS, create_filter_indexes
+from source.vector_index import (
+    DB_PATH, TABLE_NAME, build_index, config_path, load_index_config, run_queries, sample_queries,
+)
+
+# Colonnes vectorielles jamais interrogées par search_question
+UNUSED_VECTOR_COLUMNS = ("answer_embedding",)
+# Versions gardées par défaut : un processus déjà lancé lit encore la version qu'il a ouverte
+KEEP_DAYS = 7
+
+
+def dir_size(path: str) -> int:
+    """Total size in bytes of every file under `path`."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def table_report(db_path: str, table) -> dict:
+    """On-disk footprint and version history of one table."""
+    return {
+        "db_bytes": dir_size(db_path),
+        "table_bytes": dir_size(os.path.join(db_path, f"{table.name}.lance")),
+        "versions": len(table.list_versions()),
+        "fragments": table.stats()["fragment_stats"]["num_fragments"],
+        "rows": table.count_rows(),
+    }
+
+
+def scan_latency(table, n_queries: int = 50, k: int = 10) -> dict:
+    """
+    Latency of an exact (flat-scan) vector search and of a full table read.
+
+    The same seeded queries are used before and after maintenance.
+    """
+    queries = sample_queries(table, n_queries)
+    run_queries(table, queries[:5], k, exact=True)  # chauffe le cache disque
+    _, latencies = run_queries(table, queries, k, exact=True)
+    start = time.perf_counter()
+    table.to_arrow()
+    return {
+        "exact_p50_ms": float(np.percentile(latencies, 50)),
+        "exact_p95_ms": float(np.percentile(latencies, 95)),
+        "full_read_ms": (time.perf_counter() - start) * 1000,
+    }
+
+
+def _to_float16(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    dim = column.type.list_size
+    return column.cast(pa.list_(pa.float16(), dim))
+
+
+def rewrite_table(db, table_name: str, float16: bool = False, drop_columns=()):
+    """
+    Rewrite the table with float16 vectors and/or without some vector columns.
+
+    Scalar indexes and, when one was tuned, the vector index (same settings as
+    in index_config.json) are rebuilt on the new data.
+
+    Returns:
+        lancedb.table.Table: The rewritten table.
+    """
+    data = db.open_table(table_name).to_arrow()
+    data = data.drop_columns([c for c in drop_columns if c in data.column_names])
+    if float16:
+        for i, field in enumerate(data.schema):
+            if pa.types.is_fixed_size_list(field.type) and pa.types.is_float32(field.type.value_type):
+                data = data.set_column(i, field.name, _to_float16(data.column(i)))
+    table = db.create_table(table_name, data=data, mode="overwrite")
+
+    if any(c in table.schema.names for c in FILTER_COLUMNS):
+        create_filter_indexes(table)
+    config = load_index_config(db.uri)
+    if config:
+        build_index(table, config["index_type"], config["num_partitions"], config.get("num_sub_vectors") or 48)
+        config["table_version"] = table.version
+        with open(config_path(db.uri), "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=4)
+    return table
+
+
+def maintain(
+    db_path: str = DB_PATH,
+    table_name: str = TABLE_NAME,
+    float16: bool = False,
+    drop_unused: bool = False,
+    keep_days: float = KEEP_DAYS,
+    delete_unverified: bool = False,
+    n_queries: int = 50,
+):
+    """
+    Compact fragments, prune old versions and optionally shrink the vectors, then
+    report size and scan latency before/after.
+
+    Args:
+        float16 (bool): Store the vector columns as float16 (half the bytes).
+        drop_unused (bool): Drop the vector columns never searched (answer_embedding).
+        keep_days (float): Keep versions younger than this. 0 keeps only the current
+            one and breaks the readers still on an older version.
+        delete_unverified (bool): Also delete unreferenced files younger than 7 days
+            (left by interrupted writes). Only safe when nothing else is writing.
+
+    Returns:
+        dict: {"before": {...}, "after": {...}}
+    """
+    db = lancedb.connect(db_path)
+    table = db.open_table(table_name)
+    before = {**table_report(db_path, table), **scan_latency(table, n_queries)}
+
+    if float16 or drop_unused:
+        table = rewrite_table(db, table_name, float16, UNUSED_VECTOR_COLUMNS if drop_unused else ())
+    # Compaction des fragments + optimisation des index + purge des anciennes versions
+    table.optimize(cleanup_older_than=timedelta(days=keep_days), delete_unverified=delete_unverified)
+
+    table = db.open_table(table_name)
+    after = {**table_report(db_path, table), **scan_latency(table, n_queries)}
+    return {"before": before, "after": after}
+
+
+def _mb(n_bytes: int) -> str:
+    return f"{n_bytes / (1024 * 1024):.2f} Mo"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compacte qa_table, purge les anciennes versions et réduit les vecteurs.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--float16", action="store_true", help="Stocke les vecteurs en float16")
+    parser.add_argument("--drop-unused", action="store_true",
+                        help=f"Supprime les colonnes vectorielles jamais interrogées ({', '.join(UNUSED_VECTOR_COLUMNS)})")
+    parser.add_argument("--keep-days", type=float, default=KEEP_DAYS,
+                        help=f"Garde les versions plus récentes que N jours (défaut : {KEEP_DAYS})")
+    parser.add_argument("--only-current", action="store_true",
+                        help="Ne garde que la version courante (aucune instance de l'application ne doit tourner)")
+    parser.add_argument("--delete-unverified", action="store_true",
+                        help="Supprime aussi les fichiers orphelins récents (aucune écriture en cours)")
+    parser.add_argument("--queries", type=int, default=50, help="Requêtes pour mesurer la latence de scan")
+    args = parser.parse_args()
+    if args.keep_days <= 0 and not args.only_current:
+        parser.error("--keep-days 0 casse les lecteurs en cours : utiliser --only-current pour le confirmer")
+    if args.only_current:
+        args.keep_days = 0
+
+    report = maintain(args.db, args.table, args.float16, args.drop_unused, args.keep_days,
+                      args.delete_unverified, args.queries)
+    b, a = report["before"], report["after"]
+    print(f"💾 Taille de '{args.db}' : {_mb(b['db_bytes'])} -> {_mb(a['db_bytes'])} "
+          f"({a['db_bytes'] / max(b['db_bytes'], 1) - 1:+.0%})")
+    print(f"🗂️  Versions : {b['versions']} -> {a['versions']} | fragments : {b['fragments']} -> {a['fragments']}")
+    print(f"⏱️  Recherche exacte p50 : {b['exact_p50_ms']:.2f} -> {a['exact_p50_ms']:.2f} ms | "
+          f"p95 : {b['exact_p95_ms']:.2f} -> {a['exact_p95_ms']:.2f} ms")
+    print(f"📖 Lecture complète : {b['full_read_ms']:.1f} -> {a['full_read_ms']:.1f} ms")
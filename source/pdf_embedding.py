@@ -1,127 +1,225 @@
 # --- Dépendances à installer si besoin ---
 # pip install pypdf lancedb sentence-transformers pandas
 
-import re
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import pandas as pd
-from pypdf import PdfReader
+import pyarrow as pa
 import lancedb
 from sentence_transformers import SentenceTransformer
 
-# -------- 1) Chargement du PDF --------
-pdf_path = "/content/reglint.pdf"  # <-- adapte si besoin
-reader = PdfReader(pdf_path)
-
-def clean_text(t: str) -> str:
-    # Nettoyage léger : espaces, sauts de lignes multiples, hyphens de césure, etc.
-    t = re.sub(r"-\n", "", t)                 # casse mots coupés par césure
-    t = re.sub(r"\s+\n", "\n", t)
-    t = re.sub(r"\n{2,}", "\n\n", t)
-    t = re.sub(r"[ \t]{2,}", " ", t)
-    return t.strip()
-
-# -------- 2) Extraction page par page + repérage de sections --------
-pages = []
-for i, page in enumerate(reader.pages, start=1):
-    raw = page.extract_text() or ""
-    pages.append({"page": i, "text": clean_text(raw)})
-
-# Heuristique simple pour détecter des en-têtes/sections (Préambule, Article X, etc.)
-SECTION_PAT = re.compile(r"^(Préambule|Article\s+\d+[^:\n]*|ANNEXE\s*\d+)", re.IGNORECASE)
-
-def annotate_sections(pages):
-    current_section = "Document"
-    annotated = []
-    for p in pages:
-        # Cherche un titre de section au début de la page
-        first_lines = p["text"].splitlines()[:12]
-        section_found = None
-        for line in first_lines:
-            m = SECTION_PAT.match(line.strip())
-            if m:
-                section_found = m.group(0).strip()
-                break
-        if section_found:
-            current_section = section_found
-        annotated.append({**p, "section": current_section})
-    return annotated
-
-pages = annotate_sections(pages)
-
-# -------- 3) Chunking du texte pour RAG --------
-# Chunk ~800–1000 caractères avec overlap 150 pour du FR/longs articles
-CHUNK_SIZE = 500
-OVERLAP = 150
-
-def chunk_text(text, page, section, size=CHUNK_SIZE, overlap=OVERLAP):
-    text = text.strip()
-    if not text:
-        return []
-    chunks = []
-    start = 0
-    n = len(text)
-    while start < n:
-        end = min(start + size, n)
-        # Essaie de couper sur un séparateur "propre" si possible
-        slice_ = text[start:end]
-        if end < n:
-            # recule jusqu'au dernier point/fin de ligne pour éviter de couper une phrase
-            cut = max(slice_.rfind("\n"), slice_.rfind(". "))
-            if cut != -1 and cut > size * 0.5:
-                end = start + cut + 1
-                slice_ = text[start:end]
-        chunks.append({
-            "page": page,
-            "section": section,
-            "chunk": slice_.strip()
-        })
-        start = max(end - overlap, end)  # gère le cas overlap > restant
-    return chunks
-
-records = []
-for p in pages:
-    records.extend(chunk_text(p["text"], p["page"], p["section"]))
-
-df = pd.DataFrame.from_records(records)
-print(f"📄 Pages: {len(pages)} | 🧩 Chunks: {len(df)}")
-print(df.head(2))
-
-# -------- 4) Modèle d’embedding --------
+from source.load_QA import _vector_array, encode_texts
+from source.pdf_extract import CHUNK_SIZE, OVERLAP, _extract, chunk_text, file_hash
+
+# --- 1. Paramètres par défaut ---
+DB_PATH = "lancedb_reglement"
+TABLE_NAME = "reglement_chunks"
 # Multilingue, bon pour du FR
-model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-
-# Embeddings
-df["embedding"] = df["chunk"].apply(lambda x: model.encode(x).tolist())
-
-# (facultatif) Quelques métadonnées utiles pour filtrer
-df["source_file"] = Path(pdf_path).name
-
-# -------- 5) LanceDB : création/écriture --------
-db = lancedb.connect("lancedb_reglement")     # dossier local
-table = db.create_table(
-    "reglement_chunks",
-    data=df.to_dict(orient="records"),
-    mode="overwrite"  # remet à zéro si existe
-)
-
-print(f"✅ Base créée : {len(df)} chunks insérés")
-print("Champs : chunk, page, section, source_file, embedding")
-
-# -------- 6) Exemple de recherche --------
-# Pose ta requête en langage naturel (FR ok).
-query = "Quelles sont les règles sur l'utilisation des téléphones pendant les examens ?"
-query_vec = model.encode(query)
-
-results = (
-    table.search(query_vec, vector_column_name="embedding")
-         .limit(5)
-         .to_pandas()
-)
-
-# Affichage condensé
-cols_to_show = ["section", "page", "chunk"]
-print("\n🔍 Résultats similaires :")
-for _, row in results[cols_to_show].iterrows():
-    print(f"\n— {row['section']} (p.{int(row['page'])})")
-    print(row["chunk"][:600] + ("…" if len(row["chunk"]) > 600 else ""))
\ No newline at end of file
+MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+VECTOR_COLUMN = "embedding"
+
+BATCH_SIZE = 32
+
+
+def find_pdfs(inputs) -> dict:
+    """
+    PDF files given directly or found (recursively) in the given folders.
+
+    Returns:
+        dict: {source_file: path}. `source_file` is the path relative to the
+        folder it was found in (the file name for files given directly), so
+        same-named PDFs in different sub-folders stay distinct.
+    """
+    found = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            files = [(p.relative_to(item).as_posix(), str(p)) for p in sorted(Path(item).rglob("*.pdf"))]
+        else:
+            files = [(Path(item).name, item)]
+        for key, path in files:
+            if key in found and os.path.realpath(found[key]) != os.path.realpath(path):
+                raise ValueError(f"Deux PDF indexés sous le même nom : {found[key]} et {path}")
+            found[key] = path
+    return found
+
+
+def chunk_schema(dim: int) -> pa.Schema:
+    return pa.schema([
+        ("chunk", pa.string()),
+        ("page", pa.int32()),
+        ("section", pa.string()),
+        ("source_file", pa.string()),
+        ("chunk_index", pa.int32()),
+        ("page_hash", pa.string()),
+        ("file_hash", pa.string()),
+        (VECTOR_COLUMN, pa.list_(pa.float32(), dim)),
+    ])
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _indexed_state(table) -> dict:
+    """{source_file: {"file_hash": str, "pages": {page: page_hash}}} of what is already in the table."""
+    state = {}
+    if table is None:
+        return state
+    rows = table.to_arrow().select(["source_file", "page", "page_hash", "file_hash"]).to_pylist()
+    for row in rows:
+        entry = state.setdefault(row["source_file"], {"file_hash": row["file_hash"], "pages": {}})
+        entry["pages"][row["page"]] = row["page_hash"]
+    return state
+
+
+def ingest_pdfs(
+    inputs,
+    db_path: str = DB_PATH,
+    table_name: str = TABLE_NAME,
+    model_name: str = MODEL_NAME,
+    workers: int = os.cpu_count() or 1,
+    batch_size: int = BATCH_SIZE,
+    chunk_size: int = CHUNK_SIZE,
+    overlap: int = OVERLAP,
+    prune: bool = False,
+    model: SentenceTransformer = None,
+):
+    """
+    Index (or re-index) PDFs into LanceDB, touching only what changed.
+
+    Unchanged files (same SHA-256) are skipped without being opened. Changed
+    files are extracted in a process pool; only their pages whose content hash
+    differs from the stored one are re-chunked, encoded in batches and upserted
+    (old chunks of the page deleted, new ones added).
+
+    Args:
+        inputs: PDF files and/or folders (searched recursively).
+        prune: Also delete chunks of indexed files absent from `inputs`.
+
+    Returns:
+        dict: Counters (files_skipped, pages_updated, pages_deleted, chunks_added, elapsed_s).
+    """
+    start = time.perf_counter()
+    db = lancedb.connect(db_path)
+    try:
+        table = db.open_table(table_name)
+    except ValueError:  # première indexation
+        table = None
+    state = _indexed_state(table)
+    stats = {"files_skipped": 0, "pages_updated": 0, "pages_deleted": 0, "chunks_added": 0}
+
+    paths = find_pdfs(inputs)
+    todo, names = [], []
+    for name, path in paths.items():
+        digest = file_hash(path)
+        if state.get(name, {}).get("file_hash") == digest:
+            stats["files_skipped"] += 1
+        else:
+            todo.append((path, digest))
+            names.append(name)
+    print(f"📄 {len(paths)} PDF(s) : {stats['files_skipped']} inchangé(s), {len(todo)} à traiter")
+
+    # --- Extraction + nettoyage en parallèle (un fichier par tâche) ---
+    if workers > 1 and len(todo) > 1:
+        # "spawn" : pas de fork du runtime LanceDB déjà démarré dans ce processus
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo)),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            extracted = list(pool.map(_extract, todo))
+    else:
+        extracted = [_extract(item) for item in todo]
+
+    records, deletes, rehashed = [], [], []
+    for name, (path, digest, pages) in zip(names, extracted):
+        known = state.get(name, {}).get("pages", {})
+        changed = [p for p in pages if known.get(p["page"]) != p["page_hash"]]
+        removed = set(known) - {p["page"] for p in pages}
+        stale = [p["page"] for p in changed if p["page"] in known] + sorted(removed)
+        if stale:
+            deletes.append(f"source_file = {_quote(name)} AND page IN ({', '.join(map(str, stale))})")
+        if known and len(changed) < len(pages):
+            # Pages inchangées : seul le hash du fichier est à mettre à jour
+            rehashed.append((f"source_file = {_quote(name)}", digest))
+        stats["pages_updated"] += len(changed)
+        stats["pages_deleted"] += len(removed)
+        for p in changed:
+            for i, c in enumerate(chunk_text(p["text"], p["page"], p["section"], chunk_size, overlap)):
+                records.append({**c, "source_file": name, "chunk_index": i,
+                                "page_hash": p["page_hash"], "file_hash": digest})
+
+    if prune and table is not None:
+        for name in set(state) - set(paths):
+            deletes.append(f"source_file = {_quote(name)}")
+            stats["pages_deleted"] += len(state[name]["pages"])
+
+    # --- Encodage par batchs ---
+    if records:
+        model = model or SentenceTransformer(model_name)
+        embeddings = encode_texts(model, [r["chunk"] for r in records], batch_size)
+        schema = chunk_schema(embeddings.shape[1])
+        data = pa.Table.from_arrays(
+            [pa.array([r[f.name] for r in records], type=f.type) for f in schema if f.name != VECTOR_COLUMN]
+            + [_vector_array(embeddings)],
+            schema=schema,
+        )
+        stats["chunks_added"] = len(records)
+
+    # --- Upsert : suppression des pages obsolètes puis ajout des nouveaux chunks ---
+    if table is not None:
+        for where in deletes:
+            table.delete(where)
+        for where, digest in rehashed:
+            table.update(where=where, values={"file_hash": digest})
+        if records:
+            table.add(data)
+    elif records:
+        table = db.create_table(table_name, data=data)
+
+    stats["elapsed_s"] = time.perf_counter() - start
+    print(f"✅ {stats['pages_updated']} page(s) mises à jour, {stats['pages_deleted']} supprimée(s), "
+          f"{stats['chunks_added']} chunks encodés en {stats['elapsed_s']:.1f}s")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Indexe (de façon incrémentale) des PDF de règlement dans LanceDB.")
+    parser.add_argument("inputs", nargs="+", help="Fichiers PDF et/ou dossiers")
+    parser.add_argument("--db", default=DB_PATH, help="Dossier LanceDB")
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processus d'extraction")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Taille de batch pour l'encodage")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Caractères par chunk")
+    parser.add_argument("--overlap", type=int, default=OVERLAP, help="Caractères repris du chunk précédent")
+    parser.add_argument("--prune", action="store_true", help="Supprime les fichiers indexés absents des entrées")
+    parser.add_argument("--query", help="Exemple de recherche après l'indexation")
+    args = parser.parse_args()
+
+    model = SentenceTransformer(args.model)
+    ingest_pdfs(
+        args.inputs,
+        db_path=args.db,
+        table_name=args.table,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        overlap=args.overlap,
+        prune=args.prune,
+        model=model,
+    )
+
+    if args.query:
+        # --- Exemple de recherche ---
+        table = lancedb.connect(args.db).open_table(args.table)
+        results = (
+            table.search(model.encode(args.query), vector_column_name=VECTOR_COLUMN)
+                 .limit(5)
+                 .to_pandas()
+        )
+        print("\n🔍 Résultats similaires :")
+        for _, row in results.iterrows():
+            print(f"\n— {row['section']} ({row['source_file']}, p.{int(row['page'])})")
+            print(row["chunk"][:600] + ("…" if len(row["chunk"]) > 600 else ""))
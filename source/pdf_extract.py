@@ -0,0 +1,103 @@
+import hashlib
+import re
+
+from pypdf import PdfReader
+
+# Extraction et découpage des PDF (pypdf seulement, sans LanceDB ni modèle).
+# Utilisé par les processus d'extraction de source/pdf_embedding.py
+
+# Chunk ~500 caractères avec overlap 150 pour du FR/longs articles
+CHUNK_SIZE = 500
+OVERLAP = 150
+
+
+def clean_text(t: str) -> str:
+    # Nettoyage léger : espaces, sauts de lignes multiples, hyphens de césure, etc.
+    t = re.sub(r"-\n", "", t)                 # casse mots coupés par césure
+    t = re.sub(r"\s+\n", "\n", t)
+    t = re.sub(r"\n{2,}", "\n\n", t)
+    t = re.sub(r"[ \t]{2,}", " ", t)
+    return t.strip()
+
+
+# Heuristique simple pour détecter des en-têtes/sections (Préambule, Article X, etc.)
+SECTION_PAT = re.compile(r"^(Préambule|Article\s+\d+[^:\n]*|ANNEXE\s*\d+)", re.IGNORECASE)
+
+
+def annotate_sections(pages):
+    current_section = "Document"
+    annotated = []
+    for p in pages:
+        # Cherche un titre de section au début de la page
+        first_lines = p["text"].splitlines()[:12]
+        section_found = None
+        for line in first_lines:
+            m = SECTION_PAT.match(line.strip())
+            if m:
+                section_found = m.group(0).strip()
+                break
+        if section_found:
+            current_section = section_found
+        annotated.append({**p, "section": current_section})
+    return annotated
+
+
+def chunk_text(text, page, section, size=CHUNK_SIZE, overlap=OVERLAP):
+    text = text.strip()
+    if not text:
+        return []
+    chunks = []
+    start = 0
+    n = len(text)
+    while start < n:
+        end = min(start + size, n)
+        # Essaie de couper sur un séparateur "propre" si possible
+        slice_ = text[start:end]
+        if end < n:
+            # recule jusqu'au dernier point/fin de ligne pour éviter de couper une phrase
+            cut = max(slice_.rfind("\n"), slice_.rfind(". "))
+            if cut != -1 and cut > size * 0.5:
+                end = start + cut + 1
+                slice_ = text[start:end]
+        chunks.append({
+            "page": page,
+            "section": section,
+            "chunk": slice_.strip()
+        })
+        if end >= n:
+            break
+        # Le chunk suivant reprend les `overlap` derniers caractères (en avançant toujours d'au moins 1)
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def extract_pdf(path: str) -> list:
+    """
+    Extract, clean and section-annotate every page of one PDF.
+
+    Runs in a worker process, so it only takes and returns plain data.
+
+    Returns:
+        list: One dict per page (page, text, section, page_hash).
+    """
+    reader = PdfReader(path)
+    pages = [{"page": i, "text": clean_text(page.extract_text() or "")}
+             for i, page in enumerate(reader.pages, start=1)]
+    pages = annotate_sections(pages)
+    for p in pages:
+        # La section d'une page dépend des pages précédentes : elle fait partie du hash
+        p["page_hash"] = hashlib.sha256(f"{p['section']}\n{p['text']}".encode("utf-8")).hexdigest()
+    return pages
+
+
+def _extract(args):
+    path, digest = args
+    return path, digest, extract_pdf(path)
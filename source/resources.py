@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+# Charger .env local si présent (optionnel)
+load_dotenv()
+
+MODEL_NAME = "intfloat/multilingual-e5-base"
+DB_PATH = "lancedb_questions"
+TABLE_NAME = "qa_table"
+LLM_MODEL_ID = "mistralai/mistral-medium-2505"
+
+# Une seule instance par processus, partagée par toutes les sessions Streamlit
+_resources = {}
+_locks = {name: threading.Lock() for name in ("encoder", "db", "table", "index_config", "query_prefix", "language_id", "exact_index", "llm", "warm_up")}
+_process_start = time.perf_counter()
+_warmup_thread = None
+
+# Temps de chargement (secondes) de chaque ressource + latence de la première question
+load_timings = {}
+first_query_s = None
+
+
+def _get(name: str, factory):
+    """Build the resource `name` on first use (thread-safe), then always return the same instance."""
+    if name in _resources:
+        return _resources[name]
+    with _locks[name]:
+        if name not in _resources:
+            start = time.perf_counter()
+            _resources[name] = factory()
+            load_timings[name] = time.perf_counter() - start
+            print(f"⚙️  {name} chargé en {load_timings[name]:.2f}s")
+    return _resources[name]
+
+
+def _get_current(name: str, factory):
+    """
+    Like `_get`, but rebuilt when `qa_table` gets a new version (checked at most
+    every VERSION_CHECK_S, as for the exact index).
+    """
+    from source.exact_search import VERSION_CHECK_S
+    entry = _resources.get(name)
+    now = time.monotonic()
+    if entry is not None and now - entry["checked_at"] < VERSION_CHECK_S:
+        return entry["value"]
+    with _locks[name]:
+        version = get_table_version()
+        entry = _resources.get(name)
+        if entry is None or entry["version"] != version:
+            start = time.perf_counter()
+            value = factory()
+            if entry is None:
+                load_timings[name] = time.perf_counter() - start
+                print(f"⚙️  {name} chargé en {load_timings[name]:.2f}s")
+            else:
+                print(f"♻️  qa_table v{entry['version']} -> v{version} : {name} rechargé")
+            entry = _resources[name] = {"version": version, "value": value}
+        entry["checked_at"] = now
+    return entry["value"]
+
+
+def _load_encoder():
+    # Backend choisi par ENCODER_BACKEND (torch | onnx | onnx-int8), voir source/encoder.py
+    from source.encoder import load_encoder
+    return load_encoder(MODEL_NAME)
+
+
+def _load_db():
+    import lancedb
+    return lancedb.connect(DB_PATH)
+
+
+def _load_index_config():
+    from source.vector_index import VECTOR_COLUMN, load_index_config
+    # Seulement si l'index existe vraiment (une reconstruction avec load_QA le supprime)
+    if not any(VECTOR_COLUMN in idx.columns for idx in get_table().list_indices()):
+        return {}
+    return load_index_config(DB_PATH)
+
+
+def _load_llm():
+    from ibm_watsonx_ai import Credentials
+    from ibm_watsonx_ai.foundation_models import ModelInference
+
+    # --- IBM Watsonx credentials (lues depuis les variables d'environnement) ---
+    api_key = os.getenv("API_KEY")
+    project_id = os.getenv("PROJECT_ID")
+    region = os.getenv("REGION", "eu-de")  # valeur par défaut si souhaitée
+    if not api_key or not project_id:
+        raise RuntimeError(
+            "Missing IBM Watsonx credentials. Set API_KEY and PROJECT_ID in your environment."
+        )
+
+    creds = Credentials(
+        url=f"https://{region}.ml.cloud.ibm.com",
+        api_key=api_key
+    )
+    return ModelInference(
+        model_id=LLM_MODEL_ID,
+        credentials=creds,
+        project_id=project_id
+    )
+
+
+def get_encoder():
+    """Shared SentenceTransformer query encoder."""
+    return _get("encoder", _load_encoder)
+
+
+def get_query_prefix() -> str:
+    """e5 prefix for user questions: "query: " if `qa_table` was indexed with prefixes, else "" (reloaded when the table changes)."""
+    from source.encoder import QUERY_PREFIX, table_uses_prefixes
+    # Suit les reconstructions de qa_table (load_QA, maintenance) sans redémarrage
+    return _get_current("query_prefix", lambda: QUERY_PREFIX if table_uses_prefixes(get_table()) else "")
+
+
+def get_language_identifier():
+    """Shared language identifier (backend chosen by LANGUAGE_ID_BACKEND, see source/language_id.py)."""
+    from source.language_id import build_identifier
+    return _get("language_id", build_identifier)
+
+
+def get_db():
+    """Shared LanceDB connection."""
+    return _get("db", _load_db)
+
+
+def get_table():
+    """Shared handle on `qa_table`."""
+    return _get("table", lambda: get_db().open_table(TABLE_NAME))
+
+
+def get_table_version() -> int:
+    """Latest committed version of `qa_table` on disk (changes whenever the table is rebuilt)."""
+    # Le handle partagé suit la dernière version (les reconstructions écrasent la table en mode "overwrite")
+    table = get_table()
+    table.checkout_latest()
+    return table.version
+
+
+def get_index_config() -> dict:
+    """Tuned ANN search parameters for `qa_table` ({} when searching without index), reloaded when the table changes."""
+    return _get_current("index_config", _load_index_config)
+
+
+def _load_exact_index():
+    from source.exact_search import load_exact_index
+    # Handle partagé ramené à la dernière version avant l'export
+    get_table_version()
+    return load_exact_index(get_table())
+
+
+def get_exact_index():
+    """In-memory exact-search index of `qa_table` (RETRIEVAL_ENGINE=numpy), reloaded when the table changes."""
+    index = _get("exact_index", _load_exact_index)
+    if not index.is_current(get_table_version):
+        with _locks["exact_index"]:
+            if _resources["exact_index"] is index:
+                _resources["exact_index"] = _load_exact_index()
+                print(f"♻️  qa_table v{index.version} -> v{_resources['exact_index'].version} : index exact rechargé")
+        index = _resources["exact_index"]
+    return index
+
+
+def get_llm():
+    """Shared watsonx ModelInference client."""
+    return _get("llm", _load_llm)
+
+
+def set_llm(client):
+    """Replace the watsonx client (e.g. by a local stand-in for benchmarks)."""
+    _resources["llm"] = client
+
+
+def set_encoder(encoder):
+    """Replace the query encoder (any object with a SentenceTransformer-like `encode`)."""
+    _resources["encoder"] = encoder
+
+
+def warm_up(background: bool = True, llm: bool = True):
+    """
+    Load the encoder, the table and (optionally) the LLM client ahead of the first question.
+
+    Idempotent: calling it on every Streamlit rerun only starts one warm-up per process.
+
+    Returns:
+        threading.Thread | None: The warm-up thread when `background` is True.
+    """
+    global _warmup_thread
+
+    def _run():
+        from source.exact_search import RETRIEVAL_ENGINE
+
+        start = time.perf_counter()
+        get_table()
+        get_index_config()
+        if RETRIEVAL_ENGINE == "numpy":
+            get_exact_index()
+        get_language_identifier()
+        # Un premier encode initialise les poids et les buffers du modèle
+        get_encoder().encode(get_query_prefix() + "warm-up")
+        if llm:
+            try:
+                get_llm()
+            except RuntimeError as e:
+                print(f"⚠️  LLM non initialisé : {e}")
+        load_timings["warm_up"] = time.perf_counter() - start
+        print(f"🔥 Warm-up terminé en {load_timings['warm_up']:.2f}s")
+
+    if not background:
+        _run()
+        return None
+    with _locks["warm_up"]:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_run, name="resources-warm-up", daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+
+def record_query_latency(seconds: float):
+    """Keep the latency of the first question answered by this process."""
+    global first_query_s
+    if first_query_s is None:
+        first_query_s = seconds
+        print(f"⏱️  Première question traitée en {seconds:.2f}s "
+              f"({time.perf_counter() - _process_start:.2f}s après le démarrage)")
+
+
+def startup_report() -> dict:
+    """Cold-start figures: per-resource load times, warm-up duration and first-query latency."""
+    return {
+        "uptime_s": time.perf_counter() - _process_start,
+        "load_timings_s": dict(load_timings),
+        "first_query_s": first_query_s,
+    }
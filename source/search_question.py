@@ -27,14 +27,67 @@
 #         print("-" * 80)
 
 
-import lancedb
-from sentence_transformers import SentenceTransformer
+import logging
+import os
+
 import pandas as pd
 
-# --- Connect to the LanceDB database and load the model ---
-db = lancedb.connect("lancedb_questions")
-table = db.open_table("qa_table")
-model = SentenceTransformer("intfloat/multilingual-e5-base")
+from source.embedding_cache import QueryEmbeddingCache
+from source.encode_batcher import EncodeBatcher
+from source.filters import build_where
+from source.instrumentation import metrics, observe_distances, sampled, span
+from source.encoder import ENCODER_BACKEND
+from source.exact_search import RETRIEVAL_ENGINE
+from source.resources import MODEL_NAME, get_encoder, get_exact_index, get_index_config, get_query_prefix, get_table
+from source.vector_index import VECTOR_COLUMN, apply_index_config
+
+# The encoder, the LanceDB table and the tuned index config are loaded lazily,
+# once per process, by source.resources
+
+logger = logging.getLogger(__name__)
+
+# --- Query embedding cache (LRU in memory, optionally persisted on disk) ---
+# QUERY_CACHE_PATH=query_cache.sqlite keeps the embeddings across restarts
+query_cache = QueryEmbeddingCache(
+    f"{MODEL_NAME}@{ENCODER_BACKEND}",
+    max_size=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+    persist_path=os.getenv("QUERY_CACHE_PATH"),
+)
+metrics.register_collector("helpai_query_cache", query_cache.stats)
+
+# --- Micro-batching : les questions concurrentes partagent un même appel à encode() ---
+# (ENCODE_BATCH_MAX / ENCODE_BATCH_WAIT_MS, voir source/encode_batcher.py)
+encode_batcher = EncodeBatcher(lambda texts: get_encoder().encode(texts, batch_size=len(texts)))
+metrics.register_collector("helpai_encode_batcher", encode_batcher.stats)
+
+RESULT_COLUMNS = ["question", "answer", "ecole", "langue", "_distance"]
+
+
+def embed_question(question: str):
+    """Embedding of `question` (served from the query cache when possible)."""
+    with span("encode") as rec:
+        rec["cached"] = True
+
+        def encode(text):
+            rec["cached"] = False
+            return encode_batcher.encode(text, stats=rec)
+
+        # Le préfixe e5 fait partie de la clé : pas de mélange si la table est ré-indexée
+        return query_cache.get_or_encode(get_query_prefix() + question, encode)
+
+
+def embed_questions(questions: list) -> list:
+    """Embeddings of several questions: cache misses are encoded in a single call."""
+    with span("encode", questions=len(questions)) as rec:
+        texts = [get_query_prefix() + q for q in questions]
+        vectors = [query_cache.get(t) for t in texts]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            encoded = get_encoder().encode([texts[i] for i in missing], batch_size=len(missing))
+            for i, vector in zip(missing, encoded):
+                vectors[i] = query_cache.put(texts[i], vector)
+        rec["cached"] = len(questions) - len(missing)
+        return vectors
 
 
 def search_question(question: str, school: str, language: str, top_k: int = 3):
@@ -44,41 +97,105 @@ def search_question(question: str, school: str, language: str, top_k: int = 3):
     Args:
         question (str): User question.
         school (str): School name (e.g., 'esilv', 'emlv').
+        language (str): Language label (e.g., 'Français', 'English').
         top_k (int): Number of results to return (default = 3).
 
     Returns:
-        pd.DataFrame: The top_k matching question/answer pairs.
+        pd.DataFrame: The top_k matching question/answer pairs (with their `_distance`).
     """
-    # Encode the query
-    query_vec = model.encode(question)
+    # Encode the query (cache hits skip the encoder)
+    query_vec = embed_question(question)
+    return search_by_vector(query_vec, school, language, top_k)
 
-    # Retrieve the 20 most similar questions
-    results = table.search(query_vec, vector_column_name="question_embedding").limit(30).to_pandas()
 
-    # Filter results by school (the column contains strings like "esilv,emlv")
-    mask = results["ecole"].str.lower().str.contains(school.lower())
-    filtered = results[mask].head(top_k)
+def search_questions(questions: list, school: str, language: str, top_k: int = 3) -> list:
+    """
+    Bulk version of `search_question`: one encode call and one multi-vector
+    LanceDB search for all the questions (same school and language).
 
-    # Filter results by language (the column contains strings like "Français,Anglais")
-    mask = results["langue"].str.lower().str.contains(language.lower())
-    filtered = results[mask].head(top_k)
+    Returns:
+        list[pd.DataFrame | None]: The results of each question, in order.
+    """
+    if not questions:
+        return []
+    vectors = embed_questions(questions)
+    with span("vector_search", school=school, language=language, questions=len(questions),
+              engine=RETRIEVAL_ENGINE) as rec:
+        if RETRIEVAL_ENGINE == "numpy":
+            index = get_exact_index()
+            found = pd.concat([index.search(v, school, language, top_k).assign(query_index=i)
+                               for i, v in enumerate(vectors)], ignore_index=True)
+        else:
+            table = get_table()
+            query = apply_index_config(table.search(vectors, vector_column_name=VECTOR_COLUMN), get_index_config())
+            found = (
+                query
+                .where(build_where(school, language, table.schema.names), prefilter=True)
+                .select(RESULT_COLUMNS)
+                .limit(top_k)
+                .to_pandas()
+            )
+            if "query_index" not in found.columns:  # une seule question : recherche simple
+                found["query_index"] = 0
+        rec["rows"] = len(found)
+        if not found.empty:
+            observe_distances(found["_distance"])
+
+    results = []
+    for i in range(len(questions)):
+        rows = found[found["query_index"] == i]
+        if rows.empty:
+            metrics.inc("helpai_retrieval_empty", school=school)
+            results.append(None)
+        else:
+            results.append(rows[RESULT_COLUMNS].reset_index(drop=True))
+    return results
+
+
+def search_by_vector(query_vec, school: str, language: str, top_k: int = 3):
+    """
+    Same as `search_question`, for an already encoded question.
+
+    Returns:
+        pd.DataFrame | None: The top_k matching rows, or None when nothing matches.
+    """
+    # Retrieve the top_k most similar questions, pre-filtered by school and language
+    # (the filter runs inside LanceDB on the indexed ecoles / langue_code columns,
+    # or on precomputed row masks with RETRIEVAL_ENGINE=numpy)
+    with span("vector_search", school=school, language=language, engine=RETRIEVAL_ENGINE) as rec:
+        if RETRIEVAL_ENGINE == "numpy":
+            filtered = get_exact_index().search(query_vec, school, language, top_k)
+        else:
+            table = get_table()
+            query = apply_index_config(table.search(query_vec, vector_column_name=VECTOR_COLUMN), get_index_config())
+            filtered = (
+                query
+                .where(build_where(school, language, table.schema.names), prefilter=True)
+                .select(RESULT_COLUMNS)
+                .limit(top_k)
+                .to_pandas()
+            )
+        rec["rows"] = len(filtered)
+        if not filtered.empty:
+            rec["min_distance"] = float(filtered["_distance"].min())
+            observe_distances(filtered["_distance"])
 
     if filtered.empty:
-        print(f"❌ No results found for school '{school}'.")
+        metrics.inc("helpai_retrieval_empty", school=school)
+        logger.info("No results found for school '%s' (%s).", school, language)
         return None
 
-    print(f"\n🔍 Top {top_k} relevant results for '{school}':\n")
-    for i, row in filtered.iterrows():
-        print(f"🧠 Similar Question {i+1}: {row['question']}")
-        print(f"💬 Answer: {row['answer']}")
-        print(f"🏫 School(s): {row['ecole']} | 🌍 Language: {row['langue']}")
-        print("-" * 80)
+    # Détail des lignes retrouvées : seulement pour un échantillon de requêtes
+    if sampled() and logger.isEnabledFor(logging.DEBUG):
+        for i, row in filtered.iterrows():
+            logger.debug("Similar question %d (d=%.3f): %s | school(s): %s | language: %s",
+                         i + 1, row["_distance"], row["question"], row["ecole"], row["langue"])
 
-    return filtered[['question', 'answer', 'ecole', 'langue']]
+    return filtered[RESULT_COLUMNS]
 
 
 # --- Example usage ---
 if __name__ == "__main__":
     q = "How many absences are allowed ?"
     s = "esilv"
-    df_res = search_question(q, s)
+    df_res = search_question(q, s, "English")
@@ -0,0 +1,258 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from source import resources
+from source.assistant import detect_language, school_assistant, school_assistant_stream
+from source.instrumentation import metrics
+from source.search_question import search_question
+from source.service_client import OUTCOME_SEPARATOR
+from source.telemetry import telemetry
+
+# --- Configuration du service ---
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8600"))
+# Requêtes traitées en parallèle (threads) et requêtes acceptées en attente au-delà
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "8"))
+SERVICE_MAX_PENDING = int(os.getenv("SERVICE_MAX_PENDING", "32"))
+# Temps laissé aux requêtes en cours pour se terminer à l'arrêt (SIGTERM / Ctrl+C)
+SERVICE_DRAIN_TIMEOUT = float(os.getenv("SERVICE_DRAIN_TIMEOUT", "30"))
+
+logger = logging.getLogger(__name__)
+
+_OVERLOADED = b'{"error": "overloaded"}'
+_REJECTED = (b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Type: application/json\r\n"
+             b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(_OVERLOADED), _OVERLOADED))
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server whose requests run on a fixed worker pool.
+
+    At most `workers + max_pending` requests are admitted; beyond that the
+    connection gets an immediate 503 instead of piling up threads.
+    """
+
+    def __init__(self, address, handler, workers: int = SERVICE_WORKERS, max_pending: int = SERVICE_MAX_PENDING):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="service-worker")
+        self.capacity = workers + max_pending
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.in_flight = 0
+        self.draining = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def process_request(self, request, client_address):
+        if self.draining or not self.slots.acquire(blocking=False):
+            metrics.inc("helpai_service_rejected")
+            try:
+                request.sendall(_REJECTED)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        with self._lock:
+            self.in_flight += 1
+        self.pool.submit(self._work, request, client_address)
+
+    def _work(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+            with self._lock:
+                self.in_flight -= 1
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Wait until no request is in flight. Returns False if `timeout` expired first."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+
+class AssistantHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 pour le chunked (streaming), mais une requête par connexion :
+    # une connexion keep-alive inactive bloquerait un worker du pool
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s - %s", self.address_string(), fmt % args)
+
+    # --- Réponses ---
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = True
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            raise BadRequest(f"invalid JSON: {e}")
+        for field in ("question", "school"):
+            if not isinstance(payload.get(field), str) or not payload[field].strip():
+                raise BadRequest(f"'{field}' is required")
+        return payload
+
+    # --- Routes ---
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/healthz":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/readyz":
+            ready = "warm_up" in resources.load_timings and not self.server.draining
+            self._send_json(200 if ready else 503, {
+                "ready": ready,
+                "draining": self.server.draining,
+                "in_flight": self.server.in_flight,
+                **resources.startup_report(),
+            })
+        elif path == "/metrics":
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+            self.close_connection = True
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        routes = {"/search": self._search, "/answer": self._answer, "/answer/stream": self._answer_stream}
+        if path not in routes:
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            payload = self._read_json()
+            metrics.inc("helpai_service_requests", route=path)
+            routes[path](payload)
+        except BadRequest as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            logger.exception("Request %s failed", path)
+            self._send_json(500, {"error": type(e).__name__})
+
+    def _search(self, payload: dict):
+        question = payload["question"]
+        language = payload.get("language") or detect_language(question)
+        rows = search_question(question, payload["school"], language, int(payload.get("top_k", 3)))
+        records = [] if rows is None else rows.to_dict(orient="records")
+        self._send_json(200, {"language": language, "results": records})
+
+    def _answer(self, payload: dict):
+        answer = school_assistant(payload["question"], payload["school"], payload.get("chat_history") or [],
+                                  session_id=payload.get("session_id"))
+        self._send_json(200, {"answer": answer})
+
+    def _answer_stream(self, payload: dict):
+        timings = {}
+        stream = school_assistant_stream(payload["question"], payload["school"], payload.get("chat_history") or [],
+                                         timings=timings, session_id=payload.get("session_id"))
+        # Le premier chunk est calculé avant les en-têtes : une erreur en amont donne encore un 500
+        first = next(stream, "")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            self._write_chunk(first)
+            for chunk in stream:
+                self._write_chunk(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client disconnected during the stream")
+            stream.close()
+            return
+        except Exception:
+            # En-têtes déjà envoyés : on coupe le flux, le client voit une réponse tronquée (sans issue)
+            logger.exception("Stream failed")
+        else:
+            if payload.get("outcome"):
+                # Issue de la requête (cache, LLM indisponible) après le texte, derrière un séparateur
+                outcome = {"cached": bool(timings.get("cached")), "unavailable": timings.get("unavailable")}
+                self._write_chunk(OUTCOME_SEPARATOR + json.dumps(outcome))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        if data:
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+
+def serve(host: str = SERVICE_HOST, port: int = SERVICE_PORT, workers: int = SERVICE_WORKERS,
+          max_pending: int = SERVICE_MAX_PENDING, drain_timeout: float = SERVICE_DRAIN_TIMEOUT):
+    """
+    Run the assistant service until SIGTERM / SIGINT, then drain gracefully:
+    readiness turns to 503, new connections are refused, in-flight requests get
+    `drain_timeout` seconds to finish and telemetry is flushed.
+    """
+    server = PooledHTTPServer((host, port), AssistantHandler, workers, max_pending)
+    metrics.register_collector("helpai_service", lambda: {"in_flight": server.in_flight, "capacity": server.capacity})
+
+    def _stop(signum, frame):
+        if server.draining:
+            return
+        print(f"🛑 Signal {signal.Signals(signum).name} : arrêt après les requêtes en cours (max {drain_timeout:.0f}s)")
+        server.draining = True
+        # shutdown() attend la fin de serve_forever : jamais depuis le thread qui l'exécute
+        threading.Thread(target=server.shutdown, name="service-shutdown", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    # Encodeur, table et client watsonx chargés une fois, avant la première requête
+    resources.warm_up(background=True)
+    print(f"🚀 Service sur http://{host}:{port} ({workers} workers, {max_pending} requêtes en attente max)")
+    try:
+        server.serve_forever()
+    finally:
+        if not server.wait_idle(drain_timeout):
+            print(f"⚠️  {server.in_flight} requête(s) interrompue(s) après {drain_timeout:.0f}s")
+        server.pool.shutdown(wait=False, cancel_futures=True)
+        server.server_close()
+        telemetry.close()
+        print("👋 Service arrêté.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service HTTP partagé (recherche + assistant) pour les instances Streamlit.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=SERVICE_MAX_PENDING)
+    parser.add_argument("--drain-timeout", type=float, default=SERVICE_DRAIN_TIMEOUT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    serve(args.host, args.port, args.workers, args.max_pending, args.drain_timeout)
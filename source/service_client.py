@@ -0,0 +1,115 @@
+import codecs
+import http.client
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+# Adresse du service partagé (python -m source.service)
+ASSISTANT_SERVICE_URL = os.getenv("ASSISTANT_SERVICE_URL")
+SERVICE_TIMEOUT = float(os.getenv("SERVICE_TIMEOUT", "60"))
+# Séparateur (ASCII record separator) avant l'issue JSON envoyée en fin de /answer/stream
+# quand la requête contient "outcome": true
+OUTCOME_SEPARATOR = "\x1e"
+
+
+class ServiceUnavailable(RuntimeError):
+    """The assistant service could not be reached or refused the request (overloaded, draining)."""
+
+
+class ServiceClient:
+    """
+    Thin HTTP client of source/service.py, with the same call signatures as
+    `school_assistant` / `school_assistant_stream` so that app.py can use either.
+    """
+
+    def __init__(self, base_url: str = ASSISTANT_SERVICE_URL, timeout: float = SERVICE_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, path: str, payload: dict = None):
+        data = None if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(self.base_url + path, data=data,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 503:
+                raise ServiceUnavailable(f"{path}: service overloaded or shutting down") from e
+            detail = e.read().decode("utf-8", "replace")
+            raise RuntimeError(f"{path}: HTTP {e.code} {detail}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise ServiceUnavailable(f"{path}: {e}") from e
+
+    def _post_json(self, path: str, payload: dict) -> dict:
+        with self._open(path, payload) as response:
+            try:
+                return json.loads(response.read())
+            except (http.client.HTTPException, OSError, ValueError) as e:
+                # Délai dépassé, connexion coupée ou réponse tronquée (service redémarré)
+                raise ServiceUnavailable(f"{path}: {type(e).__name__} {e}") from e
+
+    @staticmethod
+    def _history(chat_history):
+        # Seuls role / content sont utiles au service
+        return [{"role": m.get("role"), "content": m.get("content", "")} for m in (chat_history or [])]
+
+    def answer(self, question: str, school: str, chat_history=None, session_id: str = None) -> str:
+        payload = {"question": question, "school": school, "chat_history": self._history(chat_history),
+                   "session_id": session_id}
+        return self._post_json("/answer", payload)["answer"]
+
+    def answer_stream(self, question: str, school: str, chat_history=None, timings: dict = None,
+                      session_id: str = None):
+        """
+        Yield the answer as it is generated.
+
+        Fills `timings` with ttft_s / total_s and, from the outcome the service
+        sends after the text, `cached` (bool) and `unavailable` (None or the
+        gateway outcome). Both stay absent if the stream was cut before it.
+        """
+        start = time.perf_counter()
+        timings = timings if timings is not None else {}
+        payload = {"question": question, "school": school, "chat_history": self._history(chat_history),
+                   "session_id": session_id, "outcome": True}
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        outcome = None
+        with self._open("/answer/stream", payload) as response:
+            try:
+                # read1 rend chaque chunk dès qu'il arrive (le décodage chunked est fait par http.client)
+                for data in iter(lambda: response.read1(4096), b""):
+                    text = decoder.decode(data)
+                    if outcome is not None:
+                        outcome += text
+                        continue
+                    text, separator, rest = text.partition(OUTCOME_SEPARATOR)
+                    if separator:
+                        outcome = rest
+                    if text:
+                        timings.setdefault("ttft_s", time.perf_counter() - start)
+                        yield text
+            except (http.client.HTTPException, OSError) as e:
+                # Délai dépassé ou flux coupé en cours de réponse (service bloqué ou redémarré)
+                raise ServiceUnavailable(f"/answer/stream: {type(e).__name__} {e}") from e
+        tail = decoder.decode(b"", final=True)
+        if outcome is not None:
+            try:
+                timings.update(json.loads(outcome + tail))
+            except (TypeError, ValueError):
+                # Issue tronquée : laissée absente, comme un flux coupé avant elle
+                pass
+        elif tail:
+            yield tail
+        timings["total_s"] = time.perf_counter() - start
+
+    def search(self, question: str, school: str, language: str = None, top_k: int = 3) -> list:
+        payload = {"question": question, "school": school, "language": language, "top_k": top_k}
+        return self._post_json("/search", payload)["results"]
+
+    def ready(self) -> bool:
+        try:
+            with self._open("/readyz") as response:
+                return json.loads(response.read()).get("ready", False)
+        except (ServiceUnavailable, http.client.HTTPException, OSError, ValueError):
+            return False
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from source.instrumentation import metrics
+
+# Messages gardés dans st.session_state ; les plus anciens sont archivés ici
+CHAT_LIVE_MESSAGES = int(os.getenv("CHAT_LIVE_MESSAGES", "20"))
+# Messages affichés par clic sur "messages précédents"
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "20"))
+# Sessions Streamlit abandonnées : purge après inactivité, et nombre max de sessions archivées
+SESSION_STORE_TTL_S = float(os.getenv("SESSION_STORE_TTL_S", str(6 * 3600)))
+SESSION_STORE_MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", "1000"))
+
+
+def deep_sizeof(obj) -> int:
+    """Approximate memory footprint in bytes of nested dicts / lists / strings."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_sizeof(v) for v in obj)
+    return size
+
+
+class SessionStore:
+    """
+    Compact per-session archive of old chat messages, shared by every session of the process.
+
+    Messages are appended in blocks, each kept as zlib-compressed JSON, so a
+    page of old messages only decompresses the blocks it overlaps. Sessions
+    idle for more than `ttl_s`, or beyond `max_sessions` (least recently used
+    first), are dropped.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_STORE_MAX_SESSIONS, ttl_s: float = SESSION_STORE_TTL_S):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.evicted = 0
+        self._sessions = OrderedDict()  # session_id -> {"blocks": [(start, count, bytes)], "count", "touched"}
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session["touched"] < self.ttl_s:
+                break
+            del self._sessions[session_id]
+            self.evicted += 1
+
+    def _touch(self, session_id: str, create: bool = False):
+        session = self._sessions.get(session_id)
+        if session is None and create:
+            session = self._sessions[session_id] = {"blocks": [], "count": 0, "touched": 0.0}
+        if session is not None:
+            session["touched"] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def archive(self, session_id: str, messages: list):
+        """Append `messages` (oldest first) to the archive of `session_id`."""
+        if not messages:
+            return
+        blob = zlib.compress(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            session = self._touch(session_id, create=True)
+            session["blocks"].append((session["count"], len(messages), blob))
+            session["count"] += len(messages)
+            self._evict(time.monotonic())
+
+    def count(self, session_id: str) -> int:
+        """Number of archived messages of `session_id`."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session["count"] if session else 0
+
+    def load(self, session_id: str, start: int = 0, end: int = None) -> list:
+        """Archived messages `start:end` of `session_id`, oldest first."""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return []
+            end = session["count"] if end is None else min(end, session["count"])
+            blocks = [b for b in session["blocks"] if b[0] < end and b[0] + b[1] > start]
+        messages = []
+        for block_start, _, blob in blocks:
+            for i, message in enumerate(json.loads(zlib.decompress(blob)), block_start):
+                if start <= i < end:
+                    messages.append(message)
+        return messages
+
+    def drop(self, session_id: str):
+        """Forget the archive of `session_id` (new conversation)."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def session_bytes(self, session_id: str) -> int:
+        """Compressed size of the archive of `session_id`."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return sum(len(b[2]) for b in session["blocks"]) if session else 0
+
+    def stats(self) -> dict:
+        """Sessions, archived messages and compressed bytes held by the process."""
+        with self._lock:
+            self._evict(time.monotonic())
+            return {
+                "sessions": len(self._sessions),
+                "messages": sum(s["count"] for s in self._sessions.values()),
+                "compressed_bytes": sum(len(b[2]) for s in self._sessions.values() for b in s["blocks"]),
+                "evicted": self.evicted,
+            }
+
+
+session_store = SessionStore()
+metrics.register_collector("helpai_session_store", session_store.stats)
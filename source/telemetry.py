@@ -0,0 +1,132 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+TELEMETRY_PATH = os.getenv("TELEMETRY_PATH", os.path.join("logs", "assistant_telemetry.jsonl"))
+TELEMETRY_MAX_BYTES = int(os.getenv("TELEMETRY_MAX_BYTES", str(10 * 1024 * 1024)))
+TELEMETRY_BACKUPS = int(os.getenv("TELEMETRY_BACKUPS", "5"))
+
+_STOP = object()
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def token_usage(response: dict) -> dict:
+    """Token counts and stop reason from a watsonx `generate` response."""
+    result = (response or {}).get("results", [{}])[0]
+    return {
+        "input_tokens": result.get("input_token_count"),
+        "generated_tokens": result.get("generated_token_count"),
+        "stop_reason": result.get("stop_reason"),
+    }
+
+
+class TelemetryLog:
+    """
+    Append-only JSONL telemetry sink that never blocks the caller.
+
+    `emit()` only puts the record on a bounded queue (records are dropped and
+    counted if it is full). A daemon thread drains the queue, writes records in
+    batches (every `batch_size` records or `flush_interval_s` seconds) and
+    rotates the file once it exceeds `max_bytes` (path.1 ... path.N).
+    """
+
+    def __init__(self, path: str = TELEMETRY_PATH, max_bytes: int = TELEMETRY_MAX_BYTES,
+                 backups: int = TELEMETRY_BACKUPS, batch_size: int = 100,
+                 flush_interval_s: float = 1.0, queue_size: int = 10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+
+    def emit(self, record: dict):
+        """Queue one record (adds `ts` if missing). Never blocks."""
+        record.setdefault("ts", datetime.now().isoformat(timespec="milliseconds"))
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval_s
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._write(batch)
+                return
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval_s
+
+    def _write(self, batch: list):
+        if not batch:
+            return
+        data = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":"), default=str) + "\n" for r in batch)
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+            self.written += len(batch)
+        except OSError as e:
+            self.dropped += len(batch)
+            print(f"⚠️  Télémétrie non écrite : {e}")
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self, timeout: float = 5.0):
+        """Flush pending records and stop the writer thread."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            self.dropped += 1
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {"written": self.written, "dropped": self.dropped, "pending": self._queue.qsize()}
+
+
+# Sink partagé par tout le processus
+telemetry = TelemetryLog()
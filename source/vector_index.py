@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import lancedb
+from lancedb.index import IvfFlat, IvfHnswPq, IvfHnswSq, IvfPq, IvfSq
+
+DB_PATH = "lancedb_questions"
+TABLE_NAME = "qa_table"
+VECTOR_COLUMN = "question_embedding"
+# Fichier de config lu automatiquement par search_question
+CONFIG_FILE = "index_config.json"
+
+# --index-type -> configuration LanceDB de l'index (distance L2, comme la recherche exacte)
+INDEX_CONFIGS = {"IVF_FLAT": IvfFlat, "IVF_SQ": IvfSq, "IVF_PQ": IvfPq, "IVF_HNSW_SQ": IvfHnswSq, "IVF_HNSW_PQ": IvfHnswPq}
+
+
+def config_path(db_path: str = DB_PATH) -> str:
+    return os.path.join(db_path, CONFIG_FILE)
+
+
+def load_index_config(db_path: str = DB_PATH) -> dict:
+    """Return the tuned index config saved next to the database, or {} if there is none."""
+    path = config_path(db_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def apply_index_config(query, config: dict):
+    """Apply the tuned search parameters (nprobes, refine_factor) to a LanceDB vector query."""
+    if config.get("nprobes"):
+        query = query.nprobes(int(config["nprobes"]))
+    if config.get("refine_factor"):
+        query = query.refine_factor(int(config["refine_factor"]))
+    return query
+
+
+def build_index(table, index_type: str = "IVF_PQ", num_partitions: int = 16, num_sub_vectors: int = 48,
+                vector_column: str = VECTOR_COLUMN):
+    """(Re)build the ANN index on `vector_column`, replacing any existing one."""
+    start = time.perf_counter()
+    params = {"distance_type": "l2", "num_partitions": num_partitions}
+    if "PQ" in index_type:
+        params["num_sub_vectors"] = num_sub_vectors
+    table.create_index(vector_column, config=INDEX_CONFIGS[index_type](**params), replace=True)
+    return time.perf_counter() - start
+
+
+def sample_queries(table, n: int, vector_column: str = VECTOR_COLUMN, seed: int = 0) -> np.ndarray:
+    """Pick `n` stored embeddings (with a little noise) to use as benchmark queries."""
+    column = table.to_arrow().column(vector_column).combine_chunks()
+    vectors = column.flatten().to_numpy().reshape(len(column), -1).astype(np.float32)
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), size=min(n, len(vectors)), replace=False)]
+    # Bruit léger : les requêtes ne sont pas exactement des lignes de la table
+    noise = rng.normal(scale=0.01, size=picked.shape).astype(np.float32)
+    return picked + noise
+
+
+def run_queries(table, queries: np.ndarray, k: int, exact: bool = False, nprobes: int = None,
+                refine_factor: int = None, vector_column: str = VECTOR_COLUMN):
+    """
+    Run every query and collect the returned row ids and latencies.
+
+    Returns:
+        tuple: (list of row-id sets, np.ndarray of latencies in ms)
+    """
+    ids, latencies = [], []
+    for vec in queries:
+        query = table.search(vec, vector_column_name=vector_column).select([]).with_row_id(True).limit(k)
+        if exact:
+            query = query.bypass_vector_index()
+        else:
+            query = apply_index_config(query, {"nprobes": nprobes, "refine_factor": refine_factor})
+        start = time.perf_counter()
+        result = query.to_arrow()
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append(set(result.column("_rowid").to_pylist()))
+    return ids, np.array(latencies)
+
+
+def recall_at_k(truth: list, found: list) -> float:
+    hits = sum(len(t & f) for t, f in zip(truth, found))
+    total = sum(len(t) for t in truth)
+    return hits / total if total else 0.0
+
+
+def tune(
+    db_path: str = DB_PATH,
+    table_name: str = TABLE_NAME,
+    index_type: str = "IVF_PQ",
+    partitions=(8, 16, 32),
+    nprobes=(1, 2, 4, 8, 16),
+    refine_factors=(None, 5, 10),
+    num_sub_vectors: int = 48,
+    k: int = 10,
+    n_queries: int = 100,
+    target_recall: float = 0.95,
+):
+    """
+    Sweep partitions x nprobes x refine_factor against an exact brute-force baseline,
+    rebuild the index with the best setting and save it to `index_config.json`.
+
+    The best setting is the fastest one (p50) reaching `target_recall`, or the one
+    with the highest recall if none does.
+
+    Returns:
+        dict: The saved config.
+    """
+    db = lancedb.connect(db_path)
+    table = db.open_table(table_name)
+    queries = sample_queries(table, n_queries)
+    n_rows = table.count_rows()
+
+    truth, exact_lat = run_queries(table, queries, k, exact=True)
+    print(f"📏 Brute force ({n_rows} lignes, {len(queries)} requêtes) : "
+          f"p50={np.percentile(exact_lat, 50):.2f}ms p95={np.percentile(exact_lat, 95):.2f}ms")
+
+    results = []
+    for n_part in partitions:
+        if n_part > n_rows:
+            continue
+        build_s = build_index(table, index_type, n_part, num_sub_vectors)
+        print(f"\n🏗️  {index_type} partitions={n_part} construit en {build_s:.2f}s")
+        for probes in nprobes:
+            if probes > n_part:
+                continue
+            for refine in refine_factors:
+                found, lat = run_queries(table, queries, k, nprobes=probes, refine_factor=refine)
+                row = {
+                    "num_partitions": n_part,
+                    "nprobes": probes,
+                    "refine_factor": refine,
+                    f"recall@{k}": recall_at_k(truth, found),
+                    "p50_ms": float(np.percentile(lat, 50)),
+                    "p95_ms": float(np.percentile(lat, 95)),
+                }
+                results.append(row)
+                print(f"   nprobes={probes:<3} refine={str(refine):<4} recall@{k}={row[f'recall@{k}']:.3f} "
+                      f"p50={row['p50_ms']:.2f}ms p95={row['p95_ms']:.2f}ms")
+
+    if not results:
+        raise ValueError(f"Table trop petite ({n_rows} lignes) pour les partitions demandées {partitions}")
+
+    good = [r for r in results if r[f"recall@{k}"] >= target_recall]
+    best = min(good, key=lambda r: r["p50_ms"]) if good else max(results, key=lambda r: r[f"recall@{k}"])
+
+    # Reconstruit l'index retenu (la dernière config balayée n'est pas forcément la meilleure)
+    build_index(table, index_type, best["num_partitions"], num_sub_vectors)
+    config = {
+        "vector_column": VECTOR_COLUMN,
+        "index_type": index_type,
+        "num_sub_vectors": num_sub_vectors if "PQ" in index_type else None,
+        **best,
+        "k": k,
+        "exact_p50_ms": float(np.percentile(exact_lat, 50)),
+        "exact_p95_ms": float(np.percentile(exact_lat, 95)),
+        "num_rows": n_rows,
+        "table_version": table.version,
+        "built_at": datetime.now().isoformat(),
+    }
+    with open(config_path(db_path), "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+
+    print(f"\n✅ Config retenue : partitions={best['num_partitions']} nprobes={best['nprobes']} "
+          f"refine={best['refine_factor']} recall@{k}={best[f'recall@{k}']:.3f} p50={best['p50_ms']:.2f}ms")
+    print(f"💾 Enregistrée dans {config_path(db_path)}")
+    return config
+
+
+def _int_list(value: str):
+    return tuple(int(v) for v in value.split(",") if v)
+
+
+def _refine_list(value: str):
+    return tuple(None if v in ("none", "0") else int(v) for v in value.lower().split(",") if v)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construit et règle l'index ANN de qa_table.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--index-type", default="IVF_PQ", choices=sorted(INDEX_CONFIGS))
+    parser.add_argument("--partitions", type=_int_list, default=(8, 16, 32), help="ex: 8,16,32")
+    parser.add_argument("--nprobes", type=_int_list, default=(1, 2, 4, 8, 16), help="ex: 1,4,16")
+    parser.add_argument("--refine", type=_refine_list, default=(None, 5, 10), help="ex: none,5,10")
+    parser.add_argument("--sub-vectors", type=int, default=48, help="Sous-vecteurs PQ (doit diviser la dimension)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--drop", action="store_true", help="Supprime l'index vectoriel et la config")
+    args = parser.parse_args()
+
+    if args.drop:
+        table = lancedb.connect(args.db).open_table(args.table)
+        for idx in table.list_indices():
+            if VECTOR_COLUMN in idx.columns:
+                table.drop_index(idx.name)
+        if os.path.exists(config_path(args.db)):
+            os.remove(config_path(args.db))
+        print("🗑️  Index vectoriel supprimé, retour à la recherche exacte.")
+    else:
+        tune(
+            db_path=args.db,
+            table_name=args.table,
+            index_type=args.index_type,
+            partitions=args.partitions,
+            nprobes=args.nprobes,
+            refine_factors=args.refine,
+            num_sub_vectors=args.sub_vectors,
+            k=args.k,
+            n_queries=args.queries,
+            target_recall=args.target_recall,
+        )
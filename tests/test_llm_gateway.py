@@ -0,0 +1,51 @@
+import asyncio
+import time
+import unittest
+
+from source.llm_gateway import LLMGateway, LLMTimeout
+
+
+class SlowClient:
+    """watsonx stand-in answering after `delay_s`."""
+
+    def __init__(self, delay_s: float):
+        self.delay_s = delay_s
+
+    def generate(self, prompt=None, params=None, **kwargs):
+        time.sleep(self.delay_s)
+        return {"results": [{"generated_text": prompt}]}
+
+    async def agenerate(self, prompt=None, params=None, **kwargs):
+        await asyncio.sleep(self.delay_s)
+        return {"results": [{"generated_text": prompt}]}
+
+
+class CancellationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancel_while_waiting_for_a_token_releases_the_slot(self):
+        gateway = LLMGateway(client_fn=lambda: SlowClient(0.01), rate_per_s=0.5, burst=1, queue_wait_s=5)
+        await gateway.agenerate("first")
+        waiting = asyncio.ensure_future(gateway.agenerate("second"))
+        await asyncio.sleep(0.1)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(gateway.stats()["active"], 0)
+
+
+class StalledUpstreamTest(unittest.TestCase):
+    def test_timed_out_calls_stop_counting_against_capacity(self):
+        client = SlowClient(1.0)
+        gateway = LLMGateway(client_fn=lambda: client, max_concurrency=1, max_queue=0, rate_per_s=0,
+                             timeout_s=0.1, max_abandoned=2)
+        with self.assertRaises(LLMTimeout):
+            gateway.generate("first")
+        stats = gateway.stats()
+        self.assertEqual((stats["active"], stats["abandoned_pending"]), (0, 1))
+        # Le slot est rendu : l'appel suivant est admis (il expire aussi), pas délesté
+        with self.assertRaises(LLMTimeout):
+            gateway.generate("second")
+        self.assertEqual(gateway.stats()["shed"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()